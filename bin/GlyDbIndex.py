@@ -23,12 +23,18 @@ for opt in glycosidase_options:
 glycosidase_options =glyopts
 
 if len(sys.argv) < 2:
-    print >>sys.stderr, "No command, use one of: build, force-build, dump, count, glycoct."
+    print >>sys.stderr, "No command, use one of: build, force-build, update, dump, count, glycoct."
     sys.exit(1)
 
-if sys.argv[1] == "build" or sys.argv[1] == "force-build":
+if sys.argv[1] in ("build","force-build","update"):
     force = (sys.argv[1] == "force-build")
+    update = (sys.argv[1] == "update")
     sys.argv.pop(1)
+    workers = 1
+    if len(sys.argv) > 2 and sys.argv[1] == "-j":
+        workers = int(sys.argv[2])
+        sys.argv.pop(1)
+        sys.argv.pop(1)
     filters = None
     modifier = None
     if len(sys.argv) > 1 and sys.argv[1] in glycosidase_options:
@@ -36,7 +42,7 @@ if sys.argv[1] == "build" or sys.argv[1] == "force-build":
         modifier = glycosidase_options[sys.argv[1]][0]
         sys.argv.pop(1)
     if len(sys.argv) <= 1:
-	print >>sys.stderr, "GlyDbIndex.py build [galactosidase-option] <database>.(gct|gdb|cfg)"
+	print >>sys.stderr, "GlyDbIndex.py (build|update) [ -j <workers> ] [galactosidase-option] <database>.(gct|gdb|cfg)"
         print >>sys.stderr, "\nGlycosidase options:\n  "+'\n  '.join(sorted(glycosidase_options))
 	sys.exit(1)
     if sys.argv[1].endswith('.gct'):
@@ -52,12 +58,20 @@ if sys.argv[1] == "build" or sys.argv[1] == "force-build":
 	    print >>sys.stderr, "GlyDbIndex.py build <database>.ctn <max-relative-demerits>"
 	    sys.exit(1)
         gdb = CartoonistDatabase(sys.argv[1],maxreldem=int(sys.argv[2]))
-    if modifier:
+    if update:
+        # new and changed records only, the index stays usable meanwhile
+        indexfile = gdb.filename + '.index'
+        if modifier:
+            sfn = gdb.filename.rsplit('.',1)
+            indexfile = sfn[0] + modifier + '.' + sfn[1] + '.index'
+        index = GlyDbIndex(indexfile,filters=filters)
+        index.update(gdb,workers=workers,verbose=True)
+    elif modifier:
 	sfn = gdb.filename.rsplit('.',1)
 	indexfile = sfn[0] + modifier + '.' + sfn[1] + '.index'
-        gdb = GlyDbIndex(gdb,force=force,filters=filters,indexfile=indexfile)
+        gdb = GlyDbIndex(gdb,force=force,filters=filters,indexfile=indexfile,workers=workers,verbose=True)
     else:
-        gdb = GlyDbIndex(gdb,force=force,filters=filters)
+        gdb = GlyDbIndex(gdb,force=force,filters=filters,workers=workers,verbose=True)
     # gdb.build()
 elif sys.argv[1] in ("dump","count","glycoct"):
     dump = False
@@ -61,19 +61,35 @@ class Composition(defaultdict):
     def count(self):
         return sum(c for e,c in self.items())
 
-class ResidueCompositionTable(dict):
+class CompositionTableBase(dict):
     def __init__(self):
+        super(CompositionTableBase,self).__init__()
+        self._residues = dict()
+    def new(self):
+        return Composition()
+    def residue_composition(self,m):
+        # m.composition(self), memoized by m's composition signature.
+        # The result is shared, do not modify it.
+        sig = m.composition_signature()
+        c = self._residues.get(sig)
+        if c == None:
+            c = m.composition(self)
+            self._residues[sig] = c
+        return c
+
+class ResidueCompositionTable(CompositionTableBase):
+    def __init__(self):
+        super(ResidueCompositionTable,self).__init__()
         consts = ConstantsTable()
         for sym,kv in consts.items():
             if 'ResidueComposition' in kv:
                 c = Composition()
                 c.parse(kv['ResidueComposition'])
                 self[sym] = c
-    def new(self):
-        return Composition()
 
-class PermethylCompositionTable(dict):
+class PermethylCompositionTable(CompositionTableBase):
     def __init__(self):
+        super(PermethylCompositionTable,self).__init__()
         consts = ConstantsTable()
         for sym,kv in consts.items():
             if 'PermethylComposition' in kv and 'ResidueComposition' in kv:
@@ -83,5 +99,3 @@ class PermethylCompositionTable(dict):
                 c1.parse(kv['PermethylComposition'])
                 c.add(c1)
                 self[sym] = c
-    def new(self):
-        return Composition()
@@ -6,10 +6,46 @@ import os, os.path, urllib, time
 import urllib2
 from collections import defaultdict
 import datetime
+import hashlib
+import multiprocessing
+import StringIO
+import array
+import cPickle as pickle
 
 import rdflib
 import json
 
+class ClosureIndex(object):
+
+    # Memoized transitive closure of a graph given by an adjacency
+    # function (children or parents). Computed iteratively on demand,
+    # only for the sub-DAG reachable from the nodes queried.
+
+    def __init__(self, adjacent):
+        self.adjacent = adjacent
+        self.closure = dict()
+
+    def __call__(self, accession):
+        if accession in self.closure:
+            return self.closure[accession]
+        todo = [(accession, False)]
+        while len(todo) > 0:
+            acc, expanded = todo.pop()
+            if acc in self.closure:
+                continue
+            if expanded:
+                reach = set()
+                for n in self.adjacent(acc):
+                    reach.add(n)
+                    reach.update(self.closure[n])
+                self.closure[acc] = frozenset(reach)
+            else:
+                todo.append((acc, True))
+                for n in self.adjacent(acc):
+                    if n not in self.closure:
+                        todo.append((n, False))
+        return self.closure[accession]
+
 class GNOmeAPI(object):
 
     # Base class for GNOme and subsumption API supported by both the
@@ -65,21 +101,32 @@ class GNOmeAPI(object):
             for c in self.children(n):
                 yield n,c
 
+    # Transitive closure indices, built once and discarded whenever
+    # the graph is modified (delete_node, set_parents)
+    _descendants_index = None
+    _ancestors_index = None
+
+    def invalidate_closure(self):
+        self._descendants_index = None
+        self._ancestors_index = None
+
     # Descendants of a node
     def descendants(self, accession):
-        desc = set()
-        for c in self.children(accession):
-            desc.add(c)
-            desc.update(self.descendants(c))
-        return desc
+        if self._descendants_index is None:
+            self._descendants_index = ClosureIndex(self.children)
+        return set(self._descendants_index(accession))
 
     # Ancestors of a node
     def ancestors(self, accession):
-        anc = set()
-        for p in self.parents(accession):
-            anc.add(p)
-            anc.update(self.ancestors(p))
-        return anc
+        if self._ancestors_index is None:
+            self._ancestors_index = ClosureIndex(self.parents)
+        return set(self._ancestors_index(accession))
+
+    # Whether a node is (strictly) subsumed by another
+    def issubsumedby(self, accession, ancestor):
+        if self._ancestors_index is None:
+            self._ancestors_index = ClosureIndex(self.parents)
+        return (ancestor in self._ancestors_index(accession))
 
     # Whether a node is a leaf
     def isleaf(self, accession):
@@ -315,9 +362,11 @@ class GNOme(GNOmeAPI):
             return self.label(o)
 
     def delete_node(self, accession):
+        self.invalidate_closure()
         self.gnome.remove((self.uri("gno:" + accession), None, None))
 
     def set_parents(self, accession, parents):
+        self.invalidate_closure()
         self.gnome.remove((self.uri("gno:" + accession), self.uri("rdfs:subClassOf"), None))
         for parent in parents:
             self.gnome.add((self.uri("gno:" + accession), self.uri("rdfs:subClassOf"), self.uri("gno:" + parent)))
@@ -442,19 +491,229 @@ class GNOme(GNOmeAPI):
 
 
 
-from . alignment import GlycanSubsumption, GlycanEqual, GlycanEqualWithWURCSCheck
+class GNOmeIndex(GNOmeAPI):
+
+    # Compact in-memory form of the GNOme ontology. Accessions are
+    # interned to integer ids, parent/child adjacency is held as tuples
+    # of ids, and level, topology, composition, and base composition
+    # are integer columns. Built once from the OWL file (using GNOme),
+    # it can be saved to and loaded from a binary snapshot file, which
+    # avoids parsing the RDF/XML in subsequent processes.
+
+    snapshot_magic = "GNOMEIDX1\n"
+    columns = ("level", "topology", "composition", "basecomposition")
+
+    def __init__(self, resource=None, format=None, snapshot=None):
+        if snapshot:
+            self.readsnapshot(snapshot)
+        else:
+            self.fromgnome(GNOme(resource=resource, format=format))
+
+    def intern(self, accession):
+        id = self._index.get(accession)
+        if id is None:
+            id = len(self._accs)
+            self._index[accession] = id
+            self._accs.append(accession)
+            self._alive.append(0)
+            self._parents.append(())
+            self._children.append(())
+            for col in self.columns:
+                self._column[col].append(-1)
+        return id
+
+    def fromgnome(self, gnome):
+        self.version = getattr(gnome, 'version', None)
+        self._accs = []
+        self._index = dict()
+        self._alive = bytearray()
+        self._parents = []
+        self._children = []
+        self._column = dict((col, array.array('i')) for col in self.columns)
+        self._labels = []
+
+        for acc in gnome.nodes():
+            self._alive[self.intern(acc)] = 1
+
+        gno = gnome.ns['gno']
+        parents = defaultdict(list)
+        for s, p, o in gnome.triples(None, 'rdfs:subClassOf', None):
+            if s.startswith(gno) and o.startswith(gno):
+                parents[self.intern(gnome.accession(s))].append(self.intern(gnome.accession(o)))
+        children = defaultdict(list)
+        for id, pids in parents.items():
+            self._parents[id] = tuple(pids)
+            for pid in pids:
+                children[pid].append(id)
+        for id, cids in children.items():
+            self._children[id] = tuple(cids)
+
+        labels = dict()
+        labelindex = dict()
+        for col, pred in zip(self.columns, ("gno:00000021", "gno:00000035", "gno:00000034", "gno:00000033")):
+            for s, p, o in gnome.triples(None, pred, None):
+                if not s.startswith(gno):
+                    continue
+                id = self.intern(gnome.accession(s))
+                if self._column[col][id] >= 0:
+                    continue
+                if o not in labels:
+                    labels[o] = gnome.label(o)
+                if col == "level":
+                    if labels[o] not in labelindex:
+                        labelindex[labels[o]] = len(self._labels)
+                        self._labels.append(labels[o])
+                    self._column[col][id] = labelindex[labels[o]]
+                else:
+                    self._column[col][id] = self.intern(labels[o])
+
+    def writesnapshot(self, filename):
+        poffsets = array.array('i', [0])
+        ptargets = array.array('i')
+        for pids in self._parents:
+            ptargets.extend(pids)
+            poffsets.append(len(ptargets))
+        data = dict(version=self.version,
+                    accessions="\n".join(self._accs),
+                    alive=str(self._alive),
+                    labels=self._labels,
+                    poffsets=poffsets.tostring(),
+                    ptargets=ptargets.tostring())
+        for col in self.columns:
+            data[col] = self._column[col].tostring()
+        wh = open(filename, 'wb')
+        wh.write(self.snapshot_magic)
+        pickle.dump(data, wh, pickle.HIGHEST_PROTOCOL)
+        wh.close()
+
+    def readsnapshot(self, filename):
+        fh = open(filename, 'rb')
+        if fh.read(len(self.snapshot_magic)) != self.snapshot_magic:
+            raise ValueError("Not a GNOme snapshot file: %s" % (filename,))
+        data = pickle.load(fh)
+        fh.close()
+
+        self.version = data['version']
+        self._accs = data['accessions'].split("\n") if data['accessions'] else []
+        self._index = dict((acc, id) for id, acc in enumerate(self._accs))
+        self._alive = bytearray(data['alive'])
+        self._labels = data['labels']
+        self._column = dict()
+        for col in self.columns:
+            self._column[col] = array.array('i')
+            self._column[col].fromstring(data[col])
+
+        poffsets = array.array('i')
+        poffsets.fromstring(data['poffsets'])
+        ptargets = array.array('i')
+        ptargets.fromstring(data['ptargets'])
+        self._parents = []
+        children = defaultdict(list)
+        for id in range(len(self._accs)):
+            pids = tuple(ptargets[poffsets[id]:poffsets[id+1]])
+            self._parents.append(pids)
+            for pid in pids:
+                children[pid].append(id)
+        self._children = [tuple(children.get(id, ())) for id in range(len(self._accs))]
+
+    def root(self):
+        return "00000001"
+
+    def nodes(self):
+        for id, acc in enumerate(self._accs):
+            if self._alive[id] and acc != "00000011":
+                yield acc
+
+    def parents(self, accession):
+        id = self._index.get(accession)
+        if id is not None:
+            for pid in self._parents[id]:
+                yield self._accs[pid]
+
+    def children(self, accession):
+        id = self._index.get(accession)
+        if id is not None:
+            for cid in self._children[id]:
+                yield self._accs[cid]
+
+    def level(self, accession):
+        id = self._index.get(accession)
+        if id is not None and self._column["level"][id] >= 0:
+            return self._labels[self._column["level"][id]]
+        return None
+
+    def get_molecularweight(self, accession):
+        if self.ismolecularweight(accession):
+            return accession
+        for anc in self.ancestors(accession):
+            if self.ismolecularweight(anc):
+                return anc
+
+    def _get_column(self, accession, col, level):
+        if self.islevel(accession, level):
+            return accession
+        id = self._index.get(accession)
+        if id is not None and self._column[col][id] >= 0:
+            return self._accs[self._column[col][id]]
+        return None
+
+    def get_basecomposition(self, accession):
+        return self._get_column(accession, "basecomposition", self.LEVEL_BASECOMPOSITION)
+
+    def get_composition(self, accession):
+        return self._get_column(accession, "composition", self.LEVEL_COMPOSITION)
+
+    def get_topology(self, accession):
+        return self._get_column(accession, "topology", self.LEVEL_TOPOLOGY)
+
+    def delete_node(self, accession):
+        # As for the OWL graph, links from children remain.
+        self.invalidate_closure()
+        id = self._index.get(accession)
+        if id is None:
+            return
+        self.set_parents(accession, [])
+        self._alive[id] = 0
+        for col in self.columns:
+            self._column[col][id] = -1
+
+    def set_parents(self, accession, parents):
+        self.invalidate_closure()
+        id = self.intern(accession)
+        for pid in self._parents[id]:
+            self._children[pid] = tuple(cid for cid in self._children[pid] if cid != id)
+        pids = tuple(self.intern(p) for p in parents)
+        self._parents[id] = pids
+        for pid in pids:
+            self._children[pid] = self._children[pid] + (id,)
+
+from . alignment import GlycanSubsumption, GlycanSubsumptionSignature, GlycanEqual, GlycanEqualWithWURCSCheck
 from . Monosaccharide import Anomer
 from . GlycanResource import GlyTouCan, GlyCosmos
 from . manipulation import Topology, Composition, BaseComposition
 
 
+# SubsumptionGraph instance inherited by (forked) compute worker
+# processes.
+_worker_graph = None
+
+def _compute_component_worker(rmass, cluster):
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        _worker_graph.compute_component(rmass, cluster)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
 class SubsumptionGraph(GNOmeAPI):
     def __init__(self, *args, **kwargs):
         pass
 
     def compute(self, *args, **kwargs):
-        self.gtc = GlyTouCan(usecache=False)
-        self.gco = GlyCosmos(usecache=False)
+        threads = kwargs.get('threads', 1)
+        self.gtc = GlyTouCan(usecache=False, threads=threads)
+        self.gco = GlyCosmos(usecache=False, threads=threads)
         self.subsumption = GlycanSubsumption()
         self.geq = GlycanEqual()
         self.geqwwc = GlycanEqualWithWURCSCheck()
@@ -562,8 +821,101 @@ class SubsumptionGraph(GNOmeAPI):
 		    for rmi in clustermap.get(bcomp,[]):
 		        del masscluster[rmi][bcomp]
 
-        for rmass, cluster in sorted(masscluster.items(),key=lambda t: float(t[0])):
-            self.compute_component(rmass, cluster)
+        clusters = sorted(masscluster.items(),key=lambda t: float(t[0]))
+
+        # Incremental computation: clusters with the same members (and
+        # member content hashes) as in a previous dump file are copied
+        # through unchanged rather than recomputed.
+        unchanged = dict()
+        if kwargs.get('previous'):
+            sections = self.readsections(kwargs.get('previous'))
+            for rmass, cluster in clusters:
+                if rmass in sections and sections[rmass][0] == self.cluster_members(cluster):
+                    unchanged[rmass] = sections[rmass][1]
+            if self.verbose:
+                print >>sys.stderr, "%d/%d clusters unchanged from previous dump" % (len(unchanged), len(clusters))
+
+        workers = kwargs.get('workers', 1)
+        if workers > 1:
+            self.compute_parallel(clusters, workers, unchanged)
+        else:
+            for rmass, cluster in clusters:
+                if rmass in unchanged:
+                    sys.stdout.write(unchanged[rmass])
+                    sys.stdout.flush()
+                else:
+                    self.compute_component(rmass, cluster)
+
+    def compute_parallel(self, clusters, workers, unchanged=None):
+        # Mass clusters are independent, so dispatch them to a process
+        # pool. Each worker captures the output of compute_component,
+        # which is then written in the (sorted) order of clusters so
+        # the dump file is the same as the sequential computation.
+        # Largest clusters are scheduled first so that one big cluster
+        # does not end up as the tail of the run.
+        if unchanged is None:
+            unchanged = dict()
+        global _worker_graph
+        _worker_graph = self
+        pool = multiprocessing.Pool(workers)
+        results = dict()
+        for rmass, cluster in sorted(clusters, key=lambda t: len(t[1]), reverse=True):
+            if rmass not in unchanged:
+                results[rmass] = pool.apply_async(_compute_component_worker, (rmass, cluster))
+        pool.close()
+        try:
+            for rmass, cluster in clusters:
+                if rmass in unchanged:
+                    sys.stdout.write(unchanged[rmass])
+                else:
+                    sys.stdout.write(results[rmass].get())
+                sys.stdout.flush()
+        except:
+            pool.terminate()
+            raise
+        pool.join()
+        _worker_graph = None
+
+    def content_hash(self, acc):
+        # Hash of everything about an accession that compute_component
+        # depends on: sequences, GlyTouCan annotations, masses, and
+        # archived/validated status.
+        h = hashlib.md5()
+        annotations = []
+        for anacc in (self.gtc.gettopo(acc), self.gtc.getcomp(acc), self.gtc.getbasecomp(acc)):
+            annotations.append(self.replace.get(anacc, anacc))
+        for value in [self.gco.getseq(acc,'wurcs'), self.gtc.getseq(acc,'wurcs'),
+                      self.gco.getmass(acc), self.gtc.getmass(acc),
+                      acc in self.replace, self.replace.get(acc), acc in self.allgco] + annotations:
+            h.update(repr(value))
+            h.update("\t")
+        return h.hexdigest()[:16]
+
+    def cluster_members(self, cluster):
+        return dict((acc, self.content_hash(acc)) for acc in cluster)
+
+    def readsections(self, dumpfilepath):
+        # Split a dump file into the verbatim output of each cluster,
+        # from "# START" to "# DONE", keyed by the rounded mass of its
+        # "# MEMBERS" line.
+        sections = dict()
+        lines = None
+        for l in open(dumpfilepath):
+            if l.startswith("# START"):
+                lines = [l]
+                rmass = None
+                members = None
+            elif lines != None:
+                lines.append(l)
+                if l.startswith("# MEMBERS"):
+                    sl = l.split(" - ", 1)[1].split()
+                    rmass = sl[0]
+                    members = dict(m.split("=", 1) for m in sl[1:])
+                elif l.startswith("# DONE"):
+                    if rmass != None:
+                        sections[rmass] = (members, "".join(lines))
+                    lines = None
+        return sections
 
     def warning(self, msg, level):
         if self.verbose >= level:
@@ -574,6 +926,8 @@ class SubsumptionGraph(GNOmeAPI):
         start = time.time()
 
         print "# START %s - %d accessions in molecular weight cluster for %s" % (time.ctime(), len(cluster), rmass)
+        print "# MEMBERS - %s" % (rmass,),
+        print " ".join("%s=%s" % t for t in sorted(self.cluster_members(cluster).items()))
         sys.stdout.flush()
 
         badparse = 0
@@ -632,6 +986,16 @@ class SubsumptionGraph(GNOmeAPI):
         outedges = defaultdict(set)
         inedges = defaultdict(set)
 
+        # Cheap invariants used to rule out pairs before the
+        # subsumption graph matching is attempted.
+        signature = dict()
+        fingerprint = dict()
+        for acc in clusteracc:
+            signature[acc] = GlycanSubsumptionSignature(cluster[acc]['glycan'])
+            fingerprint[acc] = self.geq.fingerprint(cluster[acc]['glycan'])
+        npairs = 0
+        npruned = 0
+
 	self.warning("Computation of subsumption relationships started",5)
         for acc1 in sorted(clusteracc):
             gly1 = cluster[acc1]['glycan']
@@ -639,8 +1003,12 @@ class SubsumptionGraph(GNOmeAPI):
                 gly2 = cluster[acc2]['glycan']
                 if acc1 != acc2:
 		    self.warning("%s <?= %s"%(acc1,acc2),5)
+                    npairs += 1
+                    if signature[acc1].excludes(signature[acc2]):
+                        npruned += 1
+                        continue
                     if self.subsumption.leq(gly1, gly2):
-			iseq = self.geq.eq(gly1, gly2)
+			iseq = (fingerprint[acc1] == fingerprint[acc2]) and self.geq.eq(gly1, gly2)
                         if not iseq or acc2 < acc1:
                             outedges[acc2].add(acc1)
                             inedges[acc1].add(acc2)
@@ -972,6 +1340,7 @@ class SubsumptionGraph(GNOmeAPI):
             print "%s:" % (n,),
             print " ".join(sorted(prunedoutedges[n]))
         print "# ENDEDGES"
+        print "# PRUNED - %d/%d subsumption tests pruned in molecular weight cluster for %s" % (npruned, npairs, rmass)
         sys.stdout.flush()
 
         print "# DONE - Elapsed time %.2f sec." % (time.time() - start,)
@@ -1147,6 +1516,7 @@ class SubsumptionGraph(GNOmeAPI):
 	for pa,chs in self.alledges.items():
 	    for ch in chs:
 		self.allinedges[ch].add(pa)
+        self.invalidate_closure()
 
         return raw_data
 
@@ -2400,6 +2770,18 @@ def main():
         g.restrict(restriction)
         g.write(sys.stdout)
 
+    elif cmd == "snapshot":
+
+        if len(sys.argv) < 2:
+            print "Please provide output snapshot file path and optionally GNOme.owl"
+            sys.exit(1)
+
+        if len(sys.argv) > 2:
+            g = GNOmeIndex(resource=sys.argv[2])
+        else:
+            g = GNOmeIndex()
+        g.writesnapshot(sys.argv[1])
+
     elif cmd == "dump":
 
         g = GNOme()
@@ -2408,12 +2790,28 @@ def main():
     elif cmd == "compute":
 
         verbose = 0
-        while len(sys.argv) > 1 and sys.argv[1] == "-v":
-            verbose += 1
-            sys.argv.pop(1)
+        workers = 1
+        threads = 1
+        previous = None
+        while len(sys.argv) > 1 and sys.argv[1] in ("-v", "-w", "-t", "-p"):
+            if sys.argv[1] == "-v":
+                verbose += 1
+                sys.argv.pop(1)
+            elif sys.argv[1] == "-w":
+                workers = int(sys.argv[2])
+                sys.argv.pop(1)
+                sys.argv.pop(1)
+            elif sys.argv[1] == "-t":
+                threads = int(sys.argv[2])
+                sys.argv.pop(1)
+                sys.argv.pop(1)
+            else:
+                previous = sys.argv[2]
+                sys.argv.pop(1)
+                sys.argv.pop(1)
 
         g = SubsumptionGraph()
-        g.compute(*sys.argv[1:], verbose=verbose)
+        g.compute(*sys.argv[1:], verbose=verbose, workers=workers, threads=threads, previous=previous)
 
     elif cmd == "writeowl":
 
@@ -1,7 +1,10 @@
 
-import sqlite3, re
-import cPickle as pickle
-import zlib, os, os.path, sys, math
+import sqlite3, re, json, hashlib
+import zlib, os, os.path, sys, math, time, itertools
+import multiprocessing
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
 
 from GlyMWFilter import GlyMWFilter
 from GlyCompFilter import GlyCompFilter
@@ -11,12 +14,122 @@ from GlyHighMannoseFilter import GlyHighMannoseFilter
 from GlyOxfordFilter import GlyOxfordFilter
 from GlyLinCodeFilter import GlyLinCodeFilter
 from GlyIUPACFilter import GlyIUPACFilter
-from CompositionTable import ResidueCompositionTable, PermethylCompositionTable
+from CompositionTable import Composition, ResidueCompositionTable, PermethylCompositionTable
 from ElementMass import MonoisotopicElementMass
 from GlyRecord import GlyRecord
+from GlycanFormatter import GlycoCTFormat
 from subtree import linearcodeSubtreeEquals, iupacSubtreeEquals
+from workerpool import windowed
+
+# Mass of a proton, for m/z to neutral mass conversion
+proton = 1.00727646688
+
+class GlyMassIndex:
+    """
+    Masses and ids of GlyDbIndex records as sorted arrays, loaded once,
+    for batch ppm-tolerance mass lookups without deserializing records.
+    Masses are as in the index: residue masses, without reducing end.
+    """
+    def __init__(self,rows):
+        rows = sorted(rows)
+        self.masses = array('d',[ r[0] for r in rows ])
+        self.ids = array('l',[ r[1] for r in rows ])
+
+    def __len__(self):
+        return len(self.masses)
+
+    def search(self,masses,ppm=10.0):
+        # Queries are visited in mass order, so each binary search can
+        # start where the previous one (for a smaller mass) ended.
+        masses = list(masses)
+        result = [ None ]*len(masses)
+        tol = ppm*1e-6
+        lo = 0
+        for i in sorted(range(len(masses)),key=masses.__getitem__):
+            m = masses[i]
+            lo = bisect_left(self.masses,m-m*tol,lo)
+            hi = bisect_right(self.masses,m+m*tol,lo)
+            result[i] = self.ids[lo:hi].tolist()
+        return result
+
+class TimedStage:
+    """Cumulative time spent producing records from source"""
+    def __init__(self,source,name):
+        self.source = source
+        self.name = name
+        self.elapsed = 0.0
+    def __iter__(self):
+        return self.next()
+    def next(self):
+        it = iter(self.source)
+        while True:
+            start = time.time()
+            try:
+                gr = it.next()
+            except StopIteration:
+                self.elapsed += time.time() - start
+                return
+            self.elapsed += time.time() - start
+            yield gr
+
+class RecordFeed:
+    """Source of a filter chain that is (re)filled with records"""
+    def __init__(self):
+        self.records = []
+    def __iter__(self):
+        return iter(self.records)
+
+_build_index = None
+_build_feed = None
+_build_chain = None
+
+def _build_init(index):
+    global _build_index, _build_feed, _build_chain
+    _build_index = index
+    _build_feed = RecordFeed()
+    _build_chain = index.pipeline(_build_feed)
+
+def _build_worker(records):
+    _build_feed.records = records
+    rows = [ _build_index.record(gr) for gr in _build_chain[-1] ]
+    times = GlyDbIndex.stagetimes(_build_chain)
+    for st in _build_chain:
+        st.elapsed = 0.0
+    return rows, times
+
+def plainstr(o):
+    # str rather than the unicode returned by sqlite and json
+    if isinstance(o,unicode):
+        return o.encode('utf8')
+    if isinstance(o,list):
+        return map(plainstr,o)
+    if isinstance(o,dict):
+        return dict((plainstr(k),plainstr(v)) for k,v in o.iteritems())
+    return o
+
+class GlyDbRecord(GlyRecord):
+    """
+    GlyRecord read from a GlyDbIndex. The glycan is parsed from its
+    GlycoCT sequence on first use, and cached.
+    """
+    glycoctfmt = GlycoCTFormat()
+    def __init__(self,source,accession,glycoct,**kw):
+        self.glycoct = glycoct
+        if 'composition' in kw:
+            comp = Composition()
+            comp.update(kw['composition'])
+            kw['composition'] = comp
+        GlyRecord.__init__(self,source,accession,None,**kw)
+    def getglycan(self):
+        if self._glycan is None and self.glycoct:
+            self._glycan = self.glycoctfmt.toGlycan(self.glycoct)
+        return self._glycan
+    def setglycan(self,glycan):
+        self._glycan = glycan
+    glycan = property(getglycan,setglycan)
 
 class GlyDbIndex:
+    glycoctfmt = GlycoCTFormat()
     createTable = """
         create table theindex (
           id integer primary key autoincrement, 
@@ -41,7 +154,9 @@ class GlyDbIndex:
           Fuc int not null,
           Xyl int not null,
           Xxx int not null,
-          data blob not null
+          glycoct text not null,
+          attributes text not null,
+          hash varchar not null
         );
     """
     createTable1 = """
@@ -51,10 +166,16 @@ class GlyDbIndex:
           accession varchar not null
         );
     """
+    createTable2 = """
+       create table images (
+          glyid integer primary key,
+          image blob not null
+        );
+    """
     valid = set(['Hex','HexNAc','NeuAc','NeuGc','Fuc','Xyl'])
     insert = """
         insert into theindex values (
-          ?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?
+          ?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?
         )
     """
     insert1 = """
@@ -62,6 +183,11 @@ class GlyDbIndex:
           ?,?,?
         )
     """
+    insert2 = """
+        insert into images values (
+          ?,?
+        )
+    """
     select = """
         select * from theindex
         where mw >= ? and mw <= ?
@@ -71,9 +197,23 @@ class GlyDbIndex:
         order by abs(mw-?) asc limit 1
     """
     select2 = """
-        select id,data from theindex
+        select id,source,accession,glycoct,attributes from theindex
         order by mw asc
     """
+    select3 = """
+        select id,source,accession,glycoct,attributes,mw from theindex
+        where mw >= ? and mw <= ?
+    """
+    hashsel = """
+        select accession,id,hash,mw from theindex
+    """
+    grpsel = """
+        select mw,topogrp from theindex where topogrp is not null
+    """
+    imagesel = """
+        select image from images, theindex
+        where glyid = id and accession = ?
+    """
     index = """
         create index mwindex on theindex (mw,nlinked)
     """
@@ -113,8 +253,14 @@ class GlyDbIndex:
     cntsel = """
         select count(*) from theindex
     """
+    mwsel = """
+        select mw,id from theindex
+    """
+    pmwsel = """
+        select pmw,id from theindex where pmw > 0
+    """
 
-    def __init__(self,glydb=None,force=False,filters=None,indexfile=None):
+    def __init__(self,glydb=None,force=False,filters=None,indexfile=None,workers=1,verbose=False):
 	if isinstance(glydb, basestring):
 	    if glydb.endswith('.index'):
 	        self.indexfile = glydb
@@ -128,11 +274,13 @@ class GlyDbIndex:
 	    else:
                 self.indexfile = indexfile
         self.conn = None
+        self.massindexes = {}
+        self.glycans = {}
         self.filters = []
         if filters:
             self.filters.extend(filters)
 	if self.glydb:
-            self.build(force=force)
+            self.build(force=force,workers=workers,verbose=verbose)
 
     def clean(self):
         try:
@@ -147,6 +295,9 @@ class GlyDbIndex:
     def exists(self):
 	if not os.path.exists(self.indexfile):
 	    return False
+        # Written with pickled records, or without record hashes?
+        if 'hash' not in self.columns():
+            return False
 	if not os.path.exists(self.indexfile[:-6]):
 	    return True
 	if os.path.getmtime(self.indexfile) < \
@@ -157,76 +308,48 @@ class GlyDbIndex:
             return False
         return True
 
-    def build(self,force=False):
+    def columns(self):
+        conn = sqlite3.connect(self.indexfile)
+        try:
+            return [ r[1] for r in conn.execute("pragma table_info(theindex)") ]
+        finally:
+            conn.close()
+
+    def build(self,force=False,workers=1,batchsize=1000,verbose=False):
         if self.exists() and not force:
             return
         glyind = 0;
+        nrecords = 0;
+        insertelapsed = 0.0
         self.clean()
+        # before the connection is opened, so workers do not inherit it
+        batches = self.batches(self.glydb,workers,batchsize)
         self.conn = sqlite3.connect(self.indexfile,isolation_level='DEFERRED')
+        # bulk load settings, the index is rebuilt if interrupted
+        self.conn.execute("pragma synchronous = off")
+        self.conn.execute("pragma journal_mode = memory")
+        self.conn.execute("pragma cache_size = 100000")
         self.conn.execute(self.createTable)
         self.conn.execute(self.createTable1)
+        self.conn.execute(self.createTable2)
+        for rows in batches:
+            start = time.time()
+            nrecords += len(rows)
+            rows = [ r for r in rows if r is not None ]
+            self.insertrows(self.conn,zip(range(glyind+1,glyind+len(rows)+1),rows))
+            self.conn.commit()
+            glyind += len(rows)
+            insertelapsed += time.time() - start
+        start = time.time()
         self.conn.execute(self.index)
         self.conn.execute(self.index1)
         self.conn.execute(self.index2)
         self.conn.execute(self.index3)
         self.conn.execute(self.index4)
         self.conn.execute(self.index5)
-	gdb = self.glydb
-        for f in self.filters:
-            gdb = f(gdb)
-        gdb = GlyMWFilter(gdb,
-                          ResidueCompositionTable(),
-                          PermethylCompositionTable(),
-                          MonoisotopicElementMass())
-        gdb = GlyCompFilter(gdb)
-        gdb = GlyNLinkedFilter(gdb)
-        gdb = GlyLactosamineFilter(gdb)
-        gdb = GlyHighMannoseFilter(gdb)
-	gdb = GlyOxfordFilter(gdb)
-        gdb = GlyLinCodeFilter(gdb)
-        gdb = GlyIUPACFilter(gdb)
-        for gr in gdb:
-            if 'molecular_weight' not in gr:
-                continue
-            if 'composition' not in gr:
-                continue
-	    if 'high-mannose' not in gr:
-		continue
-            cmp = gr['composition']
-            remaining_residues = sum(v for k,v in cmp.iteritems()
-                                     if k not in GlyDbIndex.valid)
-            glyind += 1
-            self.conn.execute(self.insert,(glyind,
-                                           gr.source,
-                                           gr.accession,
-                                           gr['molecular_weight'],
-					   int(gr['molecular_weight']),
-                                           gr.get('permethylated_molecular_weight',0.0),
-                                           int(gr.get('permethylated_molecular_weight',0.0)),
-                                           gr['mini-nlinked'],
-                                           gr['lactosamine'],
-                                           gr['high-mannose'],
-					   gr.get('oxford',""),
-                                           gr['lincode'],
-					   None,
-					   None,
-                                           None,
-                                           cmp['Hex'],
-                                           cmp['HexNAc'],
-                                           cmp['NeuAc'],
-                                           cmp['NeuGc'],
-                                           cmp['Fuc'],
-                                           cmp['Xyl'],
-                                           remaining_residues,
-                                           self.tostr(gr)))
-            self.conn.execute(self.insert1,(glyind,gr.source,gr.accession))
-            for res in gr.get('resource',[]):
-                source,accession = res.split(':')
-                self.conn.execute(self.insert1,(glyind,source,accession))
-            for res in gr.get('taxon',[]):
-                source,accession = res.split(':')
-                self.conn.execute(self.insert1,(glyind,source+"taxa",accession))
         self.conn.commit()
+        indexelapsed = time.time() - start
+        start = time.time()
 	lastmwstr = None
 	mwind = 0
 	group = []
@@ -234,15 +357,248 @@ class GlyDbIndex:
 	    mwstr = "%.3f"%r['molecular_weight']
 	    if mwstr != lastmwstr:
                 if len(group) != 0:
-                    self.processgroup(self.conn,mwind,group)
+                    self.processgroup(self.conn,mwind,group,self.glycans)
 		mwind += 1
                 lastmwstr = mwstr
                 group = []
 	    group.append(r)
         if len(group) != 0:
-            self.processgroup(self.conn,mwind,group)
+            self.processgroup(self.conn,mwind,group,self.glycans)
+        self.glycans = {}
         self.conn.commit()
         self.conn = None
+        self.massindexes = {}
+        groupelapsed = time.time() - start
+        if verbose:
+            print >>sys.stderr, "%d of %d records indexed, %d worker(s)"%(glyind,nrecords,workers)
+            for name,elapsed in self.buildtimes:
+                print >>sys.stderr, "  %-24s %10.2f sec"%(name,elapsed)
+            print >>sys.stderr, "  %-24s %10.2f sec"%("insert",insertelapsed)
+            print >>sys.stderr, "  %-24s %10.2f sec"%("create indexes",indexelapsed)
+            print >>sys.stderr, "  %-24s %10.2f sec"%("topology groups",groupelapsed)
+
+    def update(self,glydb,workers=1,batchsize=1000,verbose=False):
+        """
+        Insert the new, and replace the changed (by hash), records of
+        glydb, and recompute the topology and LinearCode representatives
+        of the affected mass groups only, in one transaction, so the
+        index can be queried, as it was, until the update is committed.
+        Records not in glydb are kept.
+        """
+        if not os.path.exists(self.indexfile) or 'hash' not in self.columns():
+            self.glydb = glydb
+            self.build(force=True,workers=workers,batchsize=batchsize,verbose=verbose)
+            return
+        # before the connection is opened, so workers do not inherit it
+        batches = self.batches(glydb,workers,batchsize)
+        conn = sqlite3.connect(self.indexfile,isolation_level='DEFERRED')
+        try:
+            current = {}
+            maxid = 0
+            for acc,id,hash,mw in conn.execute(self.hashsel):
+                current[plainstr(acc)] = (id,plainstr(hash),mw)
+                maxid = max(maxid,id)
+            groups = set()
+            nrecords = 0; nnew = 0; nchanged = 0
+            insertelapsed = 0.0
+            for rows in batches:
+                start = time.time()
+                inserts = []
+                for r in rows:
+                    nrecords += 1
+                    if r is None:
+                        continue
+                    row = r[0]
+                    accession,mw,hash = row[1],row[2],row[-1]
+                    if accession in current:
+                        id,hash0,mw0 = current[accession]
+                        if hash == hash0:
+                            self.glycans.pop(row[-3],None)
+                            continue
+                        # replaced, under the same id
+                        conn.execute("delete from theindex where id = ?",(id,))
+                        conn.execute("delete from accindex where glyid = ?",(id,))
+                        conn.execute("delete from images where glyid = ?",(id,))
+                        groups.add("%.3f"%mw0)
+                        nchanged += 1
+                    else:
+                        maxid += 1
+                        id = maxid
+                        nnew += 1
+                    current[accession] = (id,hash,mw)
+                    groups.add("%.3f"%mw)
+                    inserts.append((id,r))
+                self.insertrows(conn,inserts)
+                insertelapsed += time.time() - start
+            start = time.time()
+            grpinds = {}
+            for mw,topogrp in conn.execute(self.grpsel):
+                grpinds["%.3f"%mw] = int(topogrp.split('.')[0])
+            lastgrpind = max(grpinds.values() or [0])
+            for mwstr in sorted(groups,key=float):
+                if mwstr not in grpinds:
+                    lastgrpind += 1
+                    grpinds[mwstr] = lastgrpind
+                mw = float(mwstr)
+                group = []
+                for r in conn.execute(self.select3,(mw-0.001,mw+0.001)):
+                    if "%.3f"%r[5] != mwstr:
+                        continue
+                    o = self.torecord(r)
+                    o['id'] = r[0]
+                    group.append(o)
+                if len(group) != 0:
+                    self.processgroup(conn,grpinds[mwstr],group,self.glycans)
+            conn.commit()
+            groupelapsed = time.time() - start
+        except:
+            conn.rollback()
+            raise
+        finally:
+            self.glycans = {}
+            conn.close()
+        self.massindexes = {}
+        if verbose:
+            print >>sys.stderr, "%d new and %d changed of %d records, %d mass groups, %d worker(s)"%(nnew,nchanged,nrecords,len(groups),workers)
+            for name,elapsed in self.buildtimes:
+                print >>sys.stderr, "  %-24s %10.2f sec"%(name,elapsed)
+            print >>sys.stderr, "  %-24s %10.2f sec"%("insert",insertelapsed)
+            print >>sys.stderr, "  %-24s %10.2f sec"%("topology groups",groupelapsed)
+
+    def batches(self,glydb,workers=1,batchsize=1000):
+        # record() rows of glydb's filtered records, in order, in
+        # batches. With workers > 1, the filter chain is evaluated in a
+        # process pool. self.buildtimes is set once all are consumed.
+        # Serially, the parsed glycans are kept in self.glycans, by
+        # GlycoCT, for the topology groups of the same build or update.
+        self.buildtimes = []
+        self.glycans = {}
+        if workers > 1:
+            pool = multiprocessing.Pool(workers,_build_init,(self,))
+            return self.poolbatches(pool,glydb,workers,batchsize)
+        return self.serialbatches(glydb,batchsize)
+
+    def serialbatches(self,glydb,batchsize):
+        stages = self.pipeline(glydb)
+        for chunk in self.chunks(stages[-1],batchsize):
+            rows = []
+            for gr in chunk:
+                row = self.record(gr)
+                if row is not None:
+                    self.glycans[row[0][-3]] = gr.glycan
+                rows.append(row)
+            yield rows
+        self.buildtimes = self.stagetimes(stages)
+
+    def poolbatches(self,pool,glydb,workers,batchsize):
+        read = TimedStage(glydb,"read")
+        tasks = ((chunk,) for chunk in self.chunks(read,batchsize))
+        stagetimes = None
+        for rows,times in windowed(pool,_build_worker,tasks,4*workers):
+            if stagetimes is None:
+                stagetimes = times
+            else:
+                stagetimes = [ (name,t0+t1) for (name,t0),(name1,t1) in zip(stagetimes,times) ]
+            yield rows
+        self.buildtimes = [("read",read.elapsed)] + (stagetimes or [])[1:]
+
+    def pipeline(self,gdb):
+        # The filter chain of build, each filter wrapped in a TimedStage.
+        stages = [ TimedStage(gdb,"read") ]
+        filters = [ (getattr(f,'__name__',str(f)),f) for f in self.filters ]
+        filters.append(("GlyMWFilter",lambda gdb: GlyMWFilter(gdb,
+                                                             ResidueCompositionTable(),
+                                                             PermethylCompositionTable(),
+                                                             MonoisotopicElementMass())))
+        for f in (GlyCompFilter, GlyNLinkedFilter, GlyLactosamineFilter, GlyHighMannoseFilter,
+                  GlyOxfordFilter, GlyLinCodeFilter, GlyIUPACFilter):
+            filters.append((f.__name__,f))
+        for name,f in filters:
+            stages.append(TimedStage(f(stages[-1]),name))
+        return stages
+
+    @staticmethod
+    def stagetimes(stages):
+        # time spent in each stage itself, not in the stages it reads from
+        times = []
+        last = 0.0
+        for st in stages:
+            times.append((st.name,st.elapsed-last))
+            last = st.elapsed
+        return times
+
+    @staticmethod
+    def chunks(records,size):
+        records = iter(records)
+        while True:
+            chunk = list(itertools.islice(records,size))
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+    def record(self,gr):
+        # Row (without id), accession aliases and image of a filtered
+        # record, or None if it is not indexed.
+        if 'molecular_weight' not in gr:
+            return None
+        if 'composition' not in gr:
+            return None
+	if 'high-mannose' not in gr:
+	    return None
+        cmp = gr['composition']
+        glycoct = self.glycoctfmt.toStr(gr.glycan)
+        attributes = self.attributes(gr)
+        remaining_residues = sum(v for k,v in cmp.iteritems()
+                                 if k not in GlyDbIndex.valid)
+        row = (gr.source,
+               gr.accession,
+               gr['molecular_weight'],
+	       int(gr['molecular_weight']),
+               gr.get('permethylated_molecular_weight',0.0),
+               int(gr.get('permethylated_molecular_weight',0.0)),
+               gr['mini-nlinked'],
+               gr['lactosamine'],
+               gr['high-mannose'],
+	       gr.get('oxford',""),
+               gr['lincode'],
+	       None,
+	       None,
+               None,
+               cmp['Hex'],
+               cmp['HexNAc'],
+               cmp['NeuAc'],
+               cmp['NeuGc'],
+               cmp['Fuc'],
+               cmp['Xyl'],
+               remaining_residues,
+               glycoct,
+               attributes,
+               hashlib.sha1(glycoct+attributes).hexdigest())
+        aliases = [(gr.source,gr.accession)]
+        for res in gr.get('resource',[]):
+            source,accession = res.split(':')
+            aliases.append((source,accession))
+        for res in gr.get('taxon',[]):
+            source,accession = res.split(':')
+            aliases.append((source+"taxa",accession))
+        return row,aliases,gr.get('image')
+
+    @staticmethod
+    def attributes(gr):
+        # JSON, so the index does not depend on pickle or Python version
+        return json.dumps(dict((k,v) for k,v in gr.iteritems() if k != 'image'),sort_keys=True)
+
+    def insertrows(self,conn,rows):
+        # (id, record()) pairs, one executemany per table
+        inserts = []; inserts1 = []; inserts2 = []
+        for glyind,(row,aliases,image) in rows:
+            inserts.append((glyind,) + row)
+            inserts1.extend((glyind,source,accession) for source,accession in aliases)
+            if image is not None:
+                inserts2.append((glyind,sqlite3.Binary(image)))
+        conn.executemany(self.insert,inserts)
+        conn.executemany(self.insert1,inserts1)
+        conn.executemany(self.insert2,inserts2)
 
     @staticmethod
     def gdbsortkey(acc):
@@ -252,7 +608,16 @@ class GlyDbIndex:
 	    return (0,int(acc[3:]))
 
     @staticmethod
-    def processgroup(conn,grpind,group):
+    def processgroup(conn,grpind,group,glycans=None):
+        # glycans already parsed, by GlycoCT, are used instead of parsing
+        # the records' GlycoCT again, and released, as identical GlycoCT
+        # is always in the same mass group.
+        if glycans:
+            for gr in group:
+                if gr.glycoct in glycans:
+                    gr.glycan = glycans[gr.glycoct]
+            for gr in group:
+                glycans.pop(gr.glycoct,None)
         try:
             group.sort(key=lambda gr: GlyDbIndex.gdbsortkey(gr.accession))
         except:
@@ -300,16 +665,20 @@ class GlyDbIndex:
         for i1 in lcrepr.keys():
             toporepr[i1] = set(lcrepr[i1])
         toremove = set()
-        for i1 in lcrepr.keys():
+        # bucket by topology fingerprint, only compare within a bucket
+        buckets = defaultdict(list)
+        for i1 in sorted(lcrepr.keys()):
             m1 = group[i1]
-            topokeep = True
-            for i2 in lcrepr.keys():
-                m2 = group[i2]
-                if i1 > i2 and glycmp.compare(m1.glycan,m2.glycan):
-                    topokeep = False
+            fp = glycmp.fingerprint(m1.glycan)
+            if fp is None:
+                continue
+            for i2 in buckets[fp]:
+                if glycmp.compare(m1.glycan,group[i2].glycan):
                     toporepr[i2].update(toporepr[i1])
-            if not topokeep:
-                toremove.add(i1)
+                    toremove.add(i1)
+                    break
+            else:
+                buckets[fp].append(i1)
         for i1 in toremove:
             del toporepr[i1]
         # print lcrepr
@@ -345,11 +714,10 @@ class GlyDbIndex:
     def toobj1(s):
         return zlib.decompress(s)
     @staticmethod
-    def tostr(o):
-        return sqlite3.Binary(zlib.compress(pickle.dumps(o)))
-    @staticmethod
-    def toobj(s):
-        return pickle.loads(zlib.decompress(s))
+    def torecord(r):
+        # id, source, accession, glycoct, attributes columns
+        return GlyDbRecord(plainstr(r[1]),plainstr(r[2]),plainstr(r[3]),
+                           **plainstr(json.loads(r[4])))
     def get(self,**kw):
         if not self.conn:
             self.conn = sqlite3.connect(self.indexfile,isolation_level=None)
@@ -360,10 +728,10 @@ class GlyDbIndex:
                 select = "select count(*) from theindex"
 		count = True
 	    else:
-                select = "select data from theindex"
+                select = "select id,source,accession,glycoct,attributes from theindex"
 	    del kw['count']
 	else:
-            select = "select data from theindex"
+            select = "select id,source,accession,glycoct,attributes from theindex"
         values = []
         for i,(k,v) in enumerate(kw.items()):
             if i != 0:
@@ -388,7 +756,7 @@ class GlyDbIndex:
 	    yield c.execute(select,values).next()[0]
 	    return
         for r in c.execute(select,values):
-            yield self.toobj(r[0])
+            yield self.torecord(r)
         c.close()
     def count(self,**kwargs):
 	kwargs['count'] = True
@@ -400,7 +768,7 @@ class GlyDbIndex:
             self.conn = sqlite3.connect(self.indexfile,isolation_level=None)
         c = self.conn.cursor()
         for r in c.execute(self.select2):
-            o = self.toobj(r[1])
+            o = self.torecord(r)
             o['id'] = r[0]
 	    yield o
     def getall(self):
@@ -426,6 +794,45 @@ class GlyDbIndex:
             self.conn = sqlite3.connect(self.indexfile,isolation_level=None)
         c = self.conn.cursor()
 	return c.execute(self.maxpmwsel).next()[0]
+    def massindex(self,permethylated=False):
+        if permethylated not in self.massindexes:
+            if not self.conn:
+                self.conn = sqlite3.connect(self.indexfile,isolation_level=None)
+            c = self.conn.cursor()
+            self.massindexes[permethylated] = \
+                GlyMassIndex(c.execute(self.pmwsel if permethylated else self.mwsel))
+            c.close()
+        return self.massindexes[permethylated]
+    def masssearch(self,masses,ppm=10.0,permethylated=False):
+        """
+        Ids of records within ppm of each of masses (residue masses, as
+        molecular_weight or permethylated_molecular_weight), as a list
+        of lists in the order of masses.
+        """
+        return self.massindex(permethylated).search(masses,ppm)
+    def mzsearch(self,mzs,charges=(1,),ppm=10.0,permethylated=False,offset=0.0,ion=proton):
+        """
+        Ids of records matching each of mzs as an [M+zion]z+ ion, for
+        each z in charges, as a list (in the order of mzs) of lists of
+        (z, id). offset is the mass of the reducing end, if any, that
+        is not part of the indexed mass.
+        """
+        queries = [ z*(mz-ion)-offset for mz in mzs for z in charges ]
+        ids = self.masssearch(queries,ppm,permethylated)
+        result = []
+        for i in range(len(mzs)):
+            hits = []
+            for j,z in enumerate(charges):
+                hits.extend((z,id) for id in ids[i*len(charges)+j])
+            result.append(hits)
+        return result
+    def image(self,acc):
+        if not self.conn:
+            self.conn = sqlite3.connect(self.indexfile,isolation_level=None)
+        c = self.conn.cursor()
+        for r in c.execute(self.imagesel,(acc,)):
+            return str(r[0])
+        return None
     def toporepr(self,acc):
 	if not self.conn:
             self.conn = sqlite3.connect(self.indexfile,isolation_level=None)
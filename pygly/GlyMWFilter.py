@@ -11,23 +11,34 @@ class GlyMWFilter:
 	    self.addh2o = 2*self.mt['H'] + self.mt['O']
 	if kw.get('permethylated_ends',False):
             self.addperm = self.mt['C'] + 3*self.mt['H'] + self.mt['O'] + self.mt['C'] + 3*self.mt['H']
+        # composition signature -> residue mass (None if not in table)
+        self.masses = dict()
+        self.permmasses = dict()
     def __iter__(self):
 	return self.next()
+    def residuemass(self,m,comp_table,masses):
+        sig = m.composition_signature()
+        if sig not in masses:
+            try:
+                masses[sig] = comp_table.residue_composition(m).mass(self.mt)
+            except KeyError:
+                masses[sig] = None
+        return masses[sig]
     def next(self):
 	for gr in self.glydb:
 	    mw = 0.0; pmw = 0.0
 	    bad = False; pbad = False;
 	    for m in gr.glycan.all_nodes():
-		try:
-		    ec = m.composition(self.cmp)
-		    mw += ec.mass(self.mt)
-		except KeyError:
-		    bad = True
-                try:
-		    ec = m.composition(self.perm)
-		    pmw += ec.mass(self.mt)
-		except KeyError:
-		    pbad = True
+                rmw = self.residuemass(m,self.cmp,self.masses)
+                if rmw == None:
+                    bad = True
+                else:
+                    mw += rmw
+                rpmw = self.residuemass(m,self.perm,self.permmasses)
+                if rpmw == None:
+                    pbad = True
+                else:
+                    pmw += rpmw
 	    if not bad:
 	        gr['molecular_weight'] = mw + self.addh2o
 	    if not pbad:
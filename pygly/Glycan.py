@@ -5,7 +5,8 @@ import operator
 import sys
 import time
 import copy
-from collections import defaultdict
+from array import array
+from collections import defaultdict, deque
 
 try:
     from itertools import permutations, product
@@ -31,6 +32,47 @@ elmt = MonoisotopicElementMass()
 mfactory = MonoFactory()
 msym = MassSym()
 
+_adduct_masses = dict()
+def adduct_mass(adduct,mass_table=elmt):
+    key = (adduct,id(mass_table))
+    if key not in _adduct_masses:
+        # keep the mass table, so its id is not reused
+        _adduct_masses[key] = (Composition.fromstr(adduct).mass(mass_table),mass_table)
+    return _adduct_masses[key][0]
+
+def molecular_weights(glycans,permethylated=False,adduct=None,mass_table=elmt):
+    # Molecular weights of many glycans at once. Each glycan is
+    # reduced to counts of residue composition signatures, and the
+    # (glycan x signature) counts are multiplied by the signature
+    # masses, computed once per batch. None for glycans with residues
+    # missing from the composition table.
+    if permethylated:
+        comp_table = pctable
+        if adduct == None:
+            adduct = 'C2H6O'
+    else:
+        comp_table = ctable
+        if adduct == None:
+            adduct = 'H2O'
+    addmass = adduct_mass(adduct,mass_table)
+    sigmass = dict()
+    result = []
+    for g in glycans:
+        counts = defaultdict(int)
+        for m in g.all_nodes(undet_subst=True):
+            sig = m.composition_signature()
+            if sig not in sigmass:
+                try:
+                    sigmass[sig] = comp_table.residue_composition(m).mass(mass_table)
+                except KeyError:
+                    sigmass[sig] = None
+            counts[sig] += 1
+        if any(sigmass[sig] == None for sig in counts):
+            result.append(None)
+        else:
+            result.append(sum(n*sigmass[sig] for sig,n in counts.items()) + addmass)
+    return result
+
 class Glycan:
 
     iupacSym = IUPACSym()
@@ -58,6 +100,12 @@ class Glycan:
         for m in self.all_nodes(subst=True):
             m.unset_id()
 
+    def frozen(self):
+        return False
+
+    def freeze(self):
+        return FrozenGlycan(self)
+
     def set_undetermined(self, und):
         if und == None or len(und) == 0:
             self._undetermined = None
@@ -290,7 +338,8 @@ class Glycan:
         def visit(self,m):
 
             if self.comp:
-                eltcomp = m.composition(self.comp)
+                eltcomp = self.comp.new()
+                eltcomp.add(self.comp.residue_composition(m))
                 for c in m.children():
                     eltcomp.add(c._elemental_composition)
 
@@ -324,7 +373,7 @@ class Glycan:
     def elemental_composition(self,comp_table):
         eltcomp = Composition()
         for m in self.all_nodes(undet_subst=True):
-            ec = m.composition(comp_table)
+            ec = comp_table.residue_composition(m)
             eltcomp.add(ec)
         return eltcomp
 
@@ -359,11 +408,11 @@ class Glycan:
 
     def underivitized_molecular_weight(self,adduct='H2O'):
         return self.native_elemental_composition().mass(elmt) + \
-               Composition.fromstr(adduct).mass(elmt)
+               adduct_mass(adduct)
 
     def permethylated_molecular_weight(self,adduct='C2H6O'):
         return self.permethylated_elemental_composition().mass(elmt) + \
-               Composition.fromstr(adduct).mass(elmt)
+               adduct_mass(adduct)
 
     def fragments(self,r=None,force=False):
         atroot = False
@@ -427,7 +476,9 @@ class Glycan:
                 seen.add(m)
                 yield m
             if subst:
-                for s in m.substituents():
+                # in link order, not set order, so output is reproducible
+                for l in m.substituent_links():
+                    s = l.child()
                     if s not in seen:
                         seen.add(s)
                         yield s
@@ -598,6 +649,13 @@ class Glycan:
         # then the ids of each monosaccharide in each glycan will match
         # their counterpart.
 
+        # The ids of a frozen glycan are fixed, so ids are only mapped
+        # onto the other glycan, or, if both are frozen, onto a copy.
+        if g.frozen():
+            if self.frozen():
+                return self.equals(g.clone())
+            return g.equals(self)
+
         self.set_ids()
         g.unset_ids()
 
@@ -744,6 +802,169 @@ class Glycan:
         elif len(child_list) == 1:
             self.dump(child_list[0],level,br,monofmt)
 
+class FrozenGlycan(Glycan):
+
+    # Read-only snapshot of a glycan, see Glycan.freeze(), for
+    # comparison-heavy workloads. Node ids are assigned once, node i
+    # of nodes() has id i+1, so comparators need not set, unset or map
+    # ids, and a frozen glycan can be compared many times
+    # concurrently. Per node, it keeps the child (and parent) node
+    # indices in CSR arrays, the distance from the root by any link
+    # (mindist) and by instantiated links only (depth), a profile of
+    # link counts and distances, and an interned tuple of the node's
+    # own attributes and substituents.
+
+    unreachable = 2**31-1
+
+    # attribute tuple -> itself, shared by all frozen glycans
+    _interned = {}
+
+    def __init__(self,g):
+        g = g.clone()
+        self._root = g.root()
+        self._undetermined = g._undetermined
+        self._bions = None
+        self._yions = None
+
+        self._nodes = tuple(Glycan.all_nodes(self,subst=True))
+        for i,m in enumerate(self._nodes):
+            m.set_id(i+1)
+        self._monos = tuple(Glycan.all_nodes(self))
+        self._undetnodes = tuple(Glycan.all_nodes(self,undet_subst=True))
+        self._links = tuple(Glycan.all_links(self,uninstantiated=True))
+        self._instlinks = tuple(l for l in self._links if l.instantiated())
+
+        self._childptr = array('i',[0])
+        self._children = array('i')
+        self._childinst = array('b')
+        self._parentptr = array('i',[0])
+        self._parents = array('i')
+        self._ndetparents = array('i')
+        for m in self._nodes:
+            for l in m.links(instantiated_only=False):
+                self._children.append(l.child().id()-1)
+                self._childinst.append(l.instantiated())
+            self._childptr.append(len(self._children))
+            for l in m.parent_links():
+                self._parents.append(l.parent().id()-1)
+            self._parentptr.append(len(self._parents))
+            self._ndetparents.append(sum(1 for l in m.parent_links() if not l.undetermined()))
+
+        self._mindist = self._distances(instantiated_only=False)
+        self._depth = self._distances(instantiated_only=True)
+
+        self._profiles = []
+        self._keys = []
+        for i,m in enumerate(self._nodes):
+            c0,c1 = self._childptr[i],self._childptr[i+1]
+            profile = (self._parentptr[i+1]-self._parentptr[i],
+                       sum(self._childinst[c0:c1]),c1-c0,
+                       self._mindist[i],self._depth[i])
+            self._profiles.append(self._interned.setdefault(profile,profile))
+            key = self._nodekey(m)
+            self._keys.append(self._interned.setdefault(key,key))
+        self._profiles = tuple(self._profiles)
+        self._keys = tuple(self._keys)
+
+    def _distances(self,instantiated_only):
+        dist = array('i',[self.unreachable])*len(self._nodes)
+        if self._root == None:
+            return dist
+        todo = deque([self._root.id()-1])
+        dist[todo[0]] = 0
+        while len(todo) > 0:
+            i = todo.popleft()
+            for j in range(self._childptr[i],self._childptr[i+1]):
+                if instantiated_only and not self._childinst[j]:
+                    continue
+                c = self._children[j]
+                if dist[c] == self.unreachable:
+                    dist[c] = dist[i]+1
+                    todo.append(c)
+        return dist
+
+    @staticmethod
+    def _nodekey(m):
+        # everything a monosaccharide or substituent comparator may examine
+        if not m.is_monosaccharide():
+            return (m.name(),m.external_descriptor())
+        substs = tuple(sorted((sl.astuple(),sl.undetermined(),
+                               sl.child().name(),sl.child().external_descriptor())
+                              for sl in m.substituent_links(instantiated_only=False)))
+        return (m.anomer(),m.config(),m.stem(),m.superclass(),
+                m.ring_start(),m.ring_end(),m.mods(),
+                m.external_descriptor(),m.external_descriptor_id(),substs)
+
+    def frozen(self):
+        return True
+
+    def freeze(self):
+        return self
+
+    def set_root(self, r):
+        raise TypeError("FrozenGlycan is read-only")
+
+    def set_undetermined(self, und):
+        raise TypeError("FrozenGlycan is read-only")
+
+    def set_instantiation(self, inst):
+        raise TypeError("FrozenGlycan is read-only")
+
+    def set_ids(self):
+        # already set, once and for all
+        pass
+
+    def unset_ids(self):
+        # ids are fixed
+        pass
+
+    def nodes(self):
+        return self._nodes
+
+    def node(self,id):
+        return self._nodes[id-1]
+
+    def all_nodes(self,subst=False,undet_subst=False):
+        if subst:
+            return iter(self._nodes)
+        if undet_subst:
+            return iter(self._undetnodes)
+        return iter(self._monos)
+
+    def all_links(self,subst=False,uninstantiated=False):
+        if subst:
+            return Glycan.all_links(self,subst=subst,uninstantiated=uninstantiated)
+        if uninstantiated:
+            return iter(self._links)
+        return iter(self._instlinks)
+
+    def children(self,m,instantiated_only=True):
+        i = m.id()-1
+        return tuple(self._nodes[self._children[j]]
+                     for j in range(self._childptr[i],self._childptr[i+1])
+                     if not instantiated_only or self._childinst[j])
+
+    def parents(self,m):
+        i = m.id()-1
+        return tuple(self._nodes[self._parents[j]]
+                     for j in range(self._parentptr[i],self._parentptr[i+1]))
+
+    def mindist(self,m):
+        return self._mindist[m.id()-1]
+
+    def depth(self,m):
+        return self._depth[m.id()-1]
+
+    def determined_parent_count(self,m):
+        return self._ndetparents[m.id()-1]
+
+    def profile(self,m):
+        # (#parent links, #instantiated child links, #child links, mindist, depth)
+        return self._profiles[m.id()-1]
+
+    def nodekey(self,m):
+        return self._keys[m.id()-1]
+
 if __name__ == '__main__':
 
     from . MonoFactory import MonoFactory
@@ -5,11 +5,14 @@ from . MonoFormatter import GlycoCTMonoFormat, LinCodeSym, LinCodeRank, IUPACSym
 from . Monosaccharide import Monosaccharide, Linkage, Anomer, Substituent, Mod
 from . Glycan import Glycan
 from . MonoFactory import MonoFactory
+from . workerpool import windowed
 
 import re, sys, traceback
 import copy
 import string
-from collections import defaultdict
+import itertools
+import multiprocessing
+from collections import defaultdict, deque
 
 class GlycanFormatter:
     def writeToFile(self,thefile,glycan):
@@ -1240,7 +1243,7 @@ class IUPACGlycamWriter:
     def ChildrenNumIncludingItself(self, id, d):
         gr = d[id]
         num = len(list(Glycan(gr).all_nodes()))
-        if num == 1 and gr._stem == tuple([14]) and gr._mods == [((6,), 1)]:
+        if num == 1 and gr._stem == tuple([14]) and gr._mods == (((6,), 1),):
             # this method is used to sort the children branches
             # If we have multiple branch under a branch point
             # And one branch is a single Fructose
@@ -1323,6 +1326,13 @@ class WURCS20Format(GlycanFormatter):
         self.compsubstlinkre = re.compile(r'^([a-zA-Z]{1,2}[0-9?](\|[a-zA-Z]{1,2}[0-9?])*)\}\*(.*)$')
         self.substbridgelinkre = re.compile(r"^([a-zA-Z]{1,2})([0-9?])-([a-zA-Z]{1,2})([0-9?])\*(.*?)$")
         self.substbridgecompre = re.compile(r"^([a-zA-Z]{1,2}[?](\|[a-zA-Z]{1,2}[?])*)\}-\{([a-zA-Z]{1,2}[?](\|[a-zA-Z]{1,2}[?])*)\*(.*?)$")
+        # link kind -> candidate link patterns, see linkkind
+        self.linkdispatch = {
+            (False, False): (self.simplelinkre, self.multilinkre),
+            (True, False):  (self.substbridgelinkre,),
+            (True, True):   (self.substbridgecompre, self.compsubstlinkre),
+            (False, True):  (self.ambiglinkre, self.complinkre),
+        }
         self.char2int = {}
         self.int2char = {}
         for i in range(26):
@@ -1340,6 +1350,13 @@ class WURCS20Format(GlycanFormatter):
                 self.int2char[intfordoubledigit] = doubledigit
                 self.char2int[doubledigit] = intfordoubledigit
 
+    @staticmethod
+    def linkkind(li):
+        # (substituent link?, composition link?) - the '*' and '}'
+        # characters that the link patterns require
+        head = li.split('*',1)[0]
+        return (len(head) < len(li), '}' in head)
+
     def toGlycan(self,s):
         m = self.wurcsre.search(s)
         if not m:
@@ -1364,8 +1381,12 @@ class WURCS20Format(GlycanFormatter):
 
             if not li:
                 continue
+
+            # Only the link patterns consistent with the link's '*' and
+            # '}' characters are tried, in the original order.
+            linkres = self.linkdispatch[self.linkkind(li)]
             
-            mi = self.simplelinkre.search(li)
+            mi = self.simplelinkre in linkres and self.simplelinkre.search(li)
             if mi:
                 
                 ind1 = self.char2int[mi.group(1)]
@@ -1403,7 +1424,7 @@ class WURCS20Format(GlycanFormatter):
                                      child_type=Linkage.oxygenLost)
                 continue
 
-            mi = self.multilinkre.search(li)
+            mi = self.multilinkre in linkres and self.multilinkre.search(li)
             if mi:
 
                 ind1 = self.char2int[mi.group(1)]
@@ -1433,7 +1454,7 @@ class WURCS20Format(GlycanFormatter):
 
                 continue
 
-            mi = self.substbridgelinkre.search(li)
+            mi = self.substbridgelinkre in linkres and self.substbridgelinkre.search(li)
             if mi:
                 #print mi.group()
                 ind1 = self.char2int[mi.group(1)]
@@ -1444,8 +1465,9 @@ class WURCS20Format(GlycanFormatter):
                 wurcssubststr = mi.group(5).replace("*", "")
                 subst = self.mf.getsubst(wurcssubststr)
 
-                substparenttype1 = eval(self.mf.subsconfig.get(wurcssubststr, "parent_type"))
-                substchildtype1 = eval(self.mf.subsconfig.get(wurcssubststr, "child_type"))
+                substcode = self.mf.substituent(wurcssubststr)
+                substparenttype1 = substcode.parent_type
+                substchildtype1 = substcode.child_type
                 substparenttype2 = Linkage.nitrogenAdded
                 substchildtype2 = Linkage.oxygenPreserved
 
@@ -1463,7 +1485,7 @@ class WURCS20Format(GlycanFormatter):
                 #print substparenttype1, substparenttype2
                 continue
 
-            mi = self.substbridgecompre.search(li)
+            mi = self.substbridgecompre in linkres and self.substbridgecompre.search(li)
             if mi:
                 # composition like substituent in link-situation
                 # TODO anything to do with link?
@@ -1474,7 +1496,7 @@ class WURCS20Format(GlycanFormatter):
                 continue
 
 
-            mi = self.ambiglinkre.search(li)
+            mi = self.ambiglinkre in linkres and self.ambiglinkre.search(li)
             if mi:
 
                 ind1 = self.char2int[mi.group(1)]
@@ -1517,11 +1539,11 @@ class WURCS20Format(GlycanFormatter):
 
                 continue
 
-            mi = self.complinkre.search(li)
+            mi = self.complinkre in linkres and self.complinkre.search(li)
             if mi:
                 continue
 
-            mi = self.compsubstlinkre.search(li)
+            mi = self.compsubstlinkre in linkres and self.compsubstlinkre.search(li)
             if mi:
                 subst = self.mf.getsubst(mi.group(3))
                 subst.set_connected(False)
@@ -1578,6 +1600,153 @@ class WURCS20Format(GlycanFormatter):
             g.set_undetermined(set(list(unconnected)+floating_substs))
         return g
 
+class GlycanParseFailure(object):
+    """
+    Structured parse error record, as yielded by parse_many: the
+    exception class and message, and for WURCS sequences, the
+    unsupported skeleton codes, unsupported substituents and invalid
+    residues found in the sequence.
+    """
+    others = [(ZeroPlusLinkCountError, "0+ link count"),
+              (UndeterminedLinkCountError, "undetermined link count"),
+              (CircularError, "circular"),
+              (LinkCountError, "bad link count")]
+
+    def __init__(self, error, skeletons=(), substituents=(), invalid=()):
+        self.errorclass = error.__class__
+        self.message = getattr(error, 'message', None) or str(error)
+        self.skeletons = set(skeletons)
+        self.substituents = set(substituents)
+        self.invalid = set(invalid)
+
+    def error(self):
+        return self.errorclass.__name__
+
+    def other(self):
+        for cls, label in self.others:
+            if issubclass(self.errorclass, cls):
+                return set([label])
+        return set()
+
+    def codes(self):
+        # same as GlyTouCanUtil.getUnsupportedCodes
+        return self.skeletons, self.substituents, self.invalid, self.other()
+
+    def __nonzero__(self):
+        return False
+    __bool__ = __nonzero__
+
+    def __str__(self):
+        return "%s: %s" % (self.error(), self.message)
+
+parse_formats = dict(wurcs=WURCS20Format, glycoct=GlycoCTFormat)
+
+def wurcs_residue_errors(mono_format, seq):
+    skeletons = set(); substituents = set(); invalid = set()
+    try:
+        monos = seq.split('/[', 1)[1].split(']/')[0].split('][')
+    except IndexError:
+        monos = []
+    for ms in monos:
+        try:
+            mono_format.parsing(ms)
+        except WURCS20MonoFormatter.UnsupportedSkeletonCodeError as e:
+            skeletons.add(e.message.rsplit(None, 1)[-1])
+        except WURCS20MonoFormatter.UnsupportedSubstituentError as e:
+            substituents.add(e.message.rsplit(None, 1)[-1])
+        except WURCS20MonoFormatter.InvalidMonoError as e:
+            invalid.add(e.message.rsplit(None, 1)[-1])
+        except GlycanParseError:
+            pass
+    return skeletons, substituents, invalid
+
+def parse_one(parser, seq):
+    """
+    Parse seq with parser, returning the Glycan or, if it cannot be
+    parsed, a GlycanParseFailure record. Errors other than
+    GlycanParseError are raised.
+    """
+    try:
+        return parser.toGlycan(seq)
+    except GlycanParseError as e:
+        if isinstance(parser, WURCS20Format):
+            return GlycanParseFailure(e, *wurcs_residue_errors(parser.mf, seq))
+        return GlycanParseFailure(e)
+
+_parse_many_parser = None
+_parse_many_transform = None
+
+def _parse_many_init(format, transform):
+    global _parse_many_parser, _parse_many_transform
+    _parse_many_parser = format()
+    _parse_many_transform = transform
+
+def _parse_many_chunk(seqs):
+    # (True, results) or (False, traceback): a failure is returned rather
+    # than raised, as an exception that does not unpickle in the parent
+    # leaves the pool waiting for its result forever
+    try:
+        return True, [ parse_transform(_parse_many_parser, seq, _parse_many_transform) for seq in seqs ]
+    except:
+        return False, traceback.format_exc()
+
+def parse_transform(parser, seq, transform=None):
+    g = parse_one(parser, seq)
+    if transform is None or isinstance(g, GlycanParseFailure):
+        return g
+    return transform(g)
+
+def parse_many(sequences, format="wurcs", workers=1, transform=None, chunksize=500, window=None):
+    """
+    Parse (accession, sequence) pairs, yielding (accession, result) in
+    input order, where result is a Glycan or a GlycanParseFailure
+    record (which is False in a boolean context).
+
+    format is "wurcs", "glycoct" or a GlycanFormatter class. With
+    workers > 1, chunks of chunksize sequences are parsed in a
+    process pool, with at most window (default 4*workers) chunks in
+    flight, so sequences can be streamed from a large dump.
+
+    If transform is given, it is applied to each parsed Glycan and its
+    value yielded instead. Returning Glycan objects from the workers
+    costs more than parsing them, so workers > 1 pays off when the
+    per-glycan work is done by transform (in the workers) and only its
+    (small) result comes back.
+
+    Errors other than GlycanParseError, including those of transform,
+    are raised, from a worker as a RuntimeError with its traceback.
+    """
+    format = parse_formats.get(format, format)
+    if workers <= 1:
+        parser = format()
+        for acc, seq in sequences:
+            yield acc, parse_transform(parser, seq, transform)
+        return
+
+    if window is None:
+        window = 4*workers
+    sequences = iter(sequences)
+    # accessions of the chunks handed out, results come back in order
+    pending = deque()
+    def tasks():
+        while True:
+            chunk = list(itertools.islice(sequences, chunksize))
+            if len(chunk) == 0:
+                return
+            pending.append([ acc for acc, seq in chunk ])
+            yield ([ seq for acc, seq in chunk ],)
+    pool = multiprocessing.Pool(workers, _parse_many_init, (format, transform))
+    results = windowed(pool, _parse_many_chunk, tasks(), window)
+    try:
+        for ok, result in results:
+            if not ok:
+                raise RuntimeError("Worker failed:\n" + result)
+            for acc, g in zip(pending.popleft(), result):
+                yield acc, g
+    finally:
+        # terminates the pool, if not done
+        results.close()
+
 if __name__ == '__main__':
     import sys, os.path
     clsinst = eval("%s()"%sys.argv[1])
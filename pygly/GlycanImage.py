@@ -1,6 +1,8 @@
 
-from JavaProgram import GlycoCT2Image
-from GlycanFormatter import GlycoCTFormat
+from JavaProgram import GlycoCT2Image, GlycoCT2ImageWorker
+from GlycanFormatter import GlycoCTFormat, WURCS20Format, GlycanParseError
+from multiprocessing.pool import ThreadPool
+import Queue, hashlib, os, os.path, sys
 
 class GlycanImage(object):
     def __init__(self):
@@ -13,7 +15,11 @@ class GlycanImage(object):
         self._opaque = True
         self._force = False
 	self._verbose = False
+        self._workers = 0
+        self._pool = None
+        self._serve = True
         self.fmt = GlycoCTFormat()
+        self.wurcsfmt = None
         
     def scale(self,value=None):
         if value == None:
@@ -60,25 +66,195 @@ class GlycanImage(object):
 	    return self._verbose
 	self._verbose = value
 
+    def workers(self, value=None):
+        # Number of persistent JVM workers, 0 starts a JVM per image.
+        # Workers need a GlycoCT2ImageBundle jar rebuilt from
+        # src/pygly/GlycoCT2Image with its serve mode; with an older jar,
+        # the first image finds none and a JVM is started per image.
+        if value == None:
+            return self._workers
+        self.close()
+        self._workers = int(value)
+        self._serve = True
+
     def set(self,key,value):
 	if not hasattr(self,key):
 	    raise KeyError(key)
 	getattr(self,key)(value)	
 
+    def options(self):
+        return dict(format=self._format,
+                    force=str(self._force).lower(),
+                    scale=self._scale,
+                    redend=str(self._redend).lower(),
+                    orient=self._orientation,
+                    display=self._display,
+                    notation=self._notation,
+                    opaque=str(self._opaque).lower())
+
+    def glycanstr(self,glycan):
+	if isinstance(glycan,basestring):
+	    return glycan
+	return self.fmt.toStr(glycan)
+
     def writeImage(self,glycan,filename):
-	glystr = glycan
-	if not isinstance(glystr,basestring):
-	    glystr = self.fmt.toStr(glycan)
+        """
+        Write the image of glycan (a Glycan or GlycoCT) to filename.
+        Returns True if the image was written, or, without force,
+        already exists, and False otherwise, with or without workers.
+        This used to be the GlycoCT2Image output, or, if verbose,
+        whether it exited with an error.
+        """
+        status = self.render(self.glycanstr(glycan),filename,self.options())
+        return (status[0] != "ERROR")
+
+    def render(self,glystr,filename,options):
+        # (status, filename[, message]), status is OK, SKIP or ERROR, from
+        # a persistent worker, or else from a JVM started for this image
+        if self._workers > 0 and self._serve:
+            worker = self.acquire()
+            try:
+                status = worker.write(glystr,filename,**options)
+                if status[0] != "ERROR" or worker.serves():
+                    return status
+            finally:
+                self.release(worker)
+            # the installed jar has no serve mode, or java did not start
+            self._serve = False
+            if self._verbose:
+                print >>sys.stderr, "GlycoCT2Image workers unavailable, starting a JVM per image"
+        existed = os.path.exists(filename)
+        if existed and options.get('force') != 'true':
+            return ("SKIP",filename)
+        before = (os.path.getmtime(filename) if existed else None)
         imageWriter = GlycoCT2Image(glystr,
                                     filename,
-                                    format=self._format,
-                                    force=str(self._force).lower(),
-                                    scale=self._scale,
-                                    redend=str(self._redend).lower(),
-                                    orient=self._orientation,
-                                    display=self._display,
-                                    notation=self._notation,
-                                    opaque=str(self._opaque).lower(),
                                     verbose=self._verbose,
-				    stdout=(not self._verbose))
-        return imageWriter()
+				    stdout=(not self._verbose),
+                                    **options)
+        imageWriter()
+        if os.path.exists(filename) and os.path.getsize(filename) > 0 and \
+               os.path.getmtime(filename) != before:
+            return ("OK",filename)
+        return ("ERROR",filename,"image not written")
+
+    def writeImages(self,images,**kw):
+        """
+        Write (glycan, filename) pairs using the persistent workers (at
+        least one), keeping all of them busy. Yields the status tuple of
+        each image, in order. Keyword arguments override image options.
+        If the workers are unavailable, a JVM is started per image.
+        """
+        if self._workers < 1:
+            self.workers(1)
+        options = self.options()
+        options.update(kw)
+        def _write(args):
+            glystr,filename = args
+            return self.render(glystr,filename,options)
+        # glycans are formatted by the pool's (single) task thread
+        tasks = ((self.glycanstr(g),f) for g,f in images)
+        threads = ThreadPool(self._workers)
+        try:
+            for status in threads.imap(_write,tasks):
+                yield status
+        finally:
+            threads.terminate()
+
+    def canonicalstr(self,glycan):
+        if isinstance(glycan,basestring):
+            try:
+                if glycan.lstrip().startswith('WURCS'):
+                    if not self.wurcsfmt:
+                        self.wurcsfmt = WURCS20Format()
+                    glycan = self.wurcsfmt.toGlycan(glycan)
+                else:
+                    glycan = self.fmt.toGlycan(glycan)
+            except GlycanParseError:
+                return glycan.strip()
+        # GlycoCT, with its UND section, is complete, and reproducible
+        # as substituents are written in link order
+        return self.fmt.toStr(glycan)
+
+    def imagehash(self,glycan):
+        # Content hash of the glycan (as GlycoCT) and the image options
+        h = hashlib.sha1(self.canonicalstr(glycan).strip())
+        for k,v in sorted(self.options().items()):
+            if k != 'force':
+                h.update("\t%s=%s"%(k,v))
+        return h.hexdigest()
+
+    @staticmethod
+    def readManifest(filename):
+        manifest = {}
+        if os.path.exists(filename):
+            for l in open(filename):
+                sl = l.rstrip('\n').split('\t')
+                if len(sl) == 2:
+                    manifest[sl[0]] = sl[1]
+        return manifest
+
+    @staticmethod
+    def writeManifest(filename,manifest):
+        wh = open(filename+".tmp",'w')
+        for acc in sorted(manifest):
+            print >>wh, "%s\t%s"%(acc,manifest[acc])
+        wh.close()
+        os.rename(filename+".tmp",filename)
+
+    def writeCachedImages(self,images,outdir,manifest=None):
+        """
+        Render (accession, glycan) pairs to outdir/<hash>.<format>, see
+        imagehash. Images already in outdir are neither re-rendered nor
+        touched, the rest are rendered by the persistent workers. The
+        manifest (default outdir/manifest.tsv) maps accession to image
+        hash. Returns the number of images cached, rendered, and failed.
+        """
+        if not manifest:
+            manifest = os.path.join(outdir,"manifest.tsv")
+        entries = self.readManifest(manifest)
+        torender = {}
+        counts = dict(cached=0,rendered=0,failed=0)
+        for acc,glycan in images:
+            h = self.imagehash(glycan)
+            entries[acc] = h
+            if os.path.exists(os.path.join(outdir,"%s.%s"%(h,self._format))):
+                counts['cached'] += 1
+            elif h not in torender:
+                torender[h] = glycan
+        # render to a temporary name, so a failed render is never cached
+        def _images():
+            for h,glycan in torender.items():
+                yield glycan,os.path.join(outdir,"%s.partial.%s"%(h,self._format))
+        for status in self.writeImages(_images(),force='true'):
+            partial = status[1]
+            final = partial.replace(".partial.",".",1)
+            if status[0] == "OK" and os.path.exists(partial):
+                os.rename(partial,final)
+                counts['rendered'] += 1
+            else:
+                if os.path.exists(partial):
+                    os.unlink(partial)
+                counts['failed'] += 1
+        for acc in list(entries):
+            if not os.path.exists(os.path.join(outdir,"%s.%s"%(entries[acc],self._format))):
+                del entries[acc]
+        self.writeManifest(manifest,entries)
+        return counts
+
+    def acquire(self):
+        if self._pool == None:
+            self._pool = Queue.Queue()
+            for i in range(self._workers):
+                self._pool.put(GlycoCT2ImageWorker(verbose=self._verbose))
+        return self._pool.get()
+
+    def release(self,worker):
+        self._pool.put(worker)
+
+    def close(self):
+        if self._pool == None:
+            return
+        while not self._pool.empty():
+            self._pool.get().stop()
+        self._pool = None
@@ -3,7 +3,8 @@ try:
     from pygly.GlycanFormatter import WURCS20Format, GlycoCTFormat, \
                                       GlycanParseError, ZeroPlusLinkCountError, \
                                       UndeterminedLinkCountError, CircularError, \
-                                      LinkCountError
+                                      LinkCountError, \
+                                      GlycanParseFailure, parse_one
 
     from pygly.WURCS20MonoFormatter import WURCS20MonoFormat, \
                                            UnsupportedSkeletonCodeError, \
@@ -13,71 +14,125 @@ except ImportError:
     from .. GlycanFormatter import WURCS20Format, GlycoCTFormat, \
                                 GlycanParseError, ZeroPlusLinkCountError, \
                                 UndeterminedLinkCountError, CircularError, \
-                                LinkCountError
+                                LinkCountError, \
+                                GlycanParseFailure, parse_one
 
     from .. WURCS20MonoFormatter import WURCS20MonoFormat, \
                                      UnsupportedSkeletonCodeError, \
                                      UnsupportedSubstituentError, \
                                      InvalidMonoError
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import hashlib
+
+class GlycanCache(object):
+    """
+    Bounded LRU cache of parsed sequences, keyed on (accession, format,
+    sequence hash), so a changed sequence for an accession is never
+    served from the cache. Parse failures are cached (as None) too.
+    """
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.clear()
+
+    def clear(self):
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(acc, format, sequence):
+        if not isinstance(sequence, bytes):
+            sequence = sequence.encode('utf8')
+        return (acc, format, hashlib.md5(sequence).hexdigest())
+
+    def get(self, key):
+        try:
+            value = self._cache.pop(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self._cache[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._cache.pop(key, None)
+        self._cache[key] = value
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self._cache), maxsize=self.maxsize)
 
 class GlyTouCanUtil(object):
     _wurcs_mono_format = WURCS20MonoFormat()
     _wurcs_format = WURCS20Format()
     _glycoct_format = GlycoCTFormat()
     _alphamap = None
+    _glycan_cache = GlycanCache()
+
+    def glycan_cache_stats(self):
+        return self._glycan_cache.stats()
+
+    def _parsed(self, acc, format, sequence):
+        # Shared parsed instance - callers must not modify it.
+        key = self._glycan_cache.key(acc, format, sequence)
+        try:
+            return self._glycan_cache.get(key)
+        except KeyError:
+            pass
+        parser = (self._wurcs_format if format == 'wurcs' else self._glycoct_format)
+        try:
+            g = parser.toGlycan(sequence)
+        except GlycanParseError:
+            g = None
+        self._glycan_cache.put(key, g)
+        return g
+
+    def _getGlycan(self, acc, format=None):
+        for fmt in ('wurcs', 'glycoct'):
+            if format and format != fmt:
+                continue
+            sequence = self.getseq(acc, fmt)
+            if sequence:
+                g = self._parsed(acc, fmt, sequence)
+                if g is not None:
+                    return g
+        return None
 
     def getUnsupportedCodes(self, acc):
-        codes = set()
-        substs = set()
-        invalid = set()
-        other = set()
         sequence = self.getseq(acc, 'wurcs')
         if not sequence:
-            return codes, substs, invalid, other
-        monos = sequence.split('/[', 1)[1].split(']/')[0].split('][')
-        for m in monos:
-            try:
-                g = self._wurcs_mono_format.parsing(m)
-            except UnsupportedSkeletonCodeError as e:
-                codes.add(e.message.rsplit(None, 1)[-1])
-            except UnsupportedSubstituentError as e:
-                substs.add(e.message.rsplit(None, 1)[-1])
-            except InvalidMonoError as e:
-                invalid.add(e.message.rsplit(None, 1)[-1])
-            except GlycanParseError:
-                pass
+            return set(), set(), set(), set()
+        key = self._glycan_cache.key(acc, 'unsupported', sequence)
         try:
-            g = self._wurcs_format.toGlycan(sequence)
-        except ZeroPlusLinkCountError:
-            other.add("0+ link count")
-        except UndeterminedLinkCountError:
-            other.add("undetermined link count")
-        except CircularError:
-            other.add("circular")
-        except LinkCountError:
-            other.add("bad link count")
-        except GlycanParseError:
-            pass
-        return codes, substs, invalid, other
+            result = self._glycan_cache.get(key)
+        except KeyError:
+            result = self._getUnsupportedCodes(acc, sequence)
+            self._glycan_cache.put(key, result)
+        return tuple(set(s) for s in result)
+
+    def _getUnsupportedCodes(self, acc, sequence):
+        g = parse_one(self._wurcs_format, sequence)
+        if isinstance(g, GlycanParseFailure):
+            result = g.codes()
+            g = None
+        else:
+            result = set(), set(), set(), set()
+        # Parsed anyway, so seed the glycan cache for getGlycan/umw
+        self._glycan_cache.put(self._glycan_cache.key(acc, 'wurcs', sequence), g)
+        return result
 
     def getGlycan(self, acc, format=None):
-        if not format or (format == 'wurcs'):
-            sequence = self.getseq(acc, 'wurcs')
-            if sequence:
-                try:
-                    return self._wurcs_format.toGlycan(sequence)
-                except GlycanParseError:
-                    pass  # traceback.print_exc()
-        if not format or (format == 'glycoct'):
-            sequence = self.getseq(acc, 'glycoct')
-            if sequence:
-                try:
-                    return self._glycoct_format.toGlycan(sequence)
-                except GlycanParseError:
-                    pass
-        return None
+        g = self._getGlycan(acc, format)
+        if g is None:
+            return None
+        return g.clone()
 
     def glycoct(self, acc, fetch=None):
         g = self.getGlycan(acc,fetch)
@@ -86,7 +141,7 @@ class GlyTouCanUtil(object):
         return g.glycoct()
 
     def umw(self, acc, fetch=None):
-        g = self.getGlycan(acc,fetch)                                                                             
+        g = self._getGlycan(acc,fetch)
         if not g:
             return None
         try:
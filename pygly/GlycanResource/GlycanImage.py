@@ -9,8 +9,11 @@ import tempfile, os.path, traceback
 from .GlyTouCan import GlyTouCan
 
 class GlycanImage(object):
-    def __init__(self):
+    def __init__(self,workers=0):
         self.imageWriter = GI()
+        # persistent JVM workers need a GlycoCT2ImageBundle jar with serve mode
+        if workers:
+            self.imageWriter.workers(workers)
         self.gtc = GlyTouCan(prefetch=False)
     def write(self,*args,**kw):
         kw['format'] = kw.get('format','png')
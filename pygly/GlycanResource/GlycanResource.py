@@ -1,10 +1,31 @@
 
 import time
+import threading
 try:
     from pygly.ReferenceTable import ReferenceTable
 except ImportError:
     from ReferenceTable import ReferenceTable
 
+class RateLimiter(object):
+    """
+       Thread-safe request rate limiter: at most batch requests per
+       delay seconds, on average, with bursts of up to batch requests.
+    """
+
+    def __init__(self,delay,batch=1):
+        self._interval = float(delay)/max(batch,1)
+        self._burst = max(batch,1)-1
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.time()
+            slot = max(self._next,now-self._burst*self._interval)
+            self._next = slot + self._interval
+        if slot > now:
+            time.sleep(slot-now)
+
 class GlycanResource(ReferenceTable):
     """
        Abstract base class for glycan resources whose data is
@@ -14,27 +35,42 @@ class GlycanResource(ReferenceTable):
        delaybatch: Size of request batches with no waiting time, default 1 (no batches)
        retries: Maximum number of retries: default 4
 
+       Request rates are limited per service (see ratelimitkey), across
+       all instances and threads.
+
     """
 
+    _ratelimiters = {}
+    _ratelimiterslock = threading.Lock()
+
     def __init__(self,**kw):
         self._delaybatch = kw.get('delaybatch',1)
         self._delaytime = kw.get('delaytime',0.2)
         self._retries = kw.get('retries',4)
-        self._lastrequesttime = 0
-        self._requestcount = 0
+        self._ratelimiter = None
 
         super(GlycanResource,self).__init__(iniFile=kw.get('iniFile'))
 
+    def ratelimitkey(self):
+        for key in ('_endpt','_apiurl'):
+            if getattr(self,key,None):
+                return getattr(self,key)
+        return self.__class__.__name__
+
+    def ratelimiter(self):
+        if self._ratelimiter is None:
+            key = self.ratelimitkey()
+            with self._ratelimiterslock:
+                if key not in self._ratelimiters:
+                    self._ratelimiters[key] = RateLimiter(self._delaytime,self._delaybatch)
+                self._ratelimiter = self._ratelimiters[key]
+        return self._ratelimiter
+
     def wait(self,delay=None):
-        elapsed = time.time() - self._lastrequesttime
+        # delay is an additional (retry) backoff for the calling thread only
         if delay != None:
-            if elapsed < delay:
-                time.sleep(delay-elapsed)
-        elif (self._requestcount % self._delaybatch) == 0 and self._requestcount > 0:
-            if elapsed < self._delaytime:
-                time.sleep(self._delaytime-elapsed)
-        self._lastrequesttime = time.time()
-        self._requestcount += 1
+            time.sleep(delay)
+        self.ratelimiter().acquire()
 
     def attr(self,kw,key,default=None,required=False):
         if hasattr(self,key):
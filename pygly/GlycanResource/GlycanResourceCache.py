@@ -0,0 +1,159 @@
+
+from __future__ import print_function
+
+import sys
+import os.path
+import time
+import shelve
+import sqlite3
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+class SQLiteCache(object):
+
+    """
+    Single-file prefetch cache for TripleStoreResource, rows are stored
+    per (query key, accession) so point lookups use the index and full
+    iteration streams rows, rather than unpickling the whole query.
+
+    filename: SQLite database file
+    mode: 'r' (read-only, file must exist), 'w', or 'c' (create)
+    maxage: Seconds before a cached query is considered stale, default None (never)
+
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS queries (
+            key TEXT PRIMARY KEY,
+            created REAL NOT NULL,
+            nrows INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rows (
+            key TEXT NOT NULL,
+            accession TEXT,
+            row BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS rows_key_accession ON rows (key, accession);
+    """
+
+    def __init__(self,filename,mode='r',maxage=None):
+        if mode == 'r' and not os.path.exists(filename):
+            raise IOError("Cache file %s not found"%(filename,))
+        self._filename = filename
+        self._readonly = (mode == 'r')
+        self._maxage = maxage
+        self._conn = sqlite3.connect(filename,timeout=60)
+        self._conn.text_factory = str
+        if not self._readonly:
+            self._conn.executescript(self.schema)
+            self._conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def info(self,key):
+        row = self._conn.execute("SELECT created, nrows FROM queries WHERE key = ?",
+                                 (key,)).fetchone()
+        if row is None:
+            return None
+        return dict(created=row[0],nrows=row[1],age=(time.time()-row[0]))
+
+    def fresh(self,key):
+        info = self.info(key)
+        if info is None:
+            return False
+        return (self._maxage is None or info['age'] <= self._maxage)
+
+    def __contains__(self,key):
+        return self.fresh(key)
+
+    def keys(self):
+        return [ r[0] for r in self._conn.execute("SELECT key FROM queries ORDER BY key") ]
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+
+    def rows(self,key,accession=None):
+        if accession is None:
+            cursor = self._conn.execute("SELECT row FROM rows WHERE key = ? ORDER BY rowid",
+                                        (key,))
+        else:
+            cursor = self._conn.execute("SELECT row FROM rows WHERE key = ? AND accession = ? ORDER BY rowid",
+                                        (key,accession))
+        for r in cursor:
+            yield pickle.loads(bytes(r[0]))
+
+    def __getitem__(self,key):
+        # shelve-style access to a whole query, {accession: [rows]}
+        if key not in self:
+            raise KeyError(key)
+        value = {}
+        cursor = self._conn.execute("SELECT accession, row FROM rows WHERE key = ? ORDER BY rowid",
+                                    (key,))
+        for acc,row in cursor:
+            value.setdefault(acc,[]).append(pickle.loads(bytes(row)))
+        return value
+
+    def __setitem__(self,key,value):
+        self.put(key,value)
+
+    def put(self,key,value):
+        # value is {accession: [rows]}, as built by the prefetcher; the
+        # query is replaced in a single transaction.
+        assert not self._readonly
+        def _rows():
+            for acc,rows in value.items():
+                for row in rows:
+                    yield key,acc,sqlite3.Binary(pickle.dumps(row,2))
+        with self._conn:
+            self._conn.execute("DELETE FROM rows WHERE key = ?",(key,))
+            self._conn.executemany("INSERT INTO rows (key, accession, row) VALUES (?, ?, ?)",
+                                   _rows())
+            nrows = sum(map(len,value.values()))
+            self._conn.execute("INSERT OR REPLACE INTO queries (key, created, nrows) VALUES (?, ?, ?)",
+                               (key,time.time(),nrows))
+
+    def __delitem__(self,key):
+        assert not self._readonly
+        with self._conn:
+            self._conn.execute("DELETE FROM rows WHERE key = ?",(key,))
+            self._conn.execute("DELETE FROM queries WHERE key = ?",(key,))
+
+    def sync(self):
+        pass
+
+    def importshelve(self,shelvefile,verbose=False):
+        try:
+            cache = shelve.open(shelvefile,flag='r')
+        except Exception:
+            return 0
+        count = 0
+        try:
+            for key in cache.keys():
+                if verbose:
+                    print("Import key",key,"from shelve:",shelvefile, file=sys.stderr)
+                self.put(key,cache[key])
+                count += 1
+        finally:
+            cache.close()
+        return count
+
+if __name__ == "__main__":
+
+    # python -m pygly.GlycanResource.GlycanResourceCache import .gtc.cache .gtc.cache.sqlite
+    cmd = sys.argv[1]
+    if cmd == "import":
+        cache = SQLiteCache(sys.argv[3],mode='c')
+        print("Imported %d queries"%(cache.importshelve(sys.argv[2],verbose=True),), file=sys.stderr)
+        cache.close()
+    elif cmd == "info":
+        cache = SQLiteCache(sys.argv[2],mode='r')
+        for key in cache.keys():
+            info = cache.info(key)
+            print("%s\t%d\t%s"%(key,info['nrows'],time.strftime("%Y-%m-%d %H:%M:%S",time.localtime(info['created']))))
+        cache.close()
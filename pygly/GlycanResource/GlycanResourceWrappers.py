@@ -1,10 +1,32 @@
 
+from multiprocessing.pool import ThreadPool
+
+def concurrent(self,fn,args,kw,kwarg,values):
+    # Partition queries run on a bounded thread pool, rows are
+    # returned in partition order, same as the serial iteration.
+    def _rows(value):
+        kw1 = dict(kw)
+        kw1[kwarg] = value
+        return list(fn(self,*args,**kw1))
+    pool = ThreadPool(min(self._threads,len(values)))
+    try:
+        for rows in pool.imap(_rows,values):
+            for row in rows:
+                yield row
+    finally:
+        pool.terminate()
+
 # Defaults ensure a 10-way partition of GlyTouCan accessions
 def partitioner(kwarg="accession",fmt="G%%0%dd.*",digits=1,values='decimal'):
     fmtstr = fmt%(digits,)
     def partition(fn):
         def wrapper(self,*args,**kw):
-            if kwarg not in kw:
+            if kwarg not in kw and getattr(self,'_threads',1) > 1:
+                base = (10 if values == "decimal" else 16)
+                for row in concurrent(self,fn,args,kw,kwarg,
+                                      [fmtstr%(i,) for i in range(0,base**digits)]):
+                    yield row
+            elif kwarg not in kw:
                 if values == "decimal":
                     for i in range(0,10**digits):
                         kw[kwarg] = fmtstr%(i,)
@@ -30,6 +52,12 @@ def prefetcher(kwarg='accession',**kw):
             kw1 = dict((k,v) for k,v in list(kw.items()) if k != kwarg)
             key = fn.__name__+":"+":".join("%s=%s"%(k,v) for k,v in sorted(kw1.items()))
             # print >>sys.stderr, "cache key:",key
+            if key not in self._cache and usecache and self.sqlitecache() and \
+                   key in self._cacheondisk:
+                # Rows are read from the indexed store, not loaded whole
+                for row in self._cacheondisk.rows(key,kw.get(kwarg)):
+                    yield row
+                return
             if key not in self._cache:
                 if not usecache or key not in self._cacheondisk:
                     # print >>sys.stderr, "fill cache:",key
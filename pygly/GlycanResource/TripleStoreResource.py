@@ -2,8 +2,11 @@
 from __future__ import print_function
 
 import sys
+import os.path
 import re
+import io
 import traceback
+import threading
 
 import warnings
 warnings.filterwarnings('ignore')
@@ -12,12 +15,18 @@ import rdflib
 
 import shelve
 
+try:
+    import requests
+except ImportError:
+    requests = None
+
 try:
     from pygly.lockfile import FileLock
 except ImportError:
     from .. lockfile import FileLock
 
 from .GlycanResource import GlycanResource
+from .GlycanResourceCache import SQLiteCache
 
 class TripleStoreResource(GlycanResource):
 
@@ -26,6 +35,13 @@ class TripleStoreResource(GlycanResource):
 
     endpt: SPARQL query endpoint
     defns: Default accession namespace prefix for URIs
+    threads: Number of concurrent partition queries, default 1 (serial)
+    timeout: Seconds, or (connect, read) seconds, before a concurrent
+             partition query is abandoned and retried, default (10,300)
+    cachebackend: Prefetch cache store, 'sqlite' (default) or 'shelve';
+                  read-only ('r' cachemode) without a cachefile + ".sqlite"
+                  file, an existing shelve cache is used as before
+    cachemaxage: Seconds before a cached (sqlite) query is refetched, default None (never)
 
     Config file provides SPARQL queryies and the names of the methods
     that should be created to access them...
@@ -37,10 +53,14 @@ class TripleStoreResource(GlycanResource):
         self.attr(kw,'defns',default=None)
         self.attr(kw,'endpt',required=True)
         self.attr(kw,'verbose',default=False)
+        self.attr(kw,'threads',default=1)
+        self.attr(kw,'timeout',default=(10,300))
 
         self.attr(kw,'cachefile',default=False)
         self.attr(kw,'usecache',default=False)
         self.attr(kw,'cachemode',default='r')
+        self.attr(kw,'cachebackend',default='sqlite')
+        self.attr(kw,'cachemaxage',default=None)
         self.attr(kw,'prefetch',default=False)
         if not self._prefetch:
             self._usecache = False
@@ -53,10 +73,8 @@ class TripleStoreResource(GlycanResource):
         # register( 'text/plain', ResultParser, 'rdflib.plugins.sparql.results.xmlresults', 'XMLResultParser')
         # register( 'application/sparql-results+xml', ResultParser, 'rdflib.plugins.sparql.results.xmlresults', 'XMLResultParser')
 
-        from rdflib.plugins.stores.sparqlstore import SPARQLStore
-        store = SPARQLStore(self._endpt)
-        store.method = 'POST'
-        self._ts = rdflib.ConjunctiveGraph(store=store)
+        self._ts = self.newgraph()
+        self._local = threading.local()
 
         self._cache = None
 
@@ -71,21 +89,81 @@ class TripleStoreResource(GlycanResource):
             print("TripleStoreResource:prefetch = %s"%(self._prefetch), file=sys.stderr)
             print("TripleStoreResource:usecache = %s"%(self._usecache), file=sys.stderr)
             print("TripleStoreResource:cachemode = %s"%(self._cachemode), file=sys.stderr)
+            print("TripleStoreResource:cachebackend = %s"%(self._cachebackend), file=sys.stderr)
+            print("TripleStoreResource:threads = %s"%(self._threads), file=sys.stderr)
+            print("TripleStoreResource:timeout = %s"%(self._timeout,), file=sys.stderr)
+
+    def newgraph(self):
+        from rdflib.plugins.stores.sparqlstore import SPARQLStore
+        store = SPARQLStore(self._endpt)
+        store.method = 'POST'
+        return rdflib.ConjunctiveGraph(store=store)
+
+    def connection(self):
+        # Each query thread keeps its own keep-alive HTTP session (or,
+        # without requests, its own SPARQL store), as neither is safe
+        # to share between threads.
+        conn = getattr(self._local,'conn',None)
+        if conn is None:
+            if requests is not None:
+                conn = requests.Session()
+                conn.headers['Accept'] = 'application/sparql-results+xml'
+            else:
+                conn = self.newgraph()
+            self._local.conn = conn
+        return conn
+
+    def sessionquery(self,sparql):
+        conn = self.connection()
+        if requests is None:
+            return conn.query(sparql)
+        # A stalled endpoint raises requests.Timeout, retried by queryts
+        response = conn.post(self._endpt,data=dict(query=sparql),timeout=self._timeout)
+        response.raise_for_status()
+        return rdflib.query.Result.parse(io.BytesIO(response.content),format='xml')
 
     def __del__(self):
         if hasattr(self,'_usecache') and self._usecache:
             self.closecache()
 
+    def sqlitecache(self):
+        return (self._cachebackend == 'sqlite')
+
     def opencache(self):
         if self._cachefile:
+            self._cachedirty = {}
+            if self.sqlitecache() and self._cachemode == 'r' and \
+                   not os.path.exists(self._cachefile + ".sqlite"):
+                # Not migrated yet, which needs a writable cache
+                self._cachebackend = 'shelve'
+            if self.sqlitecache():
+                cachefile = self._cachefile + ".sqlite"
+                if self._verbose:
+                    print("Opening cachefile:",cachefile, file=sys.stderr)
+                self._cacheondisk = SQLiteCache(cachefile,mode=self._cachemode,
+                                                maxage=self._cachemaxage)
+                # One-time migration of an existing shelve cache
+                if self._cachemode != 'r' and len(self._cacheondisk) == 0:
+                    self._cacheondisk.importshelve(self._cachefile,verbose=self._verbose)
+                return
             if self._verbose:
                 print("Opening cachefile:",self._cachefile, file=sys.stderr)
             self._cacheondisk = shelve.open(self._cachefile,flag=self._cachemode)
-            self._cachedirty = {}
 
     def writecache(self):
         if not self._cachefile:
             return
+        if self.sqlitecache():
+            # SQLite does its own locking. Each key is one transaction,
+            # not one per row, so readers never see a partly written
+            # query and a large query is not one commit (fsync) per row.
+            for key in self._cache:
+                if self._cachedirty.get(key,False):
+                    if self._verbose:
+                        print("Write key",key,"to cachefile:",self._cachefile, file=sys.stderr)
+                    self._cacheondisk.put(key,self._cache[key])
+                    self._cachedirty[key] = False
+            return
         filelock = FileLock(self._cachefile)
         try:
             filelock.acquire()
@@ -120,7 +198,10 @@ class TripleStoreResource(GlycanResource):
         while response == None and (attempt-1) < self._retries:
             try:
                 attempt += 1
-                response = self._ts.query(sparql)
+                if self._threads > 1:
+                    response = self.sessionquery(sparql)
+                else:
+                    response = self._ts.query(sparql)
             except:
                 traceback.print_exc()
                 delay *= 2
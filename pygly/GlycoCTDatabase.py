@@ -1,5 +1,6 @@
 
-import zipfile, csv, copy
+import zipfile, csv, copy, mmap
+import multiprocessing
 from cStringIO import StringIO
 import traceback
 import sys, os, os.path
@@ -11,33 +12,131 @@ from ElementMass import MonoisotopicElementMass
 from GlyMWFilter import GlyMWFilter
 from GlyCompFilter import GlyCompFilter
 from GlyNLinkedFilter import GlyNLinkedFilter
+from workerpool import windowed
 
 # import time###
 # f = open('parsing_errors.txt','w')
 
+_iter_db = None
+_iter_transform = None
+
+def _iter_init(db, transform):
+    global _iter_db, _iter_transform
+    _iter_db = db
+    _iter_transform = transform
+    # a forked worker's copy of the handle shares its file offset with
+    # the parent's, so open another
+    _iter_db.close()
+
+def _iter_chunk(stems):
+    # (True, records) or (False, traceback): a failure is returned rather
+    # than raised, as an exception that does not unpickle in the parent
+    # leaves the pool waiting for its result forever
+    try:
+        zf = _iter_db.zipfile()
+        result = []
+        for stem in stems:
+            gr = _iter_db._get(zf,stem)
+            if gr is not None and _iter_transform is not None:
+                gr = _iter_transform(gr)
+            result.append(gr)
+    except:
+        return False, traceback.format_exc()
+    return True, result
+
+class MappedFile:
+    """Read-only file over a mmap, with the read() zipfile expects"""
+    def __init__(self,mm):
+        self.mm = mm
+    def read(self,n=-1):
+        if n < 0:
+            n = len(self.mm) - self.mm.tell()
+        return self.mm.read(n)
+    def seek(self,pos,whence=0):
+        self.mm.seek(pos,whence)
+    def tell(self):
+        return self.mm.tell()
+    def close(self):
+        self.mm.close()
+
 class GlycoCTDatabase:
     prefix = ""
     extn = "gct"
     source = ""
-    def __init__(self,filename):
+    def __init__(self,filename,usemmap=False):
         self.filename = filename
         self.name,extn = filename.rsplit('.',1)
         self.name = os.path.split(self.name)[1]
         assert extn == self.extn
         self.fmt = GlycoCTFormat()
+        self.usemmap = usemmap
+        self.zf = None
+        self.mm = None
+        self.stamp = None
+        self.members = None
+        self.stems = None
+    def zipfile(self):
+        # One handle, and a map from accession (without prefix) to its
+        # txt, att and png members, kept while the file is unchanged.
+        # The handle belongs to this process (iterparallel's workers open
+        # their own) and is not thread-safe: use one GlycoCTDatabase per
+        # thread.
+        st = os.stat(self.filename)
+        stamp = (st.st_mtime,st.st_size)
+        if self.zf is not None and stamp == self.stamp:
+            return self.zf
+        self.close()
+        if self.usemmap:
+            f = open(self.filename,'rb')
+            try:
+                self.mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            finally:
+                f.close()
+            self.zf = zipfile.ZipFile(MappedFile(self.mm),"r")
+        else:
+            self.zf = zipfile.ZipFile(self.filename,"r")
+        self.stamp = stamp
+        self.members = {}
+        self.stems = []
+        for name in self.zf.namelist():
+            if '.' not in name:
+                continue
+            stem,extn = name.rsplit('.',1)
+            if extn not in ('txt','att','png'):
+                continue
+            if extn == 'txt':
+                self.stems.append(stem)
+            self.members.setdefault(stem,{})[extn] = name
+        return self.zf
+    def close(self):
+        if self.zf is not None:
+            self.zf.close()
+        if self.mm is not None:
+            self.mm.close()
+        self.zf = None
+        self.mm = None
+        self.stamp = None
+    def __getstate__(self):
+        # handles do not pickle, the copy opens its own when first used
+        state = dict(self.__dict__)
+        state.update(zf=None,mm=None,stamp=None,members=None,stems=None)
+        return state
+    def accessions(self):
+        self.zipfile()
+        return [ self.prefix+stem for stem in self.stems ]
     def getraw(self,accession):
-	zf = zipfile.ZipFile(self.filename, "r")
-	fn = accession[len(self.prefix):]+'.txt'
-	try:
-            zf.getinfo(fn)
-        except KeyError:
+        zf = self.zipfile()
+        name = self.members.get(accession[len(self.prefix):],{}).get('txt')
+        if name is None:
             return None
-	gct = self._getraw(zf,fn)
-	zf.close()
-	return gct
+        return self._getraw(zf,name)
     def _getraw(self,zf,name):
          return zf.read(name)
-    def _get(self,zf,name):
+    def _get(self,zf,stem):
+        members = self.members.get(stem,{})
+        if 'txt' not in members:
+            return None
+        name = members['txt']
         try:
             glystr = self._getraw(zf,name)
             g = self.fmt.toGlycan(glystr)
@@ -49,45 +148,77 @@ class GlycoCTDatabase:
         except:
             print >>sys.stderr, "Problem with GlycoCT file "+name
             # time.sleep(2)###
-            traceback.print_exc()
-            sys.exit(1)
+            raise
 	kwargs = {}
-	try:
-	    attstr = zf.read(name.rsplit('.',1)[0]+'.att')
-	    for r in csv.reader(StringIO(attstr)):
+        if 'att' in members:
+            for r in csv.reader(StringIO(zf.read(members['att']))):
 	        kwargs[r[0]] = copy.copy(r[1:])
-	except KeyError:
-	    pass
-	try:
-	    kwargs['image'] = zf.read(name.rsplit('.',1)[0]+'.png')
-	except KeyError:
-	    pass
+        if 'png' in members:
+	    kwargs['image'] = zf.read(members['png'])
         gr = GlyRecord(source=self.source if self.source else self.name,
-                       accession=self.prefix+name.rsplit('.',1)[0],glycan=g,name=self.name,
+                       accession=self.prefix+stem,glycan=g,name=self.name,
 		       **kwargs)
 	# print gr
 	return gr
     def get(self,accession):
-	zf = zipfile.ZipFile(self.filename, "r")
-	fn = accession[len(self.prefix):]+'.txt'
-	try:
-	    zf.getinfo(fn)
-	except KeyError:
-	    return None
-	gr = self._get(zf,fn)
-	zf.close()
-	return gr
+        zf = self.zipfile()
+	return self._get(zf,accession[len(self.prefix):])
+    def get_many(self,accessions):
+        """
+        Records (or None) for each of accessions, in order. Members are
+        read in archive order, rather than the order of accessions.
+        """
+        zf = self.zipfile()
+        stems = [ acc[len(self.prefix):] for acc in accessions ]
+        def offset(i):
+            name = self.members.get(stems[i],{}).get('txt')
+            return zf.getinfo(name).header_offset if name else -1
+        result = [ None ]*len(stems)
+        for i in sorted(range(len(stems)),key=offset):
+            result[i] = self._get(zf,stems[i])
+        return result
     def __iter__(self):
         return self.next()
     def next(self):
-        zf = zipfile.ZipFile(self.filename, "r")
-        for name in zf.namelist():
-            if not name.endswith('.txt'):
-                continue
-	    gr = self._get(zf,name)
+        zf = self.zipfile()
+        for stem in self.stems:
+	    gr = self._get(zf,stem)
 	    if gr:
 	 	yield gr
-	zf.close()
+    def iterparallel(self,workers=2,transform=None,chunksize=100,window=None):
+        """
+        As iteration, with the members parsed by workers processes,
+        chunksize accessions at a time, and at most window (default
+        4*workers) chunks in flight.
+
+        If transform is given, it is applied to each record, in the
+        workers, and its value yielded instead. Returning records, with
+        their glycans, from the workers costs about as much as parsing
+        them, so this pays off when the work is done by transform.
+        """
+        if workers <= 1:
+            for gr in self:
+                if transform is not None:
+                    gr = transform(gr)
+                yield gr
+            return
+        if window is None:
+            window = 4*workers
+        self.zipfile()
+        stems = list(self.stems)
+        tasks = ((stems[i:i+chunksize],) for i in range(0,len(stems),chunksize))
+        pool = multiprocessing.Pool(workers,_iter_init,(self,transform))
+        results = windowed(pool,_iter_chunk,tasks,window)
+        try:
+            for ok,result in results:
+                if not ok:
+                    raise RuntimeError("Worker failed:\n"+result)
+                for gr in result:
+                    if gr is not None:
+                        yield gr
+        finally:
+            # terminates the pool, if not done
+            results.close()
 
 class GlycomeDBDatabase(GlycoCTDatabase):
     prefix = "GDB"
@@ -1,6 +1,7 @@
 
 from tempfile import mkstemp
 import os,sys,re,os.path,time
+import threading, Queue
 from subprocess import Popen, PIPE, STDOUT
 
 class JavaProgram(object):
@@ -11,12 +12,14 @@ class JavaProgram(object):
 	self.java = 'javaw' if javaw else 'java'
 	self.stdout = stdout
     
-    def __call__(self):
+    def javaexe(self):
 	if 'JAVA_HOME' in os.environ:
 	    prefix = os.environ['JAVA_HOME']
-	    java = os.path.join(prefix,'bin',self.java)
-	else:
-	    java = self.java
+	    return os.path.join(prefix,'bin',self.java)
+	return self.java
+
+    def __call__(self):
+        java = self.javaexe()
         cmd = '"%s" -cp "%s" %s %s'%(java,self.classpath(),self.main,self.args())
         if self.verbose:
             print >>sys.stderr, "Executing:", cmd
@@ -74,7 +77,106 @@ class JavaProgram(object):
             raise RuntimeError("Can't find library %s"%l)
 
         return found_libs
-        
+
+class JavaWorker(JavaProgram):
+    """
+    Long-lived java process which reads requests from stdin and
+    answers each with a single tab-separated status line on stdout.
+    The process is (re)started on demand, so a crashed JVM is replaced
+    by the next request. A JVM that does not answer within timeout
+    seconds is killed, and replaced in the same way.
+    """
+
+    def __init__(self,verbose=False,javaw=(sys.platform=="win32"),timeout=120):
+        super(JavaWorker,self).__init__(verbose=verbose,javaw=javaw)
+        self.proc = None
+        self.lines = None
+        self.timeout = timeout
+        self.restarts = 0
+        self.answered = 0
+
+    def command(self):
+        return [self.javaexe(),'-cp',self.classpath(),self.main] + self.args().split()
+
+    def start(self):
+        cmd = self.command()
+        if self.verbose:
+            print >>sys.stderr, "Starting:", " ".join(cmd)
+        stderr = None
+        if not self.verbose:
+            stderr = open(os.devnull,'w')
+        self.proc = Popen(cmd,stdin=PIPE,stdout=PIPE,stderr=stderr)
+        if stderr != None:
+            stderr.close()
+        # status lines are read by a thread, so a request can time out
+        self.lines = Queue.Queue()
+        reader = threading.Thread(target=self.readlines,args=(self.proc.stdout,self.lines))
+        reader.daemon = True
+        reader.start()
+
+    @staticmethod
+    def readlines(stdout,lines):
+        # lines of one process, then None at EOF
+        try:
+            for line in iter(stdout.readline,''):
+                lines.put(line)
+        except (IOError,OSError,ValueError):
+            pass
+        lines.put(None)
+
+    def alive(self):
+        return (self.proc != None and self.proc.poll() == None)
+
+    def stop(self):
+        if self.proc == None:
+            return
+        try:
+            self.proc.stdin.close()
+            self.proc.wait()
+        except (IOError,OSError):
+            pass
+        self.proc = None
+
+    def kill(self):
+        if self.proc == None:
+            return
+        try:
+            self.proc.kill()
+            self.proc.wait()
+        except (IOError,OSError):
+            pass
+        self.proc = None
+
+    def request(self,header,body,retries=1):
+        # Returns the status line fields, or None if the worker died, or
+        # did not answer in time, on this request each time it was tried.
+        body = body.replace('\r','').rstrip('\n')
+        for attempt in range(retries+1):
+            if not self.alive():
+                if self.proc != None:
+                    self.restarts += 1
+                    self.kill()
+                try:
+                    self.start()
+                except OSError:
+                    # no java executable
+                    return None
+            try:
+                self.proc.stdin.write(header + "\n" + body + "\n//\n")
+                self.proc.stdin.flush()
+                line = self.lines.get(timeout=self.timeout)
+            except (IOError,OSError,Queue.Empty):
+                line = None
+            if line:
+                self.answered += 1
+                return line.rstrip('\n').split('\t')
+            self.restarts += 1
+            self.kill()
+        return None
+
+    def __del__(self):
+        self.stop()
+
 class GlycoCT2Image(JavaProgram):
     libs = """
               GlycoCT2ImageBundle
@@ -100,6 +202,32 @@ class GlycoCT2Image(JavaProgram):
     def stdin(self):
         return self.glycoctstr
 
+class GlycoCT2ImageWorker(JavaWorker):
+    libs = """
+              GlycoCT2ImageBundle
+           """
+    main = "GlycoCT2Image"
+
+    def args(self):
+        return "serve"
+
+    def write(self,glycanstr,outfile,**kw):
+        theargs = []
+        for k,v in kw.items():
+            theargs.append(k)
+            theargs.append(v)
+        theargs.append("out")
+        theargs.append(outfile)
+        status = self.request("\t".join(map(str,theargs)),glycanstr)
+        if status == None:
+            return ("ERROR",outfile,"worker failed")
+        return tuple(status)
+
+    def serves(self):
+        # False if the JVM never answered, such as a GlycoCT2ImageBundle
+        # jar built before the serve mode was added
+        return (self.answered > 0)
+
 class GWBFormatter(JavaProgram):
     libs = """
               GlycoCT2ImageBundle
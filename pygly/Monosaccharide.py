@@ -60,10 +60,37 @@ class Anomer:
     uncyclized = 3
     missing    = None
 
+def _slotnames(cls):
+    names = []
+    for c in reversed(cls.__mro__):
+        names.extend(c.__dict__.get('__slots__',()))
+    return names
+
+def _getstate(obj):
+    # Unset slots are left out, so hasattr works the same after unpickling
+    state = dict()
+    for k in _slotnames(type(obj)):
+        if hasattr(obj,k):
+            state[k] = getattr(obj,k)
+    return state
+
+def _setstate(obj,state):
+    # Also accepts the __dict__ of instances pickled before __slots__
+    slots = set(_slotnames(type(obj)))
+    for k,v in state.items():
+        if k in slots:
+            setattr(obj,k,v)
+
 class Node(object):
 
     # The Node class represents the functionality common to Monosaccaharides and Substituents...
 
+    # Instances are compact, held by the hundred thousand for GlyTouCan
+    __slots__ = ('_links','_parent_links','_connected','_id',
+                 '_external_descriptor',
+                 # Cached by Glycan.subtree_composition
+                 '_elemental_composition','_symbol_composition')
+
     def __init__(self):
 
         # Contains a list of links specifying residues that the monosaccharide is linked to
@@ -84,6 +111,12 @@ class Node(object):
 
         return 
 
+    def __getstate__(self):
+        return _getstate(self)
+
+    def __setstate__(self,state):
+        _setstate(self,state)
+
     def links(self,instantiated_only=True):
         if instantiated_only:
             return list(filter(lambda l: l.instantiated(),self._links))
@@ -184,6 +217,10 @@ class Monosaccharide(Node):
     # Note that we use None to indicate unset or null values
     # throughout. To unset a value, assign None to it.
 
+    __slots__ = ('_anomer','_config','_stem','_superclass',
+                 '_ring_start','_ring_end','_mods',
+                 '_substituent_links','_eid')
+
     def __init__(self):
 
         super(Monosaccharide,self).__init__()
@@ -208,8 +245,9 @@ class Monosaccharide(Node):
         # Ring closure ending position (THE NUMBER OF THE CARBON) (int)
         self._ring_end = None
 
-        # Modifier type (Optional, Repeatable)
-        self._mods = []
+        # Modifier type (Optional, Repeatable), sorted tuple of
+        # (positions,mod) so clones can share it
+        self._mods = ()
 
         # A list of 0 or more links to substituent objects.
         self._substituent_links = []
@@ -218,23 +256,40 @@ class Monosaccharide(Node):
         # Could be used for keeping track of monosaccharide from descriptor assigned ID
         self._eid = None
 
+    def __setstate__(self,state):
+        super(Monosaccharide,self).__setstate__(state)
+        self._mods = tuple(self._mods)
+
     def is_monosaccharide(self):
         return True
 
     def clone(self):
         m = Monosaccharide()
         m._anomer = self._anomer
-        m._config = copy.deepcopy(self._config)
-        m._stem = copy.deepcopy(self._stem)
+        # config, stem and mods are tuples, safe to share
+        m._config = self._config
+        m._stem = self._stem
         m._superclass = self._superclass
         m._ring_start = self._ring_start
         m._ring_end = self._ring_end
-        m._mods = copy.deepcopy(self._mods)
+        m._mods = self._mods
         # m._composition = copy.copy(self._composition)
-        # Will this do it?
-        m._substituent_links = copy.deepcopy(self._substituent_links)
-        for l in m._substituent_links:
-            l.set_parent(m)
+        if all(len(sl.child()._links) == 0 and len(sl.child()._parent_links) == 1
+               for sl in self._substituent_links):
+            for sl in self._substituent_links:
+                s = sl.child().clone()
+                l = sl.clone()
+                l.set_child(s)
+                l.set_parent(m)
+                m.add_substituent_link(l)
+                s.add_parent_link(l)
+        else:
+            # Substituents linked to other residues (or shared). Seed
+            # the memo with the new parent so the copy does not follow
+            # the links' parent reference back into the original structure.
+            m._substituent_links = copy.deepcopy(self._substituent_links,{id(self): m})
+            for l in m._substituent_links:
+                l.set_parent(m)
         # m._links = copy.deepcopy(self._links)
         m._id = self._id
         m._connected = self._connected
@@ -261,7 +316,7 @@ class Monosaccharide(Node):
             else:
                 c = cache[l.child().id()]
                 idlc = None
-            cl = copy.deepcopy(l)
+            cl = l.clone()
             cl.set_child(c)
             cl.set_parent(m)
             m.add_link(cl)
@@ -460,13 +515,11 @@ class Monosaccharide(Node):
             pos = tuple(sorted(map(int,pos.split(','))))
         else:
             pos = (int(pos),)
-        self._mods.append((pos,mod))
-        self._mods = sorted(self._mods)
+        self._mods = tuple(sorted(self._mods + ((pos,mod),)))
 
     def remove_mod(self,mod,pos=None):
-        for i in range(len(self._mods)-1,-1,-1):
-            if (self._mods[i][1]) == mod and (pos == None or self._mods[i][0] == pos):
-                del self._mods[i]
+        self._mods = tuple(m for m in self._mods
+                           if m[1] != mod or (pos != None and m[0] != pos))
 
     def count_mod(self,mod=None):
         count = 0
@@ -476,7 +529,7 @@ class Monosaccharide(Node):
         return count
 
     def clear_mods(self):
-        self._mods = []
+        self._mods = ()
 
     def has_mods(self):
         return len(self._mods) > 0
@@ -491,6 +544,12 @@ class Monosaccharide(Node):
             c.add(comp_table[('Substituent',sub.name())])
         return c
 
+    def composition_signature(self):
+        # everything composition() depends on
+        return ('Monosaccharide',self.superclass(),
+                tuple(sorted(mod for pos,mod in self.mods())),
+                tuple(sorted(sub.name() for sub in self.substituents())))
+
 ##     def set_composition(self,**kw):
 ##         self._composition.update(kw)
 
@@ -667,6 +726,8 @@ class Substituent(Node):
     acetyl_oxygen_lost = 44
     phosphate_bridged = 45
 
+    __slots__ = ('_sub',)
+
     def __init__(self,sub):
 
         super(Substituent,self).__init__()
@@ -676,6 +737,8 @@ class Substituent(Node):
     def clone(self):
         s = Substituent(self.name())
         s.set_id(self.id())
+        s._connected = self._connected
+        s._external_descriptor = self._external_descriptor
         return s
 
     def deepclone(self,identified_link=None,cache=None):
@@ -695,7 +758,7 @@ class Substituent(Node):
             else:
                 c = cache[l.child().id()]
                 idlc = None
-            cl = copy.deepcopy(l)
+            cl = l.clone()
             cl.set_child(c)
             cl.set_parent(m)
             m.add_link(cl)
@@ -721,6 +784,9 @@ class Substituent(Node):
         c.add(comp_table[('Substituent',self.name())])
         return c
 
+    def composition_signature(self):
+        return ('Substituent',self.name())
+
     def __str__(self):
         if self._id:
             return "%s:%s"%(self._id,constantString(Substituent,self._sub))
@@ -734,7 +800,7 @@ class Substituent(Node):
     def fully_determined(self):
         return True
 
-class Linkage:
+class Linkage(object):
 
     # Atom Replacement constants (link types)
     oxygenPreserved     = 1
@@ -746,7 +812,14 @@ class Linkage:
     # Note that we use None to indicate unset values throughout. To
     # unset a value, assign None to it.
 
-    def __init__(self, child,
+    # Link types and positions are frozensets, shared by clones
+    __slots__ = ('_child','_parent','_parent_type','_parent_pos',
+                 '_child_type','_child_pos','_undetermined',
+                 '_instantiated','_id')
+
+    # child defaults to None only so that instances pickled before
+    # Linkage was a new-style class can be loaded
+    def __init__(self, child=None,
                  parent_type=None, parent_pos=None,
                  child_type=None, child_pos=None,
                  parent_type2=None, parent_pos2=None,
@@ -792,6 +865,15 @@ class Linkage:
         self.unset_id()
         self.set_parent(None)
 
+    def __getstate__(self):
+        return _getstate(self)
+
+    def __setstate__(self,state):
+        _setstate(self,state)
+        for k in ('_parent_type','_parent_pos','_child_type','_child_pos'):
+            if getattr(self,k,None) != None:
+                setattr(self,k,frozenset(getattr(self,k)))
+
     def id(self):
         return self._id
 
@@ -811,7 +893,7 @@ class Linkage:
         return l
 
     def clone(self):
-        l = Linkage(child=self.child(),
+        l = self.__class__(child=self.child(),
                     parent_pos=self.parent_pos(),
                     parent_type=self.parent_type(),
                     child_pos=self.child_pos(),
@@ -840,17 +922,19 @@ class Linkage:
     def set_child_type(self, child_type):
         # instance setting 
         if child_type in (1,2,3,4):
-            self._child_type = set([child_type])
+            self._child_type = frozenset([child_type])
+        elif child_type != None:
+            # set of 1,2,3,4 hopefully
+            self._child_type = frozenset(child_type)
         else:
-            # None or set of 1,2,3,4 hopefully
-            self._child_type = child_type
+            self._child_type = None
 
     def set_child_type2(self, child_type):
         if child_type == None:
             return
         assert child_type in (1,2,3,4)
         assert self._child_type
-        self._child_type.add(child_type)
+        self._child_type = self._child_type.union([child_type])
 
     def child_pos(self):
         return self._child_pos
@@ -861,19 +945,19 @@ class Linkage:
             if child_pos == -1:
                 self._child_pos = None
             else:
-                self._child_pos = set([child_pos])
+                self._child_pos = frozenset([child_pos])
         except (ValueError,TypeError):
             if child_pos == None:
                 self._child_pos = None
             else:
-                self._child_pos = set(child_pos)
+                self._child_pos = frozenset(child_pos)
 
     def set_child_pos2(self, child_pos):
         if child_pos == None:
             return
         assert isinstance(child_pos,int)
         assert self._child_pos
-        self._child_pos.add(child_pos)
+        self._child_pos = self._child_pos.union([child_pos])
 
     def parent(self):
         return self._parent
@@ -887,17 +971,19 @@ class Linkage:
     def set_parent_type(self, parent_type):
         if parent_type in (1,2,3,4):
             # instance setting 
-            self._parent_type = set([parent_type])
+            self._parent_type = frozenset([parent_type])
+        elif parent_type != None:
+            # set of 1,2,3,4 hopefully
+            self._parent_type = frozenset(parent_type)
         else:
-            # None or set of 1,2,3,4 hopefully
-            self._parent_type = parent_type
+            self._parent_type = None
 
     def set_parent_type2(self, parent_type):
         if parent_type == None:
             return
         assert parent_type in (1,2,3,4)
         assert self._parent_type
-        self._parent_type.add(parent_type)
+        self._parent_type = self._parent_type.union([parent_type])
 
     def parent_pos(self):
         return self._parent_pos
@@ -908,19 +994,19 @@ class Linkage:
             if parent_pos == -1:
                 self._parent_pos = None
             else:
-                self._parent_pos = set([parent_pos])
+                self._parent_pos = frozenset([parent_pos])
         except (ValueError,TypeError):
             if parent_pos == None:
                 self._parent_pos = None
             else:
-                self._parent_pos = set(parent_pos)
+                self._parent_pos = frozenset(parent_pos)
 
     def set_parent_pos2(self, parent_pos):
         if parent_pos == None:
             return
         assert isinstance(parent_pos,int)
         assert self._parent_pos
-        self._parent_pos.add(parent_pos)
+        self._parent_pos = self._parent_pos.union([parent_pos])
 
     def set_undetermined(self,und):
         self._undetermined = und
@@ -1019,7 +1105,7 @@ class Linkage:
 
 # Should we specialize substituent linkages?
 class SubLinkage(Linkage):
-    pass
+    __slots__ = ()
 
 # This is here to put peptide mass and elemental composition on the same
 # footing as glycans....
@@ -54,36 +54,105 @@ def readconfig(inifilename):
         cfg.readfp(StringIO(u'\n'.join(iniFile)),inifilename)
     return cfg
 
+# Names usable in the WURCS 2.0 ini tables, e.g. Stem.glc or Linkage.oxygenLost
+constant_namespace = dict(Anomer=Anomer, Config=Config, Stem=Stem, SuperClass=SuperClass,
+                          Mod=Mod, Linkage=Linkage, Substituent=Substituent)
+
+def constant(value):
+    try:
+        cls, attr = value.strip().split('.')
+        return getattr(constant_namespace[cls], attr)
+    except (ValueError, KeyError, AttributeError):
+        raise ValueError("Bad constant: %r" % (value,))
+
+class SkeletonCode(object):
+    """Compiled [skeleton code] section of wurcs20_skeleton.ini"""
+    __slots__ = ('code', 'anomer', 'stem', 'config', 'superclass', 'mods')
+
+    def __init__(self, code, cfg):
+        self.code = code
+        self.anomer = None
+        if cfg.has_option(code, "anomer"):
+            self.anomer = constant(cfg.get(code, "anomer"))
+        self.stem = None
+        if cfg.has_option(code, "stem"):
+            self.stem = tuple(map(constant, cfg.get(code, "stem").split()))
+        self.config = None
+        if cfg.has_option(code, "config"):
+            self.config = tuple(map(constant, cfg.get(code, "config").split()))
+        self.superclass = None
+        if cfg.has_option(code, "superclass"):
+            self.superclass = constant(cfg.get(code, "superclass"))
+        self.mods = ()
+        if cfg.has_option(code, "mods"):
+            mods_list = cfg.get(code, "mods").split()
+            self.mods = tuple((mods_list[i], constant(mods_list[i + 1])) for i in range(0, len(mods_list), 2))
+
+class SubstituentCode(object):
+    """Compiled [substituent] section of wurcs20_substituent.ini"""
+    __slots__ = ('name', 'type', 'parent_type', 'child_type', 'child_pos')
+
+    def __init__(self, name, cfg):
+        self.name = name
+        self.type = None
+        if cfg.has_option(name, "type"):
+            self.type = constant(cfg.get(name, "type"))
+        self.parent_type = constant(cfg.get(name, "parent_type"))
+        self.child_type = constant(cfg.get(name, "child_type"))
+        self.child_pos = int(cfg.get(name, "child_pos"))
+
+def compiletable(cfg, cls):
+    table = {}
+    for section in cfg.sections():
+        try:
+            table[section] = cls(section, cfg)
+        except (ValueError, ConfigParser.NoOptionError):
+            # placeholder or incomplete entry, treated as unsupported
+            pass
+    return table
+
+tables = None
+
+def loadtables():
+    # The ini files are parsed and compiled once per process, and
+    # the (read-only) tables shared by all WURCS20MonoFormat instances
+    global tables
+    if tables is None:
+        skelconfig = readconfig('wurcs20_skeleton.ini')
+        subsconfig = readconfig('wurcs20_substituent.ini')
+        tables = (skelconfig, subsconfig,
+                  compiletable(skelconfig, SkeletonCode),
+                  compiletable(subsconfig, SubstituentCode))
+    return tables
+
 class WURCS20MonoFormat:
     mono_pattern = re.compile(
         r"^([0-9a-zA-Z]{3,9})((-\d[abx])(_[0-9?]-[0-9?])?)?((_([0-9?]|[0-9]\|[0-9]|[0-9]-[0-9])(\*[^_]+)?)*)$")
+    anomer_pattern = re.compile(r"^-(\d)(.)$")
+    ring_pattern = re.compile(r"^_(\d|\?)-(\d|\?)$")
+    bridge_pattern = re.compile(r'^\d-\d$')
 
     def __init__(self):
         self.cache = {}
         self.load()
 
     def load(self):
-        self.skelconfig = readconfig('wurcs20_skeleton.ini')
-        self.subsconfig = readconfig('wurcs20_substituent.ini')
+        self.skelconfig, self.subsconfig, self.skeletons, self.substituents = loadtables()
 
-    def getsubst(self,sub_name):
+    def substituent(self, sub_name, sub=None):
         try:
-            sub_type = self.subsconfig.get(sub_name, "type")
-            subst = Substituent(eval(sub_type))
-        except (ConfigParser.NoSectionError, ValueError):
-            raise UnsupportedSubstituentError(sub_name)
-        return subst
-
-    skel_config_get_default_section = ""
+            return self.substituents[sub_name]
+        except KeyError:
+            raise UnsupportedSubstituentError(sub if sub is not None else sub_name)
 
-    def skel_config_get(self, optionx, skelton_code=skel_config_get_default_section):
-        try:
-            return self.skelconfig.get(self.skel_config_get_default_section, optionx)
-        except ConfigParser.NoOptionError:
-            return None
+    def getsubst(self,sub_name):
+        sc = self.substituent(sub_name)
+        if sc.type is None:
+            raise UnsupportedSubstituentError(sub_name)
+        return Substituent(sc.type)
 
     def parsing(self, mono_string):
-        parsed = re.search(self.mono_pattern, mono_string)
+        parsed = self.mono_pattern.search(mono_string)
 
         if not parsed:
             # Bad formatted WURCS mono
@@ -99,51 +168,43 @@ class WURCS20MonoFormat:
         m = Monosaccharide()
         m.set_external_descriptor(skel)
 
-        if skel in self.skelconfig.sections():
-            self.skel_config_get_default_section = skel
-
-            anomer_s = self.skel_config_get("anomer")
-            if anomer_s:
-                m.set_anomer(eval(anomer_s))
-                if m.anomer() == Anomer.uncyclized:
-                    m.set_ring_start(0)
-                    m.set_ring_end(0)
+        try:
+            sk = self.skeletons[skel]
+        except KeyError:
+            # skeleton code not supported
+            raise UnsupportedSkeletonCodeError(skel)
 
-            stem = self.skel_config_get("stem")
-            if stem:
-                m.set_stem(*(map(lambda s: eval(s), stem.split())))
+        if sk.anomer is not None:
+            m.set_anomer(sk.anomer)
+            if m.anomer() == Anomer.uncyclized:
+                m.set_ring_start(0)
+                m.set_ring_end(0)
 
-            config = self.skel_config_get("config")
-            if config:
-                m.set_config(*(map(lambda c: eval(c), config.split())))
-            else:
-                if stem:
-                    m.set_config(*([None] * len(m.stem())))
+        if sk.stem:
+            m.set_stem(*sk.stem)
 
-            if m.stem() and m.config():
-                assert len(m.stem()) == len(m.config()), "Inconsistent config/stem for %s" % (skel,)
-            elif not m.stem():
-                assert not m.config(), "Problem with config/stem for %s"(skel, )
+        if sk.config:
+            m.set_config(*sk.config)
+        else:
+            if sk.stem:
+                m.set_config(*([None] * len(m.stem())))
 
-            superclass = self.skel_config_get("superclass")
-            if superclass:
-                m.set_superclass(eval(superclass))
+        if m.stem() and m.config():
+            assert len(m.stem()) == len(m.config()), "Inconsistent config/stem for %s" % (skel,)
+        elif not m.stem():
+            assert not m.config(), "Problem with config/stem for %s" % (skel,)
 
-            mods = self.skel_config_get("mods")
-            if mods:
-                mods_list = mods.split()
-                for i in range(0, len(mods_list), 2):
-                    m.add_mod(mods_list[i], eval(mods_list[i + 1]))
+        if sk.superclass is not None:
+            m.set_superclass(sk.superclass)
 
-        else:
-            # skeleton code not supported
-            raise UnsupportedSkeletonCodeError(skel)
+        for pos, mod in sk.mods:
+            m.add_mod(pos, mod)
 
         if anomer:
-            match = re.search(r"^-(\d)(.)$", anomer)
+            match = self.anomer_pattern.search(anomer)
             if not match:
                 raise InvalidMonoError(mono_string)
-            if anomer_s and eval(anomer_s) != Anomer.missing:
+            if sk.anomer is not None:
                 raise InvalidMonoError(mono_string)
             if match.group(2) == "a":
                 m.set_anomer(Anomer.alpha)
@@ -155,7 +216,7 @@ class WURCS20MonoFormat:
                 raise InvalidMonoError(mono_string)
 
         if ring:
-            match = re.search(r"^_(\d|\?)-(\d|\?)$", ring)
+            match = self.ring_pattern.search(ring)
             if not match:
                 raise InvalidMonoError(mono_string)
             try:
@@ -180,53 +241,45 @@ class WURCS20MonoFormat:
                     sub_name = "anhydro"
                     # Note, we appear to require \d-\d for sub, otherwise it is a no-op?
                     # cases with \d only do not appear to change the mass...
-                    if not re.search(r'^\d-\d$', sub):
+                    if not self.bridge_pattern.search(sub):
                         raise InvalidMonoError(mono_string)
+                sc = self.substituent(sub_name, sub)
+                if sc.type is None:
+                    raise UnsupportedSubstituentError(sub)
                 try:
-                    sub_type = self.subsconfig.get(sub_name, "type")
-                    pt = self.subsconfig.get(sub_name, "parent_type")
-                    ct = self.subsconfig.get(sub_name, "child_type")
-                    cp = self.subsconfig.get(sub_name, "child_pos")
-                    sub_object = Substituent(eval(sub_type))
+                    sub_object = Substituent(sc.type)
                     sub_object.set_external_descriptor(sub_name)
 
-                    if cp != None:
-                        cp = int(cp)
-
-                    if re.search(r"^\d-\d$", pp) and sub_name != "anhydro":
+                    if self.bridge_pattern.search(pp) and sub_name != "anhydro":
                         for pp in pp.split("-"):
                             pp = int(pp)
-                            m.add_substituent(sub_object, parent_pos=pp, parent_type=eval(pt), child_pos=cp,
-                                              child_type=eval(ct))
+                            m.add_substituent(sub_object, parent_pos=pp, parent_type=sc.parent_type,
+                                              child_pos=sc.child_pos, child_type=sc.child_type)
 
                     elif '|' not in pp and '-' not in pp:
                         if pp == "?" or pp == "-1":
                             pp = -1
                         else:
                             pp = int(pp)
-                        m.add_substituent(sub_object, parent_pos=pp, parent_type=eval(pt), child_pos=cp,
-                                          child_type=eval(ct))
+                        m.add_substituent(sub_object, parent_pos=pp, parent_type=sc.parent_type,
+                                          child_pos=sc.child_pos, child_type=sc.child_type)
                     elif '|' in pp:
                         pp = map(int, pp.split('|'))
-                        m.add_substituent(sub_object, parent_pos=pp, parent_type=eval(pt), child_pos=cp,
-                                          child_type=eval(ct))
+                        m.add_substituent(sub_object, parent_pos=pp, parent_type=sc.parent_type,
+                                          child_pos=sc.child_pos, child_type=sc.child_type)
                     elif '-' in pp and sub_name == "anhydro":
                         pp = map(int, pp.split('-'))
                         if len(pp) != 2:
                             raise UnsupportedSubstituentError(sub)
-                        m.add_substituent(sub_object, parent_pos=pp[0], parent_type=eval(pt),
-                                                  child_pos=cp, child_type=eval(ct)).child()
-                        pt = self.subsconfig.get(sub_name + "1", "parent_type")
-                        ct = self.subsconfig.get(sub_name + "1", "child_type")
-                        cp = self.subsconfig.get(sub_name + "1", "child_pos")
-                        if cp != None:
-                            cp = int(cp)
-                        m.add_substituent(sub_object, parent_pos=pp[1], parent_type=eval(pt), child_pos=cp,
-                                          child_type=eval(ct))
+                        m.add_substituent(sub_object, parent_pos=pp[0], parent_type=sc.parent_type,
+                                          child_pos=sc.child_pos, child_type=sc.child_type)
+                        sc1 = self.substituent(sub_name + "1", sub)
+                        m.add_substituent(sub_object, parent_pos=pp[1], parent_type=sc1.parent_type,
+                                          child_pos=sc1.child_pos, child_type=sc1.child_type)
                     else:
                         raise UnsupportedSubstituentError(sub)
-                except (ConfigParser.NoSectionError, ValueError):
-                    # Substituent not supported or badly formatted
+                except ValueError:
+                    # Substituent badly formatted
                     raise UnsupportedSubstituentError(sub)
 
         return m
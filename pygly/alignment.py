@@ -6,6 +6,8 @@ import inspect
 import sys, os.path
 import time
 import copy
+import hashlib
+import itertools
 from collections import defaultdict
 
 verbose = False
@@ -48,12 +50,35 @@ class Comparitor(object):
     def leq(self,a,b):
         raise NotImplemented()
 
+    # returns a hashable key for a such that eq(a,b) implies key(a) ==
+    # key(b), made only of the properties eq examines. Unequal items
+    # may share a key.
+
+    def key(self,a):
+        raise NotImplemented()
+
+def _canonical(v):
+    # normalize sets and sequences so that equal values have equal reprs
+    if isinstance(v,(set,frozenset)):
+        return tuple(sorted(map(_canonical,v)))
+    if isinstance(v,(list,tuple)):
+        return tuple(map(_canonical,v))
+    if isinstance(v,bool) or v == None:
+        return v
+    if isinstance(v,(int,long)):
+        return int(v)
+    return v
+
 class MonosaccharideComparitor(Comparitor):
     def __init__(self,substcmp=None,sublinkcmp=None,**kw):
         self._substcmp = substcmp
         self._sublinkcmp = sublinkcmp
         super(MonosaccharideComparitor,self).__init__(**kw)
 
+    def substkey(self,a):
+        return tuple(sorted((self._sublinkcmp.key(sl),self._substcmp.key(sl.child()))
+                            for sl in a.substituent_links()))
+
     def substeq(self,a,b):
         return self._substcmp.eq(a,b)
 
@@ -98,6 +123,13 @@ class LinkageComparitor(LinkageComparitorBase):
             lb_upper = b.parent().parent_links()[0]
             return self._sublinkcmp.eq(la_upper, lb_upper) and self._linkcmp.eq(a, b) and self._substcmp.eq(pa, pb)
 
+    def key(self, a):
+        pa = a.parent()
+        if pa.is_monosaccharide():
+            return (True, self._linkcmp.key(a))
+        la_upper = pa.parent_links()[0]
+        return (False, self._sublinkcmp.key(la_upper), self._linkcmp.key(a), self._substcmp.key(pa))
+
     def leq(self, a, b):
         pa = a.parent()
         pb = b.parent()
@@ -129,6 +161,11 @@ def _mindistfromroot(r,d=0,dist=None,instonly=True):
 	    dist.update(_mindistfromroot(ch,d+1,dist,instonly))
     return dist
 
+def _samenode(frozen,a,b):
+    # Nodes of frozen glycans with identical attributes and
+    # substituents are eq (and leq) under any (reflexive) comparator
+    return frozen != None and frozen[0].nodekey(a) == frozen[1].nodekey(b)
+
 class GlycanEquivalence(Comparitor):
 
     ### Assumes glycans have the same topology...
@@ -144,29 +181,29 @@ class GlycanEquivalence(Comparitor):
 	self.bdist = None
         super(GlycanEquivalence,self).__init__(**kw)
 
-    def rootmonoeq(self,a,b):
-        return self._rootmonocmp.eq(a,b)
+    def rootmonoeq(self,a,b,frozen=None):
+        return _samenode(frozen,a,b) or self._rootmonocmp.eq(a,b)
 
-    def monoeq(self,a,b):
-        return self._monocmp.eq(a,b)
+    def monoeq(self,a,b,frozen=None):
+        return _samenode(frozen,a,b) or self._monocmp.eq(a,b)
 
     def linkeq(self,a,b):
         return self._linkcmp.eq(a,b)
 
-    def subtree_eq(self,a,b,root=True,mapids=False):
+    def subtree_eq(self,a,b,root=True,mapids=False,frozen=None):
 
         if root:
-            if not self.rootmonoeq(a,b):
+            if not self.rootmonoeq(a,b,frozen):
                 return False
         else:
-            if not self.monoeq(a,b):
+            if not self.monoeq(a,b,frozen):
                 return False
 
         if mapids:
             b.set_id(a.id())
 
         for ii,jj in itermatchings(a.links(),b.links(),
-                                   lambda i,j: self.linkeq(i,j) and self.subtree_eq(i.child(),j.child(),root=False,mapids=mapids)):
+                                   lambda i,j: self.linkeq(i,j) and self.subtree_eq(i.child(),j.child(),root=False,mapids=mapids,frozen=frozen)):
             return True
 
         if mapids:
@@ -198,21 +235,38 @@ class GlycanEquivalence(Comparitor):
             break
         return child_links_match
 
+    def frozen_monosaccharide_match(self,a,b,frozen):
+
+        # link counts and distances from the root are precomputed
+        if frozen[0].profile(a) != frozen[1].profile(b):
+            return False
+        if not self.monoeq(a,b,frozen):
+            return False
+
+        for ii,jj in itermatchings(a.links(instantiated_only=False),b.links(instantiated_only=False),
+                                   lambda i,j: self.linkeq(i,j) and self.monoeq(i.child(),j.child(),frozen)):
+            return True
+        return False
+
     def eq(self,a,b):
-	
-	self.adist = None
-	self.bdist = None
-      
-        a.set_ids()        
-        b.unset_ids()
+
+        frozen = None
+        if a.frozen() or b.frozen():
+            # ids and distances are fixed, leave them (and self) be
+            a,b = frozen = (a.freeze(),b.freeze())
+        else:
+            self.adist = None
+            self.bdist = None
+            a.set_ids()
+            b.unset_ids()
 
 	lineno()
 
         if a.has_root() and b.has_root():
             if not a.undetermined() and not b.undetermined():
                 # Simple topologically determined glycan
-                return self.subtree_eq(a.root(),b.root(),mapids=True)
-            if not self.subtree_eq(a.root(),b.root(),mapids=False):
+                return self.subtree_eq(a.root(),b.root(),mapids=(not frozen),frozen=frozen)
+            if not self.subtree_eq(a.root(),b.root(),mapids=False,frozen=frozen):
                 # non-composition, but might be undetermined toplogy. Determined part should match.
                 return False
 
@@ -267,12 +321,16 @@ class GlycanEquivalence(Comparitor):
 
 	lineno()
 
-	# compute distances 
-	self.adist = _mindistsfromroot(a.root())
-	self.bdist = _mindistsfromroot(b.root())
+        if frozen:
+            match = lambda x,y: self.frozen_monosaccharide_match(x,y,frozen)
+        else:
+            # compute distances
+            self.adist = _mindistsfromroot(a.root())
+            self.bdist = _mindistsfromroot(b.root())
+            match = self.monosaccharide_match
 
         iters = 0
-        for ii,jj in itergenmatchings(nodeset1, nodeset2, self.monosaccharide_match):
+        for ii,jj in itergenmatchings(nodeset1, nodeset2, match):
 
             iters += 1
             matching = dict(zip(map(lambda m: m.id(),ii),map(lambda m: m.id(),jj)))
@@ -289,15 +347,75 @@ class GlycanEquivalence(Comparitor):
                     break
             if good:
                 # print >>sys.stderr, "%d iterations to find an isomorphism"%(iters,)
-		self.adist = None
-		self.bdist = None
+                if not frozen:
+                    self.adist = None
+                    self.bdist = None
                 return True
 
         lineno()
                 
-	self.adist = None
-	self.bdist = None
+        if not frozen:
+            self.adist = None
+            self.bdist = None
         return False
+
+    def nodekeys(self,g):
+        # bottom-up keys of each monosaccharide: its own key and the
+        # (multiset of) keys of its links and their children.
+        keys = {}
+        def _key(m):
+            if m not in keys:
+                if m.is_monosaccharide():
+                    mkey = self._monocmp.key(m)
+                else:
+                    mkey = (None,m.name())
+                keys[m] = (mkey,tuple(sorted((self._linkcmp.key(l),_key(l.child()))
+                                             for l in m.links(instantiated_only=False))))
+            return keys[m]
+        for m in g.all_nodes(subst=False):
+            _key(m)
+        return keys
+
+    def canonical(self,g):
+        """
+        Canonical form of g, as a string: independent of the order of
+        its links, substituents and node ids, and equal for glycans this
+        comparitor considers equal.
+        """
+        keys = self.nodekeys(g)
+        rootkey = None
+        if g.has_root():
+            rootkey = keys[g.root()]
+        allkeys = sorted(keys[m] for m in g.all_nodes(subst=False))
+        return repr(_canonical((g.has_root(),rootkey,allkeys)))
+
+    def fingerprint(self,g):
+        """
+        Canonical hash of g: glycans this comparitor considers equal
+        always have the same fingerprint. Unequal glycans rarely
+        collide, so equal fingerprints should be confirmed with eq.
+        """
+        return hashlib.md5(self.canonical(g)).hexdigest()
+
+    def classes(self,glycans,fingerprints=None):
+        """
+        Partition glycans into equivalence classes, preserving order.
+        Only glycans with the same fingerprint are compared with eq.
+        """
+        if fingerprints == None:
+            fingerprints = map(self.fingerprint,glycans)
+        buckets = defaultdict(list)
+        classes = []
+        for g,fp in zip(glycans,fingerprints):
+            for cls in buckets[fp]:
+                if self.eq(cls[0],g):
+                    cls.append(g)
+                    break
+            else:
+                cls = [g]
+                buckets[fp].append(cls)
+                classes.append(cls)
+        return classes
         
 class CompositionEquivalence(Comparitor):
 
@@ -353,11 +471,11 @@ class GlycanPartialOrder(Comparitor):
     def topoeq(self,a,b):
         return self._topocmp.eq(a,b)
 
-    def rootmonoleq(self,a,b):
-        return self._rootmonocmp.leq(a,b)
+    def rootmonoleq(self,a,b,frozen=None):
+        return _samenode(frozen,a,b) or self._rootmonocmp.leq(a,b)
 
-    def monoleq(self,a,b):
-        return self._monocmp.leq(a,b)
+    def monoleq(self,a,b,frozen=None):
+        return _samenode(frozen,a,b) or self._monocmp.leq(a,b)
 
     def linkleq(self,a,b):
         return self._linkcmp.leq(a,b)
@@ -383,25 +501,43 @@ class GlycanPartialOrder(Comparitor):
             return False
         return True
 
-    def subtree_leq(self,a,b,root=True):
+    def frozen_monosaccharide_leq(self,a,b,frozen):
+
+        fa,fb = frozen
+        if fa.determined_parent_count(a) < fb.determined_parent_count(b):
+            return False
+        pa,pb = fa.profile(a),fb.profile(b)
+        # parent links, instantiated links, all links, mindist, depth
+        if pa[0] > pb[0] or pa[1] < pb[1] or pa[2] > pb[2]:
+            return False
+        if pa[3] < pb[3] or pa[4] > pb[4]:
+            return False
+        return self.monoleq(a,b,frozen)
+
+    def subtree_leq(self,a,b,root=True,frozen=None):
 
         if root:
-            if not self.rootmonoleq(a,b):
+            if not self.rootmonoleq(a,b,frozen):
                 return False
         else:
-            if not self.monoleq(a,b):
+            if not self.monoleq(a,b,frozen):
                 return False
 
         for ii,jj in itermatchings(a.links(),b.links(),
-                                   lambda i,j: self.linkleq(i,j) and self.subtree_leq(i.child(),j.child(),root=False)):
+                                   lambda i,j: self.linkleq(i,j) and self.subtree_leq(i.child(),j.child(),root=False,frozen=frozen)):
             return True
 
         return False
 
     def leq(self,a,b):
 
-	self.adist = None
-	self.bdist = None
+        frozen = None
+        if a.frozen() or b.frozen():
+            # ids and distances are fixed, leave them (and self) be
+            a,b = frozen = (a.freeze(),b.freeze())
+        else:
+            self.adist = None
+            self.bdist = None
 
         lineno("Start of Subsumption leq")
 
@@ -427,22 +563,26 @@ class GlycanPartialOrder(Comparitor):
 
         if not a.undetermined() and not b.undetermined():
             # Simple topologically determined glycan
-            return self.subtree_leq(a.root(),b.root())
+            return self.subtree_leq(a.root(),b.root(),frozen=frozen)
 
         # at this point at both are rooted and least one is undetermined
 
         a.set_ids()
         b.set_ids()
 
-	self.adist = _mindistsfromroot(a.root())
-	self.bdist = _mindistsfromroot(b.root())
+        if frozen:
+            match = lambda x,y: self.frozen_monosaccharide_leq(x,y,frozen)
+        else:
+            self.adist = _mindistsfromroot(a.root())
+            self.bdist = _mindistsfromroot(b.root())
+            match = self.monosaccharide_leq
 
         lineno()
 
         nodeset1 = list(a.all_nodes(subst=False))
         nodeset2 = list(b.all_nodes(subst=False))
 
-        if not self.rootmonoleq(a.root(),b.root()):
+        if not self.rootmonoleq(a.root(),b.root(),frozen):
             return False
 
         lineno()
@@ -486,7 +626,7 @@ class GlycanPartialOrder(Comparitor):
         lineno()
 
         iters = 0
-        for ii,jj in itergenmatchings(nodeset1, nodeset2, self.monosaccharide_leq):
+        for ii,jj in itergenmatchings(nodeset1, nodeset2, match):
 
             iters += 1
             matching = dict(zip(map(lambda m: m.id(),ii),map(lambda m: m.id(),jj)))
@@ -522,57 +662,90 @@ class GlycanPartialOrder(Comparitor):
 
 
 
+def connected_subsets(r, size):
+    """
+    Sets of size nodes, including r, with every node reachable from r by
+    (possibly uninstantiated) links within the set. Each set is
+    generated exactly once, by extending with one candidate node at a
+    time and excluding it from the sets generated afterwards, so no
+    duplicate checks are needed. Sets are yielded as frozensets.
+    """
+
+    size = int(size)
+    nodes = [r]
+    index = {r: 0}
+    i = 0
+    while i < len(nodes):
+        for l in nodes[i].links(instantiated_only=False):
+            if l.child() not in index:
+                index[l.child()] = len(nodes)
+                nodes.append(l.child())
+        i += 1
+    if size < 1 or size > len(nodes):
+        return
+    children = [ [ index[l.child()] for l in n.links(instantiated_only=False) ] for n in nodes ]
+
+    # node sets are bitmasks over nodes
+    def extend(current, n, ext, extmask, excluded):
+        if n == size:
+            yield current
+            return
+        ext = list(ext)
+        while ext:
+            w = ext.pop()
+            extmask &= ~(1 << w)
+            with_w = current | (1 << w)
+            seen = with_w | excluded | extmask
+            newext = list(ext)
+            newextmask = extmask
+            for c in children[w]:
+                if not (seen >> c) & 1:
+                    seen |= (1 << c)
+                    newext.append(c)
+                    newextmask |= (1 << c)
+            for s in extend(with_w, n+1, newext, newextmask, excluded):
+                yield s
+            excluded |= (1 << w)
+
+    ext = []
+    extmask = 0
+    for c in children[0]:
+        if c != 0 and not (extmask >> c) & 1:
+            ext.append(c)
+            extmask |= (1 << c)
+    for s in extend(1, 1, ext, extmask, 0):
+        yield frozenset(nodes[i] for i in range(len(nodes)) if (s >> i) & 1)
+
 class ConnectedNodesCache:
 
-    def __init__(self):
-        self.data = {}
+    # Connected node sets are kept for the most recent glycan only, and
+    # at most maxsets of them, beyond that they are enumerated on demand.
 
-    def put(self, g):
-        for m in g.all_nodes():
-            self.data[m] = {
-                1: [{m}]
-            }
+    def __init__(self, maxsets=100000):
+        self.maxsets = maxsets
+        self.clear()
 
-    def update_cache(self, m, size):
-
-        if size in self.data[m]:
-            return
-        i = max(self.data[m].keys())
-
-        while i < size:
-            i += 1
-
-            res = []
-            for currentSet in self.data[m][i-1]:
-                for res0 in self.connectedNodesPlusOneSimple(currentSet):
-                    if res0 not in res:
-                        res.append(res0)
-            self.data[m][i] = res
-
-    def connectedNodesPlusOneSimple(self, currentSet):
-        res = []
-        for n in currentSet:
-            res += [x.child() for x in n.links(instantiated_only=False)]
-        children = filter(lambda x:x not in currentSet, res)
-        children = set(children)
-
-        res = []
-        for n in children:
-            res0 = currentSet.copy()
-            res0.add(n)
-            res.append(res0)
-        return res
+    def put(self, g):
+        if g is not self.glycan:
+            self.clear()
+            self.glycan = g
 
     def get(self, m, size):
-        size = int(size)
-        self.update_cache(m, size)
-        return self.data[m][size]
+        key = (m, int(size))
+        if key in self.data:
+            return self.data[key]
+        sets = connected_subsets(m, size)
+        cached = list(itertools.islice(sets, self.maxsets - self.nsets + 1))
+        if self.nsets + len(cached) > self.maxsets:
+            return itertools.chain(cached, sets)
+        self.nsets += len(cached)
+        self.data[key] = cached
+        return cached
 
     def clear(self):
+        self.glycan = None
         self.data = {}
-
-
-
+        self.nsets = 0
 
 
 class SubstructureSearch(GlycanPartialOrder):
@@ -622,64 +795,11 @@ class SubstructureSearch(GlycanPartialOrder):
     def check_links_childlink_count(self, m, tg):
         return True
 
-    # For recursive algorithm
-    def connectedNodesPlusOne(self, currentSet, candidates):
-        res = []
-        for c in candidates:
-            newCurrentSet = currentSet.copy()
-            newCandidatesSet = candidates.copy()
-
-            newCurrentSet.add(c)
-            newCandidatesSet.remove(c)
-
-            issueFlag = False
-            for cl in c.links(instantiated_only=False):
-                toAdd = cl.child()
-                if toAdd in newCurrentSet and toAdd in newCandidatesSet:
-                    issueFlag = True
-                    break
-                else:
-                    newCandidatesSet.add(toAdd)
-            if issueFlag:
-                continue
-
-            r = (newCurrentSet, newCandidatesSet)
-            if r not in res:
-                res.append(r)
-                yield r
-
-    def connectedNodes(self, currentSet, candidates, size):
-        # set, set, int
-        if len(currentSet) == size:
-            yield currentSet
-            raise StopIteration
-        elif len(candidates) == 0:
-            raise StopIteration
-
-        seen = []
-        for newCurrentSet, newCandidatesSet in self.connectedNodesPlusOne(currentSet, candidates):
-            for r in self.connectedNodes(newCurrentSet, newCandidatesSet, size):
-                if r not in seen:
-                    seen.append(r)
-                    yield r
-
-    # Recursive algorithm
-    def allConnectedNodesByRootRecursive(self, r, size):
-        res = []
-        for cn in self.connectedNodes({r},
-                                      set([x.child() for x in r.links(instantiated_only=False)]),
-                                      size):
-            res.append(cn)
-
-        return res
-
-
-
     def allConnectedNodesByRoot(self, r, size):
         if self.connected_nodes_pre_computed:
             return self.nodes_cache.get(r, size)
         else:
-            return self.allConnectedNodesByRootRecursive(r, size)
+            return connected_subsets(r, size)
 
     def subtree_leq(self,m, tg,root=True):
 
@@ -723,6 +843,17 @@ class SubstructureSearch(GlycanPartialOrder):
             if self.rootmonoleq(m.root(), tg_root):
                 potential_TG_root.append(tg_root)
 
+        if self.connected_nodes_pre_computed:
+            # connected node sets are cached per target
+            self.nodes_cache.put(tg)
+
+        return self.leq_roots(m, tg, potential_TG_root, underterminedLinkage)
+
+    def leq_roots(self, m, tg, potential_TG_root, underterminedLinkage=True):
+        # As leq, with the candidate target nodes for the motif root
+        # already determined. The connected nodes cache must already
+        # have been given tg.
+
         # Use subtree algorithm to save runtime
         if not m.undetermined():
             for n in potential_TG_root:
@@ -736,23 +867,11 @@ class SubstructureSearch(GlycanPartialOrder):
         if not underterminedLinkage:
             return False
 
-        if tg.undetermined() and self.connected_nodes_pre_computed:
-            # pre compute the connected node set
-            self.nodes_cache.put(tg)
-
-
-        #i = 0
+        m_nodes = list(m.all_nodes())
         for tg_root in potential_TG_root:
 
-            for tg_nodes in self.allConnectedNodesByRoot(tg_root, len(list(m.all_nodes()))):
-                # print map(lambda x: x.external_descriptor_id(), tg_nodes),map(lambda x: x.external_descriptor_id(), list(m.all_nodes()))
-                #i+=1
-                #j=0
-                for monoset_m, monoset_tg in itergenmatchings(list(m.all_nodes()), tg_nodes, self.monoleq):
-                    # matching = dict(zip(map(lambda m: m.external_descriptor_id(), monoset_m), map(lambda m: m.external_descriptor_id(), monoset_tg)))
-                    # print matching
-                    #j+=1
-                    #print i, j
+            for tg_nodes in self.allConnectedNodesByRoot(tg_root, len(m_nodes)):
+                for monoset_m, monoset_tg in itergenmatchings(m_nodes, tg_nodes, self.monoleq):
                     if self.check_links(m, monoset_m, monoset_tg):
                         return True
 
@@ -959,12 +1078,19 @@ class MonosaccharideEqual(MonosaccharideComparitor):
             return False
         return True
 
+    def key(self,a):
+        return (a._anomer,a._config,a._stem,a._superclass,a._ring_start,a._ring_end,
+                _canonical(a._mods),self.substkey(a))
+
 class MonosaccharideEqualWithWURCSCheck(MonosaccharideEqual):
 
     def eq(self,a,b):
         if a.external_descriptor() != b.external_descriptor():
             return False
         return super(MonosaccharideEqualWithWURCSCheck, self).eq(a, b)
+
+    def key(self,a):
+        return (a.external_descriptor(),super(MonosaccharideEqualWithWURCSCheck, self).key(a))
       
 class MonosaccharideTopoEqual(MonosaccharideComparitor):
 
@@ -992,6 +1118,10 @@ class MonosaccharideTopoEqual(MonosaccharideComparitor):
             return False
         return True
 
+    def key(self,a):
+        return (a._config,a._stem,a._superclass,a._ring_start,a._ring_end,
+                _canonical(a._mods),self.substkey(a))
+
 class MonosaccharideImageEqual(MonosaccharideComparitor):
 
     def eq(self,a,b):
@@ -1010,6 +1140,9 @@ class MonosaccharideImageEqual(MonosaccharideComparitor):
             return False
         return True
 
+    def key(self,a):
+        return (a._stem,a._superclass,_canonical(a._mods),self.substkey(a))
+
 class MonosaccharideSubsumed(MonosaccharideComparitor):
 
     @staticmethod
@@ -1144,7 +1277,7 @@ class MonosaccharideMotifComparisonSubstTolerance(MonosaccharideComparitor):
         if m._ring_end and g._ring_end and m._ring_end != g._ring_end:
             return False
 
-        gmod = copy.deepcopy(g._mods)
+        gmod = list(g._mods)
         for mod in m._mods:
             if mod in gmod:
                 gmod.remove(mod)
@@ -1192,6 +1325,8 @@ class SubstituentEqual(SubstituentComparitor):
 	if a._sub != b._sub:
             return False
         return True
+    def key(self,a):
+        return a._sub
     def leq(self,a,b):
 	if a._sub != b._sub:
             return False
@@ -1203,6 +1338,8 @@ class SubstituentEqualWithWURCSCheck(SubstituentEqual):
         if a.external_descriptor() != b.external_descriptor():
             return False
         return super(SubstituentEqualWithWURCSCheck, self).eq(a, b)
+    def key(self,a):
+        return (a.external_descriptor(),a._sub)
 
 
             
@@ -1219,6 +1356,8 @@ class LinkageEqualSimple(LinkageComparitorBase):
         if a._undetermined != b._undetermined:
             return False
 	return True
+    def key(self,a):
+        return _canonical((a._parent_type,a._child_type,a._child_pos,a._parent_pos,a._undetermined))
 
 class LinkageTopoEqualSimple(LinkageComparitorBase):
     def eq(self,a,b):
@@ -1230,12 +1369,16 @@ class LinkageTopoEqualSimple(LinkageComparitorBase):
         if a._undetermined != b._undetermined:
             return False
 	return True
+    def key(self,a):
+        return _canonical((a._parent_type,a._child_type,a._undetermined))
 
 class LinkageImageEqualSimple(LinkageComparitorBase):
     def eq(self,a,b):
         if a._undetermined != b._undetermined:
             return False
 	return True
+    def key(self,a):
+        return a._undetermined
 
 class LinkageSubsumedSimple(LinkageComparitorBase):
 
@@ -1429,6 +1572,126 @@ class GlycanSubsumption(GlycanPartialOrder):
         kw['monocmp']=MonosaccharideSubsumed(**kw)
         super(GlycanSubsumption,self).__init__(**kw)
 
+class GlycanSubsumptionSignature(object):
+
+    # Cheap glycan invariants which are necessary conditions for
+    # GlycanSubsumption.leq. Computed once per glycan, they can be
+    # used to prove leq(a,b) is impossible without any graph matching.
+
+    def __init__(self,g):
+
+        monos = list(g.all_nodes(subst=False))
+        self.nmono = len(monos)
+
+        # Monosaccharide (superclass, mods) classes and substituent
+        # counts, linked and floating, must be preserved by the
+        # composition partial-order test...
+        self.mods = defaultdict(int)
+        self.monoclass = defaultdict(int)
+        self.subst = defaultdict(int)
+        nmonoall = 0
+        for n in g.all_nodes(subst=False,undet_subst=True):
+            if n.is_monosaccharide():
+                nmonoall += 1
+                mods = tuple(n.mods())
+                self.mods[mods] += 1
+                self.monoclass[(n.superclass(),mods)] += 1
+                for s in n.substituents():
+                    self.subst[s.name()] += 1
+            else:
+                self.subst[n.name()] += 1
+        if nmonoall != self.nmono:
+            # floating substituents with children, be conservative
+            self.mods = None
+            self.monoclass = None
+
+        self.hasroot = g.has_root()
+        self.undetermined = g.undetermined()
+        if not self.hasroot:
+            return
+
+        r = g.root()
+        self.root = (r.anomer(),r.config(),r.stem(),r.superclass(),r.ring_start(),r.ring_end())
+        self.rootmods = tuple(r.mods())
+
+        self.ninst = sum(1 for _ in g.all_links())
+        self.nlinks = sum(1 for _ in g.all_links(uninstantiated=True))
+
+        self.nundet = 0
+        for m in monos:
+            if m == r:
+                continue
+            if any(l.undetermined() for l in m.parent_links()):
+                self.nundet += 1
+
+        # sorted distances from the root, as used by GlycanPartialOrder
+        self.depth = self.depths(r,monos,True)
+        self.depthall = self.depths(r,monos,False)
+
+    @staticmethod
+    def depths(r,monos,instonly):
+        dist = {r: 0}
+        todo = [r]
+        while len(todo) > 0:
+            m = todo.pop(0)
+            for l in m.links(instantiated_only=instonly):
+                ch = l.child()
+                if ch not in dist:
+                    dist[ch] = dist[m] + 1
+                    todo.append(ch)
+        return sorted(dist.get(m,1e+20) for m in monos)
+
+    def excludes(self,other):
+        # True if GlycanSubsumption.leq(a,b) must be False, where self
+        # is the signature of a and other is the signature of b.
+
+        if self.nmono != other.nmono:
+            return True
+        if self.subst != other.subst:
+            return True
+        if self.mods != None and other.mods != None:
+            if self.mods != other.mods:
+                return True
+            for (sc,mods),cnt in other.monoclass.items():
+                if sc != None and cnt > self.monoclass.get((sc,mods),0):
+                    return True
+
+        if not other.hasroot:
+            return False
+        if not self.hasroot:
+            return True
+
+        if self.rootmods != other.rootmods:
+            return True
+        for x,y in zip(self.root,other.root):
+            if not MonosaccharideSubsumed._leq_(x,y):
+                return True
+
+        if not self.undetermined and not other.undetermined:
+            # Both topologically determined, subtree_leq is a tree
+            # isomorphism on instantiated links
+            if self.ninst != other.ninst:
+                return True
+            if self.depth != other.depth:
+                return True
+            return False
+
+        if self.ninst < other.ninst:
+            return True
+        if (self.nlinks - self.ninst) > (other.nlinks - other.ninst):
+            return True
+        if self.nlinks > other.nlinks:
+            return True
+        if self.nundet > other.nundet:
+            return True
+        for d1,d2 in zip(self.depth,other.depth):
+            if d1 > d2:
+                return True
+        for d1,d2 in zip(self.depthall,other.depthall):
+            if d1 < d2:
+                return True
+        return False
+
 class GlycanCompositionSubsumption(CompositionPartialOrder):
     def __init__(self,**kw):
         kw['substcmp']=SubstituentEqual(**kw)
@@ -1502,6 +1765,150 @@ class NonReducingEndMotifInclusive(SubstructureSearchNonReducingEnd):
         super(NonReducingEndMotifInclusive, self).__init__(**kw)
 
 
+def _repeated(g):
+    # not every Glycan implementation knows about repeating units
+    return hasattr(g,'repeated') and g.repeated()
+
+class MotifIndex(object):
+    """
+    Align many motifs against each target glycan in one call. Motifs
+    are compiled once, and per-target work (node lists, monosaccharide
+    class buckets, connected node sets) is shared across motifs and
+    across the inclusive/strict, core/substructure/whole and
+    non-reducing-end alignments. Motifs whose monosaccharide classes
+    cannot be embedded in the target are pruned before any matching.
+
+    >>> index = MotifIndex()
+    >>> index.add("G00026MO",motif)
+    >>> for acc,result in index.alignments(glycan).items():
+    ...     print acc, result
+
+    Each result is a tuple of booleans, in the order of MotifIndex.fields.
+
+    """
+
+    fields = ("Core_Inclusive", "Substructure_Inclusive", "Whole_Inclusive", "Non_Red_Inclusive",
+              "Core_Strict", "Substructure_Strict", "Whole_Strict", "Non_Red_Strict")
+    nomatch = (False,)*8
+
+    def __init__(self, motifs=None):
+        self.nodes_cache = ConnectedNodesCache()
+        self.loose = MotifInclusive(connected_nodes_cache=self.nodes_cache)
+        self.loose_nred = NonReducingEndMotifInclusive(connected_nodes_cache=self.nodes_cache)
+        self.strict = MotifStrict(connected_nodes_cache=self.nodes_cache)
+        self.strict_nred = NonReducingEndMotifStrict(connected_nodes_cache=self.nodes_cache)
+        self.motifs = {}
+        if motifs:
+            for acc,motif in motifs.items():
+                self.add(acc,motif)
+
+    @staticmethod
+    def monoclasses(m):
+        # The motif comparisons require equal superclass, and equal stem
+        # when the motif monosaccharide has one, so these classes bound
+        # the target monosaccharides a motif monosaccharide can match.
+        if m._stem:
+            return [(m._superclass,),(m._superclass,m._stem)]
+        return [(m._superclass,)]
+
+    def add(self, acc, motif):
+        classes = defaultdict(int)
+        nodes = list(motif.all_nodes())
+        for m in nodes:
+            for c in self.monoclasses(m):
+                classes[c] += 1
+        rootclass = None
+        if motif.has_root():
+            rootclass = self.monoclasses(motif.root())[-1]
+        self.motifs[acc] = dict(glycan=motif,
+                                size=len(nodes),
+                                classes=classes,
+                                rootclass=rootclass,
+                                repeated=_repeated(motif))
+
+    def __len__(self):
+        return len(self.motifs)
+
+    def target(self, tg):
+        nodes = list(tg.all_nodes())
+        classes = defaultdict(int)
+        buckets = defaultdict(list)
+        for m in nodes:
+            for c in [(m._superclass,),(m._superclass,m._stem)]:
+                classes[c] += 1
+                buckets[c].append(m)
+        self.nodes_cache.put(tg)
+        return dict(glycan=tg,
+                    root=tg.root(),
+                    size=len(nodes),
+                    classes=classes,
+                    buckets=buckets,
+                    repeated=_repeated(tg))
+
+    def pruned(self, motif, target):
+        if motif['rootclass'] is None:
+            return True
+        if motif['size'] > target['size']:
+            return True
+        for c,count in motif['classes'].items():
+            if count > target['classes'].get(c,0):
+                return True
+        return False
+
+    def alignments(self, tg):
+        result = {}
+        if not tg.has_root():
+            for acc in self.motifs:
+                result[acc] = self.nomatch
+            return result
+        target = self.target(tg)
+        for acc,motif in self.motifs.items():
+            if self.pruned(motif,target):
+                result[acc] = self.nomatch
+            else:
+                result[acc] = self.align(motif,target)
+        return result
+
+    def align(self, motif, target):
+        m = motif['glycan']
+        tg = target['glycan']
+        mroot = m.root()
+
+        # Strict monosaccharide comparison implies inclusive, so strict
+        # root candidates are a subset of the inclusive ones.
+        loose_roots = [ n for n in target['buckets'][motif['rootclass']]
+                        if self.loose.rootmonoleq(mroot,n) ]
+        loose_core_roots = [ n for n in loose_roots if n == target['root'] ]
+        loose_other_roots = [ n for n in loose_roots if n != target['root'] ]
+
+        loose_core = self.loose.leq_roots(m, tg, loose_core_roots, True)
+        loose_substructure_partial = False
+        if not loose_core:
+            loose_substructure_partial = self.loose.leq_roots(m, tg, loose_other_roots, True)
+        loose_substructure = loose_core or loose_substructure_partial
+        loose_whole = loose_core and motif['size'] == target['size']
+
+        loose_nred = False
+        if loose_substructure and not motif['repeated'] and not target['repeated']:
+            loose_nred = self.loose_nred.leq_roots(m, tg, loose_roots, True)
+
+        strict_core, strict_substructure_partial, strict_nred = False, False, False
+        if loose_substructure:
+            strict_roots = [ n for n in loose_roots if self.strict.rootmonoleq(mroot,n) ]
+            if loose_core:
+                strict_core = self.strict.leq_roots(m, tg, [ n for n in strict_roots if n == target['root'] ], False)
+            if loose_substructure_partial and not strict_core:
+                strict_substructure_partial = self.strict.leq_roots(m, tg, [ n for n in strict_roots if n != target['root'] ], False)
+        strict_substructure = strict_core or strict_substructure_partial
+        strict_whole = strict_core and motif['size'] == target['size']
+
+        if loose_nred and strict_substructure:
+            strict_nred = self.strict_nred.leq_roots(m, tg, strict_roots, False)
+
+        return (loose_core, loose_substructure, loose_whole, loose_nred,
+                strict_core, strict_substructure, strict_whole, strict_nred)
+
+
 
 
 
@@ -234,6 +234,66 @@ def product(*args,**kw):
         l0 = l1
     return l0
 
+def _maxmatching(rows,adj):
+    """
+
+    Size of a maximum bipartite matching (Hopcroft-Karp) of rows to
+    columns, adj maps each row to its candidate columns.
+
+    """
+    matchrow = {}
+    matchcol = {}
+    size = 0
+    # greedy start, often already maximum
+    for r in rows:
+        for c in adj[r]:
+            if c not in matchcol:
+                matchrow[r] = c
+                matchcol[c] = r
+                size += 1
+                break
+    if size == len(rows):
+        return size
+    while True:
+        # layer the rows by alternating path length from the free rows
+        dist = {}
+        queue = []
+        for r in rows:
+            if r not in matchrow:
+                dist[r] = 0
+                queue.append(r)
+        found = False
+        qi = 0
+        while qi < len(queue):
+            r = queue[qi]
+            qi += 1
+            for c in adj[r]:
+                r2 = matchcol.get(c)
+                if r2 is None:
+                    found = True
+                elif r2 not in dist:
+                    dist[r2] = dist[r] + 1
+                    queue.append(r2)
+        if not found:
+            return size
+
+        def augment(r):
+            for c in adj[r]:
+                r2 = matchcol.get(c)
+                if r2 is None or (dist.get(r2) == dist[r] + 1 and augment(r2)):
+                    matchrow[r] = c
+                    matchcol[c] = r
+                    return True
+            dist[r] = None
+            return False
+
+        for r in rows:
+            if r not in matchrow and augment(r):
+                size += 1
+
+def _perfectmatching(domains):
+    return (_maxmatching(list(domains),domains) == len(domains))
+
 def itermatchings(items1,items2,matchtest):
     eq = dict()
     list1 = list(items1)
@@ -242,25 +302,66 @@ def itermatchings(items1,items2,matchtest):
     n2 = len(list2)
 
     if n1 != n2:
-        raise StopIteration
+        return
 
-    for inds in itertools.permutations(range(n2)):
-        badmatch = False
-        for ai,bi in zip(range(n1),inds):
-            if (ai,bi) in eq:
-                if not eq[(ai,bi)]:
-                    badmatch = True
-                    break
-            else:
-                a = list1[ai]; b = list2[bi]
-                if not matchtest(a,b):
-                    eq[(ai,bi)] = False
-                    badmatch = True
-                    break
+    if n1 <= 3:
+        # few enough permutations to just try them all
+        for inds in itertools.permutations(range(n2)):
+            badmatch = False
+            for ai,bi in zip(range(n1),inds):
+                if (ai,bi) in eq:
+                    if not eq[(ai,bi)]:
+                        badmatch = True
+                        break
                 else:
-                    eq[(ai,bi)] = True
-        if not badmatch:
+                    a = list1[ai]; b = list2[bi]
+                    if not matchtest(a,b):
+                        eq[(ai,bi)] = False
+                        badmatch = True
+                        break
+                    else:
+                        eq[(ai,bi)] = True
+            if not badmatch:
+                yield list1,list(map(list2.__getitem__,inds))
+        return
+
+    # Depth-first over the permutations in itertools.permutations order,
+    # testing pairs lazily. Prefixes that cannot be completed, given the
+    # pairs already known not to match, are skipped, so matchtest is
+    # only called on pairs the full enumeration would have tested.
+
+    nomatch = [0]
+    def test(ai,bi):
+        if (ai,bi) not in eq:
+            eq[(ai,bi)] = bool(matchtest(list1[ai],list2[bi]))
+            if not eq[(ai,bi)]:
+                nomatch[0] += 1
+        return eq[(ai,bi)]
+
+    def feasible(ai,free):
+        adj = dict()
+        for a in range(ai,n1):
+            adj[a] = [ b for b in free if eq.get((a,b)) != False ]
+        return _perfectmatching(adj)
+
+    inds = []
+    def extend(ai,free,checked):
+        if ai == n1:
             yield list1,list(map(list2.__getitem__,inds))
+            return
+        if nomatch[0] > checked and n1 - ai > 2:
+            checked = nomatch[0]
+            if not feasible(ai,free):
+                return
+        for bi in sorted(free):
+            if test(ai,bi):
+                inds.append(bi)
+                for m in extend(ai+1,free-set([bi]),checked):
+                    yield m
+                inds.pop()
+
+    for m in extend(0,set(range(n2)),0):
+        yield m
 
 def iterplacements(items1,items2):
     list1 = list(items1)
@@ -340,7 +441,6 @@ def iterecmatchings(items1,items2,matchtest):
         found = False
         for i in ec1:
             # print i,j,
-            sys.stdout.flush()
             if matchtest(list1[i],list2[j]):
                 # print "match"
                 # sys.stdout.flush()
@@ -373,9 +473,38 @@ def iterecmatchings(items1,items2,matchtest):
     yield list(map(lambda t: list1[t[0]],anypairs)),list(map(lambda t: list2[t[1]],anypairs)) 
     
     for mp in itertools.product(*args):
-        pairs = reduce(lambda a,b: list(a) + list(b), mp)
+        pairs = list(itertools.chain.from_iterable(mp))
         yield list(map(lambda t: list1[t[0]],pairs)),list(map(lambda t: list2[t[1]],pairs))
 
+def _assign(pairs,domains,forced):
+    # Assign the forced (i,j) pairs, removing their j's from the
+    # remaining domains, and assign any i left with a single candidate
+    # in turn. None if some i is left without candidates.
+    domains = dict(domains)
+    assigned = dict()
+    while len(forced) > 0:
+        columns = set()
+        for i,j in forced:
+            if i not in domains:
+                if assigned.get(i) == j:
+                    continue
+                return None
+            if j not in domains[i] or j in columns:
+                return None
+            del domains[i]
+            assigned[i] = j
+            columns.add(j)
+        forced = []
+        for k,d in list(domains.items()):
+            if not d.isdisjoint(columns):
+                d = d - columns
+                if len(d) == 0:
+                    return None
+                domains[k] = d
+                if len(d) == 1:
+                    forced.append((k,next(iter(d))))
+    return pairs + list(assigned.items()),domains
+
 def itergenmatchings(items1,items2,matchtest):
 
     list1 = list(items1)
@@ -384,7 +513,7 @@ def itergenmatchings(items1,items2,matchtest):
     n2 = len(list2)
 
     if n1 != n2:
-        raise StopIteration
+        return
 
     edges = defaultdict(set)
     inedges = defaultdict(set)
@@ -397,65 +526,42 @@ def itergenmatchings(items1,items2,matchtest):
     # for i in edges:
     #     print "%s:"%i," ".join(map(str,sorted(edges[i])))
 
-    outdegree = defaultdict(int)
-    indegree = defaultdict(int)
-    for i in range(n1):
-        outdegree[i] = len(edges[i])
-    for j in range(n2):
-        indegree[j] = len(inedges[j])
+    # Each partial solution is the pairs chosen so far and the remaining
+    # candidates (domain) of each unassigned item of list1. Partial
+    # solutions are only kept if a perfect matching of the remaining
+    # items is still possible.
 
-    startpairs = []
-    outdegreezero = 0
+    domains = dict()
+    forced = []
     for i in range(n1):
-        if outdegree[i] == 0:
-            raise StopIteration
-        if outdegree[i] == 1:
-            j = next(iter(edges[i]))
-            startpairs.append((i,j))
-    
-    indegreezero = 0
+        domains[i] = frozenset(edges[i])
+        if len(edges[i]) == 1:
+            forced.append((i,next(iter(edges[i]))))
     for j in range(n2):
-        if indegree[j] == 0:
-            raise StopIteration
-        if indegree[j] == 1:
-            i = next(iter(inedges[j]))
-            startpairs.append((i,j))
-
-    startpairs = list(set(startpairs))
+        if len(inedges[j]) == 1:
+            forced.append((next(iter(inedges[j])),j))
 
-    # print startpairs
-
-    if len(startpairs) != len(set(map(itemgetter(0),startpairs))):
-        raise StopIteration
-    if len(startpairs) != len(set(map(itemgetter(1),startpairs))):
-        raise StopIteration
-
-    startn1set = set(range(n1)) - set(map(itemgetter(0),startpairs))
-    startn2set = set(range(n2)) - set(map(itemgetter(1),startpairs))
-
-    # print startn1set,startn2set
-
-    if len(startn1set) == 0:
-        l1 = map(lambda t: list1[t[0]],startpairs)
-        l2 = map(lambda t: list2[t[1]],startpairs)
-        yield list(l1),list(l2)
+    start = _assign([],domains,forced)
+    if start is None or not _perfectmatching(start[1]):
+        return
 
-    start = (startpairs,startn1set,startn2set)
     partialsolutions = [start]
     while len(partialsolutions) > 0:
-        pairs,tochoose1,tochoose2 = partialsolutions.pop()
-        # print pairs,tochoose1,tochoose2
-        if len(tochoose1) == 0:
-            assert len(tochoose2) == 0
+        pairs,domains = partialsolutions.pop()
+        if len(domains) == 0:
             l1 = map(lambda t: list1[t[0]],pairs)
             l2 = map(lambda t: list2[t[1]],pairs)
             yield list(l1),list(l2)
-        else:
-            i1 = sorted(tochoose1,key=outdegree.get)[0]
-            newtochoose1 = set(filter(lambda i: i != i1,tochoose1))
-            for i2 in (edges[i1]&tochoose2):
-                newtochoose2 = set(filter(lambda i: i != i2,tochoose2))
-                partialsolutions.append((pairs+[(i1,i2)],newtochoose1,newtochoose2))
+            continue
+        i1 = min(domains,key=lambda i: (len(domains[i]),i))
+        for i2 in sorted(domains[i1],reverse=True):
+            partial = _assign(pairs,domains,[(i1,i2)])
+            if partial is None:
+                continue
+            # with two or fewer left, _assign has already decided
+            if len(partial[1]) > 2 and not _perfectmatching(partial[1]):
+                continue
+            partialsolutions.append(partial)
 
 def itergenmaximalmatchings(items1,items2,matchtest):
 
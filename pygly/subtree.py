@@ -1,5 +1,5 @@
 from combinatorics import select
-import sys, traceback
+import sys, traceback, hashlib
 from MonoFormatter import LinCodeSym, IUPACSym
 from collections import defaultdict
 from CompositionTable import ResidueCompositionTable
@@ -191,6 +191,29 @@ class iupacSubtreeEquals(subtreeEquals):
     def linkEqual(self,l1,l2):
         return True
 
+    def treekey(self,r):
+        # links are ignored and children unordered, as in compare_
+        return "%s(%s)"%(self.fmt.toStr(r),
+                         ",".join(sorted(self.treekey(l.child()) for l in r.links())))
+
+    def fingerprint(self,G):
+        # compare(G1,G2) implies fingerprint(G1) == fingerprint(G2), so
+        # glycans need only be compared within a fingerprint. None if G
+        # cannot compare equal to any glycan.
+        try:
+            if not G.undetermined():
+                return hashlib.md5(self.treekey(G.root())).hexdigest()
+            keys = set()
+            for Gi in G.instantiations():
+                keys.add(self.treekey(Gi.root()))
+                if len(keys) > 1:
+                    return None
+        except:
+            return None
+        if len(keys) != 1:
+            return None
+        return hashlib.md5(keys.pop()).hexdigest()
+
 class stringentSubtreeEquals(subtreeEquals):
 
     def nodeEqual(self,n1,n2,root,vo):
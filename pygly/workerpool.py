@@ -0,0 +1,32 @@
+
+from collections import deque
+
+def windowed(pool, func, tasks, window):
+    """
+    Apply func to each argument tuple of tasks in the multiprocessing
+    pool, with at most window tasks in flight, and yield the results in
+    task order, so tasks can be streamed from a large source.
+
+    A task's exception is raised here. The pool is closed once all tasks
+    are done, terminated if a task fails or the consumer stops early,
+    and joined either way.
+    """
+    tasks = iter(tasks)
+    inflight = deque()
+    try:
+        while True:
+            while len(inflight) < window:
+                try:
+                    args = tasks.next()
+                except StopIteration:
+                    break
+                inflight.append(pool.apply_async(func, args))
+            if len(inflight) == 0:
+                break
+            yield inflight.popleft().get()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
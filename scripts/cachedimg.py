@@ -0,0 +1,47 @@
+#!/bin/env python27
+import sys, os, os.path
+import findpygly
+from pygly.GlycanImage import GlycanImage
+
+if len(sys.argv) <= 2:
+    print >>sys.stderr, "cachedimg.py [ image options ] <outdir> <glycan1.seq> [ <glycan2.seq> ... ]"
+    print >>sys.stderr, """
+    Images are named by a hash of the glycan and the image options, and
+    only rendered if not already in <outdir>. The accession (file name
+    without extension) to image hash mapping is kept in manifest.tsv.
+
+    Image options:
+    scale        <float>                               [1.0]
+    reducing_end (true|false)                          [true]
+    orientation  (RL|LR|TB|BT)                         [RL]
+    notation     (snfg|cfg|cfgbw|cfglink|uoxf|text|uoxfcol) [snfg]
+    display      (normal|normalinfo|compact)           [normalinfo]
+    format       (png|svg)                             [png]
+    workers      <int>                                 [2]
+    manifest     <file>                                [<outdir>/manifest.tsv]
+    """.strip()
+    sys.exit(1)
+
+imageWriter = GlycanImage()
+imageWriter.workers(2)
+manifest = None
+args = sys.argv[1:]
+while len(args) > 2 and (args[0] == "manifest" or hasattr(imageWriter,args[0])):
+    key,value = args[:2]
+    args = args[2:]
+    if key == "manifest":
+        manifest = value
+        continue
+    imageWriter.set(key,value)
+
+outdir = args[0]
+if not os.path.isdir(outdir):
+    os.makedirs(outdir)
+
+def images():
+    for filename in args[1:]:
+        acc = os.path.splitext(os.path.basename(filename))[0]
+        yield acc, open(filename).read()
+
+counts = imageWriter.writeCachedImages(images(),outdir,manifest)
+print >>sys.stderr, "%(cached)d cached, %(rendered)d rendered, %(failed)d failed"%counts
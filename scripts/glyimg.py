@@ -13,6 +13,7 @@ if len(sys.argv) <= 1:
     orientation  (RL|LR|TB|BT)                         [RL]
     notation     (cfg|cfgbw|cfglink|uoxf|text|uoxfcol) [cfg]
     display      (normal|normalinfo|compact)           [normalinfo]
+    workers      <int>                                 [1]
     """.strip()
     sys.exit(1)
 
@@ -28,7 +29,12 @@ for i in range(1,len(sys.argv),2):
     imageWriter.set(key,value)
     lastopt = i+1
 
-for acc in sys.argv[(lastopt+1):]:
-    outfile = acc + ".png"
-    g = gtc.getGlycan(acc)
-    imageWriter.writeImage(g,outfile)
+def images():
+    for acc in sys.argv[(lastopt+1):]:
+        g = gtc.getGlycan(acc)
+        if g:
+            yield g, acc + ".png"
+
+for status in imageWriter.writeImages(images()):
+    if status[0] == "ERROR":
+        print >>sys.stderr, "\t".join(status)
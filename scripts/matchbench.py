@@ -0,0 +1,85 @@
+#!/bin/env python27
+import sys, time, random
+import findpygly
+from pygly.GlycanFormatter import WURCS20Format
+from pygly.alignment import GlycanEqual, GlycanSubsumption, MotifInclusive
+
+if len(sys.argv) > 1 and sys.argv[1] in ("-h","--help"):
+    print >>sys.stderr, "matchbench.py [ <accession-wurcs.tsv> [ <npairs> ] ]"
+    print >>sys.stderr, """
+    Micro-benchmark of the matching generators (combinatorics) as used
+    by Glycan.equals, GlycanEqual.eq, GlycanSubsumption.leq and
+    MotifInclusive.leq, over pairs of GlyTouCan structures with the
+    same number of monosaccharides. Structures are read from a
+    tab-separated accession, WURCS file, or fetched from GlyTouCan.
+    Also checks that Glycan.equals gives the same answer when either or
+    both glycans are frozen, and leaves frozen node ids alone.
+    """.strip()
+    sys.exit(1)
+
+npairs = 2000
+if len(sys.argv) > 2:
+    npairs = int(sys.argv[2])
+
+def sequences():
+    if len(sys.argv) > 1:
+        for l in open(sys.argv[1]):
+            sl = l.split()
+            if len(sl) >= 2:
+                yield sl[0],sl[-1]
+    else:
+        from pygly.GlycanResource.GlyTouCan import GlyTouCanNoCache
+        for acc,fmt,seq in GlyTouCanNoCache().allseq(format="wurcs"):
+            yield acc,seq
+
+wp = WURCS20Format()
+bysize = {}
+for acc,seq in sequences():
+    try:
+        # parsed twice, so identical pairs are not the same object
+        g1 = wp.toGlycan(seq)
+        g2 = wp.toGlycan(seq)
+    except:
+        continue
+    bysize.setdefault(len(list(g1.all_nodes())),[]).append((acc,g1,g2))
+    if sum(map(len,bysize.values())) >= 5*npairs:
+        break
+
+random.seed(0)
+pairs = []
+sizes = [ s for s in bysize if len(bysize[s]) > 1 ]
+while len(pairs) < npairs and len(sizes) > 0:
+    s = random.choice(sizes)
+    (acc1,g1,g1a),(acc2,g2,g2a) = random.sample(bysize[s],2)
+    pairs.append((g1,g2))
+    pairs.append((g1,g1a))
+
+def frozenids(fg):
+    return [ m.id() for m in fg.nodes() ] == range(1,len(fg.nodes())+1)
+
+for a,b in pairs:
+    fa,fb = a.freeze(),b.freeze()
+    expected = a.equals(b)
+    assert a.equals(fb) == expected, "plain.equals(frozen)"
+    assert fa.equals(b) == expected, "frozen.equals(plain)"
+    assert fa.equals(fb) == expected, "frozen.equals(frozen)"
+    assert frozenids(fa) and frozenids(fb), "frozen ids changed"
+
+glyeq = GlycanEqual()
+glyleq = GlycanSubsumption()
+motif = MotifInclusive()
+
+tests = [("Glycan.equals", lambda a,b: a.equals(b)),
+         ("GlycanEqual.eq", glyeq.eq),
+         ("GlycanSubsumption.leq", glyleq.leq),
+         ("MotifInclusive.leq", motif.leq)]
+
+print "%d pairs, frozen and plain Glycan.equals agree"%(len(pairs),)
+for name,test in tests:
+    start = time.time()
+    ntrue = 0
+    for a,b in pairs:
+        if test(a,b):
+            ntrue += 1
+    elapsed = time.time() - start
+    print "%-22s %6d true %8.3f sec %8.1f usec/pair"%(name,ntrue,elapsed,1e6*elapsed/len(pairs))
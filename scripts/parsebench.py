@@ -0,0 +1,63 @@
+#!/bin/env python27
+import sys, time
+import findpygly
+from pygly.GlycanFormatter import WURCS20Format, parse_many
+
+if len(sys.argv) > 1 and sys.argv[1] in ("-h","--help"):
+    print >>sys.stderr, "parsebench.py [ <accession-wurcs.tsv> [ <repeats> [ <workers> ] ] ]"
+    print >>sys.stderr, """
+    Parse-throughput benchmark of WURCS20Format.toGlycan over a WURCS
+    dump. Structures are read from a tab-separated accession, WURCS
+    file, or fetched from GlyTouCan. Reports the one-time cost of
+    constructing the parser, first pass (empty residue cache) and
+    repeated pass throughput, and the throughput of parse_many with
+    the given number of worker processes.
+    """.strip()
+    sys.exit(1)
+
+repeats = 3
+if len(sys.argv) > 2:
+    repeats = int(sys.argv[2])
+
+workers = 1
+if len(sys.argv) > 3:
+    workers = int(sys.argv[3])
+
+def sequences():
+    if len(sys.argv) > 1:
+        for l in open(sys.argv[1]):
+            sl = l.split()
+            if len(sl) >= 2:
+                yield sl[0],sl[-1]
+    else:
+        from pygly.GlycanResource.GlyTouCan import GlyTouCanNoCache
+        for acc,fmt,seq in GlyTouCanNoCache().allseq(format="wurcs"):
+            yield acc,seq
+
+accseqs = list(sequences())
+seqs = [ seq for acc,seq in accseqs ]
+
+start = time.time()
+wp = WURCS20Format()
+elapsed = time.time() - start
+print "%d sequences"%(len(seqs),)
+print "%-12s %8.3f sec"%("constructor",elapsed)
+
+for rep in range(repeats+1):
+    start = time.time()
+    nbad = 0
+    for seq in seqs:
+        try:
+            wp.toGlycan(seq)
+        except:
+            nbad += 1
+    elapsed = time.time() - start
+    print "%-12s %6d bad %8.3f sec %8.1f seq/sec"%(("first pass" if rep == 0 else "pass %d"%(rep,)),nbad,elapsed,len(seqs)/elapsed)
+
+start = time.time()
+nbad = 0
+for acc,g in parse_many(accseqs,workers=workers):
+    if not g:
+        nbad += 1
+elapsed = time.time() - start
+print "%-12s %6d bad %8.3f sec %8.1f seq/sec"%("parse_many/%d"%(workers,),nbad,elapsed,len(seqs)/elapsed)
@@ -2,55 +2,49 @@
 import os
 import sys
 import time
+import heapq
+import hashlib
+import multiprocessing
 import findpygly
 import pygly.alignment
 from pygly.GlycanFormatter import GlycoCTFormat, WURCS20Format
 from pygly.GlycanResource.GlyTouCan import GlyTouCanNoCache
 from pygly.GlycanResource.GlyCosmos import GlyCosmosNoCache
 from getwiki import GlycoMotifWiki
-w = GlycoMotifWiki()
+
+# computealignments.py [ <output.tsv> [ <workdir> [ <processes> [ <shards> ] ] ] ]
+#
+# GlyTouCan structures are split into shards by accession, shards are
+# aligned in a process pool and each shard's sorted rows written to
+# <workdir> as soon as it finishes. Completed shards are recorded in
+# <workdir>/checkpoint.tsv, with a digest of the shard's structures and
+# the motifs, so a rerun only recomputes missing or changed shards. The
+# shard files are merged into the final (sorted) alignments file.
 
 if len(sys.argv) > 1:
     res_file_path = sys.argv[1] # "../data/motif_alignments.tsv"
 else:
     res_file_path = None
 
-wp = WURCS20Format()
-gp = GlycoCTFormat()
-gtc = GlyTouCanNoCache()
-
-nodes_cache = pygly.alignment.ConnectedNodesCache()
-
-loose_matcher = pygly.alignment.MotifInclusive(connected_nodes_cache=nodes_cache)
-loose_nred_matcher = pygly.alignment.NonReducingEndMotifInclusive(connected_nodes_cache=nodes_cache)
-
-strict_matcher = pygly.alignment.MotifStrict(connected_nodes_cache=nodes_cache)
-strict_nred_matcher = pygly.alignment.NonReducingEndMotifStrict(connected_nodes_cache=nodes_cache)
-
-
-motif_gobjs = {}
-for m in w.itermotif():
-
-    acc = m.get("glytoucan")
-    if acc in motif_gobjs:
-        continue
-
-    try:
-        motif_gobjs[acc] = wp.toGlycan(str(m.get("wurcs")))
-    except:
+if len(sys.argv) > 2:
+    workdir = sys.argv[2]
+else:
+    workdir = (res_file_path or "motif_alignments.tsv") + ".shards"
 
-        try:
-            motif_gobjs[acc] = gp.toGlycan(m.get("glycoct"))
-        except:
-            continue
+if len(sys.argv) > 3:
+    processes = int(sys.argv[3])
+else:
+    processes = multiprocessing.cpu_count()
 
-archived = set()
-gco = GlyCosmosNoCache()
-for acc in gco.archived():
-    acc = acc["accession"]
-    archived.add(acc)
+if len(sys.argv) > 4:
+    nshards = int(sys.argv[4])
+else:
+    nshards = 256
 
+header = "Motif\tStructure\tCore_Inclusive\tSubstructure_Inclusive\tWhole_Inclusive\tNon_Red_Inclusive\tCore_Strict\tSubstructure_Strict\tWhole_Strict\tNon_Red_Strict\n"
 
+wp = WURCS20Format()
+gp = GlycoCTFormat()
 
 def secondtostr(i):
     i = int(i)
@@ -68,106 +62,151 @@ def secondtostr(i):
 
     return "%sh:%sm" % (h, m)
 
-# f1 = open("tmp.txt", "w")
-result = []
-i, l, lastper = 0.0, len(list(gtc.allseq(format="wurcs"))) / 100.0, 0
-
-
-start_ts = time.time()
-motif_accs = motif_gobjs.keys()
-
-for glycan_acc, f, s in gtc.allseq(format="wurcs"):
-    i += 1
-    per = i / l
-
-    if glycan_acc in archived:
-        continue
-
-    nodes_cache.clear()
-    try:
-        glycan_obj = wp.toGlycan(s)
-    except:
-        continue
-
-    if per > lastper:
-        lastper += 0.1
-        lapsed = time.time() - start_ts
-        print >> sys.stderr, "%0.2f Percent finished after %s, estimate %s remaining" % (per, secondtostr(lapsed), secondtostr(lapsed/per*(100-per)))
+def shardof(acc):
+    # stable across runs, so new accessions only change their own shard
+    return int(hashlib.md5(acc).hexdigest()[:8], 16) % nshards
 
+def shardfile(shard):
+    return os.path.join(workdir, "shard-%05d.tsv" % shard)
 
-    for motif_acc in motif_accs:
-        motif_gobj = motif_gobjs[motif_acc]
+def checkpointfile():
+    return os.path.join(workdir, "checkpoint.tsv")
 
-        # Loose match first
-        loose_core = loose_matcher.leq(motif_gobj, glycan_obj, rootOnly=True, anywhereExceptRoot=False, underterminedLinkage=True)
-        loose_substructure_partial = False
-        if not loose_core:
-            loose_substructure_partial = loose_matcher.leq(motif_gobj, glycan_obj, rootOnly=False, anywhereExceptRoot=True, underterminedLinkage=True)
+def readcheckpoint():
+    done = {}
+    if os.path.exists(checkpointfile()):
+        for l in open(checkpointfile()):
+            sl = l.split()
+            if len(sl) == 2:
+                done[int(sl[0])] = sl[1]
+    return done
 
-        loose_substructure = loose_core or loose_substructure_partial
+motif_index = None
 
-        loose_whole = False
-        if loose_core and loose_matcher.whole_glycan_match_check(motif_gobj, glycan_obj):
-            loose_whole = True
+def alignshard(args):
+    shard, digest, structures = args
 
-        loose_nred = False
-        if not motif_gobj.repeated() and not glycan_obj.repeated() and loose_substructure:
-            loose_nred = loose_nred_matcher.leq(motif_gobj, glycan_obj, underterminedLinkage=True)
+    result = []
+    for glycan_acc, s in structures:
 
-
-        # if inclusive, then try to match strict
-        strict_core, strict_substructure_partial, strict_whole, strict_nred = False, False, False, False
-        if loose_core:
-            strict_core = strict_matcher.leq(motif_gobj, glycan_obj, rootOnly=True, anywhereExceptRoot=False, underterminedLinkage=False)
-
-        if loose_substructure_partial:
-            if not strict_core:
-                strict_substructure_partial = strict_matcher.leq(motif_gobj, glycan_obj, rootOnly=False, anywhereExceptRoot=True, underterminedLinkage=False)
-
-        if strict_core and strict_matcher.whole_glycan_match_check(motif_gobj, glycan_obj):
-            strict_whole = True
-
-        strict_substructure = strict_core or strict_substructure_partial
-
-        if loose_nred and strict_substructure:
-            strict_nred = strict_nred_matcher.leq(motif_gobj, glycan_obj, underterminedLinkage=False)
-
-
-
-        res0 = [loose_core, loose_substructure, loose_whole, loose_nred,
-                strict_core, strict_substructure, strict_whole, strict_nred]
-
-        if True not in res0:
+        try:
+            glycan_obj = wp.toGlycan(s)
+        except:
             continue
 
-        res0 = map(lambda x: "Y" if x else "N", res0)
-
-        line = "\t".join([motif_acc, glycan_acc] + res0)
-
-        # f1.write(line + "\n")
-        result.append(line)
-
-result = sorted(result)
-if res_file_path:
-    result_file = open(res_file_path, "w")
-else:
-    result_file = sys.stdout
-result_file.write("Motif\tStructure\tCore_Inclusive\tSubstructure_Inclusive\tWhole_Inclusive\tNon_Red_Inclusive\tCore_Strict\tSubstructure_Strict\tWhole_Strict\tNon_Red_Strict\n")
-result_file.write("\n".join(result))
-if res_file_path:
-    result_file.close()
-
-
-
+        for motif_acc, res0 in motif_index.alignments(glycan_obj).items():
 
+            if True not in res0:
+                continue
 
+            res0 = map(lambda x: "Y" if x else "N", res0)
 
+            line = "\t".join([motif_acc, glycan_acc] + res0)
 
+            result.append(line)
 
+    result.sort()
+    filename = shardfile(shard)
+    wh = open(filename + ".partial", "w")
+    for line in result:
+        wh.write(line + "\n")
+    wh.close()
+    os.rename(filename + ".partial", filename)
+    return shard, digest
 
+def shardlines(shard):
+    for l in open(shardfile(shard)):
+        yield l.rstrip("\n")
 
+if __name__ == "__main__":
 
+    w = GlycoMotifWiki()
+    gtc = GlyTouCanNoCache()
 
+    motif_gobjs = {}
+    motif_seqs = {}
+    for m in w.itermotif():
 
+        acc = m.get("glytoucan")
+        if acc in motif_gobjs:
+            continue
 
+        try:
+            motif_seqs[acc] = str(m.get("wurcs"))
+            motif_gobjs[acc] = wp.toGlycan(motif_seqs[acc])
+        except:
 
+            try:
+                motif_seqs[acc] = m.get("glycoct")
+                motif_gobjs[acc] = gp.toGlycan(motif_seqs[acc])
+            except:
+                del motif_seqs[acc]
+                continue
+
+    archived = set()
+    gco = GlyCosmosNoCache()
+    for acc in gco.archived():
+        acc = acc["accession"]
+        archived.add(acc)
+
+    motif_digest = hashlib.md5()
+    for acc in sorted(motif_seqs):
+        motif_digest.update("%s\t%s\n" % (acc, motif_seqs[acc]))
+
+    shards = [[] for i in range(nshards)]
+    for glycan_acc, f, s in gtc.allseq(format="wurcs"):
+        if glycan_acc in archived:
+            continue
+        shards[shardof(glycan_acc)].append((glycan_acc, s))
+
+    digests = []
+    for shard in range(nshards):
+        shards[shard].sort()
+        digest = motif_digest.copy()
+        for glycan_acc, s in shards[shard]:
+            digest.update("%s\t%s\n" % (glycan_acc, s))
+        digests.append(digest.hexdigest())
+
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    done = readcheckpoint()
+    todo = []
+    for shard in range(nshards):
+        if done.get(shard) == digests[shard] and os.path.exists(shardfile(shard)):
+            continue
+        todo.append((shard, digests[shard], shards[shard]))
+    print >> sys.stderr, "%d of %d shards already aligned" % (nshards - len(todo), nshards)
+
+    # Workers inherit the motif index from this process
+    motif_index = pygly.alignment.MotifIndex(motif_gobjs)
+
+    start_ts = time.time()
+    if len(todo) > 0:
+        pool = multiprocessing.Pool(processes)
+        checkpoint = open(checkpointfile(), "a")
+        for i, (shard, digest) in enumerate(pool.imap_unordered(alignshard, todo)):
+            checkpoint.write("%d\t%s\n" % (shard, digest))
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+            per = 100.0 * (i + 1) / len(todo)
+            lapsed = time.time() - start_ts
+            print >> sys.stderr, "%0.2f Percent finished after %s, estimate %s remaining" % (per, secondtostr(lapsed), secondtostr(lapsed/per*(100-per)))
+        checkpoint.close()
+        pool.close()
+        pool.join()
+
+    if res_file_path:
+        result_file = open(res_file_path + ".partial", "w")
+    else:
+        result_file = sys.stdout
+    result_file.write(header)
+    first = True
+    for line in heapq.merge(*[shardlines(shard) for shard in range(nshards)]):
+        if not first:
+            result_file.write("\n")
+        result_file.write(line)
+        first = False
+    if res_file_path:
+        result_file.close()
+        os.rename(res_file_path + ".partial", res_file_path)
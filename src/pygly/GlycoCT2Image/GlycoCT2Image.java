@@ -6,6 +6,10 @@ import java.io.FileInputStream;
 import java.io.OutputStream;
 import java.io.FileOutputStream;
 import java.io.BufferedInputStream;
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.io.FileDescriptor;
 import java.io.IOException;
 import javax.imageio.ImageIO;
 import java.awt.image.BufferedImage;
@@ -141,7 +145,7 @@ public class GlycoCT2Image
 		}
 	}
 
-	public static void main(String[] args) throws Exception
+	private static class Renderer
 	{
 		// GlycanWorkspace -> BuilderWorkspace: different constructor
 		GlycanRendererAWT t_grawt = new GlycanRendererAWT();
@@ -153,56 +157,151 @@ public class GlycoCT2Image
 		MassOptions mo = new MassOptions();
 		boolean mass_opts=false;
 
-		setNotation(t_gwb,"cfg");
-		setDisplay(t_gwb,"normalinfo");
-		setOrientation(t_gwb,"RL");
-		String imagefmt = "png";
-		double scale=4.0;
-		boolean reducing_end=true;
-		boolean opaque=true;
-		boolean force=false;
-		String outDir = "";
-		String outFile = "";
+		String imagefmt;
+		double scale;
+		boolean reducing_end;
+		boolean opaque;
+		boolean force;
 
-		for (int i=0; i<args.length; i+=1) {
+		Renderer() {
+			reset();
+		}
 
-			if (args[i].equals("format") && args.length > (i+1)) {
-				imagefmt = args[i+1];
-				i += 1;
-				continue;
+		void reset() {
+			setNotation(t_gwb,"cfg");
+			setDisplay(t_gwb,"normalinfo");
+			setOrientation(t_gwb,"RL");
+			imagefmt = "png";
+			scale=4.0;
+			reducing_end=true;
+			opaque=true;
+			force=false;
+		}
+
+		boolean setOption(String key, String value) {
+			if (key.equals("format")) {
+				imagefmt = value;
+			} else if (key.equals("scale")) {
+				scale = Double.parseDouble(value);
+			} else if (key.equals("redend")) {
+				reducing_end = Boolean.parseBoolean(value);
+			} else if (key.equals("orient")) {
+				setOrientation(t_gwb,value);
+			} else if (key.equals("notation")) {
+				setNotation(t_gwb,value);
+			} else if (key.equals("display")) {
+				setDisplay(t_gwb,value);
+			} else if (key.equals("opaque")) {
+				opaque = Boolean.parseBoolean(value);
+			} else if (key.equals("force")) {
+				force = Boolean.parseBoolean(value);
+			} else {
+				return false;
 			}
-			if (args[i].equals("scale") && args.length > (i+1)) {
-				scale = Double.parseDouble(args[i+1]);
-				i += 1;
-				continue;
+			return true;
+		}
+
+		// Returns false if the image exists already and force is not set
+		boolean render(String glycanstr, String outFile) throws GlycanException, IOException {
+			File outputfile = new File(outFile);
+			if (!force && outputfile.exists()) {
+				return false;
 			}
-			if (args[i].equals("redend") && args.length > (i+1)) {
-				reducing_end = Boolean.parseBoolean(args[i+1]);
-				i += 1;
-				continue;
+
+			Glycan glycan;
+			if (glycanstr.startsWith("WURCS")) {
+				try {
+					glycan = wparser.readGlycan(glycanstr, mo);
+				} catch (Exception ex) {
+					throw new GlycanException(ex.getMessage());
+				}
+			} else if (glycanstr.startsWith("RES")) {
+				try {
+					glycan = parser.readGlycan(glycanstr, mo);
+				} catch (Exception ex) {
+					throw new GlycanException(ex.getMessage());
+				}
+			} else {
+				throw new IllegalArgumentException("Bad glycan descriptor!");
 			}
-			if (args[i].equals("orient") && args.length > (i+1)) {
-				setOrientation(t_gwb,args[i+1]);
-				i += 1;
-				continue;
+
+			if (imagefmt.equalsIgnoreCase("png") || imagefmt.equalsIgnoreCase("jpg") || imagefmt.equalsIgnoreCase("jpeg")) {
+				BufferedImage img = t_gwb.getGlycanRenderer().getImage(glycan, opaque, mass_opts, reducing_end, scale);
+				ImageIO.write(img, imagefmt, outputfile);
+			} else if (imagefmt.equalsIgnoreCase("svg")) {
+				String t_svg = SVGUtils.getVectorGraphics(t_grawt, new Union<Glycan>(glycan), mass_opts, reducing_end);
+				FileWriter outputfilewriter = new FileWriter(outFile);
+				outputfilewriter.write(t_svg);
+				outputfilewriter.close();
+			} else {
+				throw new IllegalArgumentException("Image format " + imagefmt + " is not supported");
 			}
-			if (args[i].equals("notation") && args.length > (i+1)) {
-				setNotation(t_gwb,args[i+1]);
-				i += 1;
+			return true;
+		}
+	}
+
+	// Persistent worker mode: each request is a header line of
+	// tab-separated option/value pairs (including out), then the
+	// glycan, then a line containing just "//". Each request gets one
+	// status line: OK, SKIP (exists), or ERROR, then the output file.
+	private static void serve(Renderer renderer) throws IOException
+	{
+		// Keep anything the libraries print away from the status lines
+		PrintStream status = new PrintStream(new FileOutputStream(FileDescriptor.out), true);
+		System.setOut(System.err);
+
+		BufferedReader in = new BufferedReader(new InputStreamReader(System.in));
+		String header;
+		while ((header = in.readLine()) != null) {
+			if (header.length() == 0) {
 				continue;
 			}
-			if (args[i].equals("display") && args.length > (i+1)) {
-				setDisplay(t_gwb,args[i+1]);
-				i += 1;
-				continue;
+			StringBuilder glycanstr = new StringBuilder();
+			String line;
+			while ((line = in.readLine()) != null && !line.equals("//")) {
+				glycanstr.append(line).append("\n");
 			}
-			if (args[i].equals("opaque") && args.length > (i+1)) {
-				opaque = Boolean.parseBoolean(args[i+1]);
-				i += 1;
-				continue;
+
+			String outFile = "";
+			try {
+				renderer.reset();
+				String[] opts = header.split("\t");
+				for (int i=0; i+1<opts.length; i+=2) {
+					if (opts[i].equals("out")) {
+						outFile = opts[i+1];
+					} else if (!renderer.setOption(opts[i],opts[i+1])) {
+						throw new IllegalArgumentException("Bad option " + opts[i]);
+					}
+				}
+				if (outFile.equals("")) {
+					throw new IllegalArgumentException("No output file");
+				}
+				if (renderer.render(glycanstr.toString(),outFile)) {
+					status.println("OK\t" + outFile);
+				} else {
+					status.println("SKIP\t" + outFile);
+				}
+			}
+			catch (Throwable ex) {
+				status.println("ERROR\t" + outFile + "\t" + String.valueOf(ex.getMessage()).replace('\n',' ').replace('\t',' '));
+			}
+		}
+	}
+
+	public static void main(String[] args) throws Exception
+	{
+		Renderer renderer = new Renderer();
+
+		String outDir = "";
+		String outFile = "";
+
+		for (int i=0; i<args.length; i+=1) {
+
+			if (args[i].equals("serve")) {
+				serve(renderer);
+				return;
 			}
-			if (args[i].equals("force") && args.length > (i+1)) {
-				force = Boolean.parseBoolean(args[i+1]);
+			if (args.length > (i+1) && renderer.setOption(args[i],args[i+1])) {
 				i += 1;
 				continue;
 			}
@@ -220,55 +319,19 @@ public class GlycoCT2Image
 			String glycanstr = readFileAsString(args[i]);
 			if (outFile.equals("")) {
 			    if (outDir.equals("")) {
-				outFile = changeExtn(args[i],imagefmt);
+				outFile = changeExtn(args[i],renderer.imagefmt);
 			    } else {
                                 File f = new File(args[i]);
 			        String name = f.getName();
-			        String newname = changeExtn(name,imagefmt);
+			        String newname = changeExtn(name,renderer.imagefmt);
 				outFile = outDir + File.separator + newname;
 			    }
 			}
 
 			try {
-                            File outputfile = new File(outFile);
-			    if (force || !outputfile.exists()) {
-
-			    Glycan glycan;
-			    if (glycanstr.startsWith("WURCS")) {
-				try {
-			            glycan = wparser.readGlycan(glycanstr, mo);
-				} catch (Exception ex) {
-				    throw new GlycanException(ex.getMessage());
-				}
-			    } else if (glycanstr.startsWith("RES")) {
-				try {
-			            glycan = parser.readGlycan(glycanstr, mo);
-				} catch (Exception ex) {
-				    throw new GlycanException(ex.getMessage());
-				}
-			    } else {
-			        throw new IllegalArgumentException("Bad glycan descriptor!");
-			    }
-
-			    if (imagefmt.equalsIgnoreCase("png") || imagefmt.equalsIgnoreCase("jpg") || imagefmt.equalsIgnoreCase("jpeg")) {
-			        BufferedImage img = t_gwb.getGlycanRenderer().getImage(glycan, opaque, mass_opts, reducing_end, scale);
-                                ImageIO.write(img, imagefmt, outputfile);
+			    if (renderer.render(glycanstr,outFile)) {
 				System.out.println(args[i]);
 			    }
-			    else if (imagefmt.equalsIgnoreCase("svg")) {
-
-                    String t_svg = SVGUtils.getVectorGraphics(t_grawt, new Union<Glycan>(glycan), mass_opts, reducing_end);
-
-                    FileWriter outputfilewriter = new FileWriter(outFile);
-                    outputfilewriter.write(t_svg);
-                    outputfilewriter.close();
-				System.out.println(args[i]);
-			    }
-			    else {
-			        throw new IllegalArgumentException("Image format " + imagefmt + " is not supported");
-			    }
-			    }
-
 			}
 			catch (GlycanException ex) {
 				System.out.println(args[i] + ": " + ex.getMessage());